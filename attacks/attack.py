@@ -31,22 +31,33 @@ if __name__ == '__main__':
     parser.add_argument('attack_name', choices=['TokPair', 'RangeBRC', 'SRC'])
     parser.add_argument('db_file', nargs='?', default=None)
     parser.add_argument('output_file_path', nargs='?', default='output.csv')
+    parser.add_argument('--trace', default=None, metavar='TRACE_FILE',
+                        help='attack a leakage trace written by generate_trace.py instead of a database')
     args = parser.parse_args()
 
-    print("Loading database...")
-    db = None
-    if args.db_file:
-        with open(args.db_file, "rb") as fp:
-            db = pickle.load(fp)
-
-    print("Attacking...")
-
-    if args.attack_name == "TokPair":
-        attacks.tokenpairattack.attack(args.attack_name, db, args.output_file_path)
-    elif args.attack_name == "RangeBRC":
-        attacks.brc_attack.attack(args.attack_name, db, args.output_file_path)
-    elif args.attack_name == "SRC":
-        srcortools.attack(args.output_file_path, db)
-
+    if args.trace:
+        print("Attacking trace...")
+        if args.attack_name == "TokPair":
+            attacks.tokenpairattack.attack_trace(args.attack_name, args.trace, args.output_file_path)
+        elif args.attack_name == "RangeBRC":
+            attacks.brc_attack.attack_trace(args.attack_name, args.trace, args.output_file_path)
+        elif args.attack_name == "SRC":
+            srcortools.attack_trace(args.output_file_path, args.trace)
     else:
-        print("I don't know this attack")
+        print("Loading database...")
+        db = None
+        if args.db_file:
+            with open(args.db_file, "rb") as fp:
+                db = pickle.load(fp)
+
+        print("Attacking...")
+
+        if args.attack_name == "TokPair":
+            attacks.tokenpairattack.attack(args.attack_name, db, args.output_file_path)
+        elif args.attack_name == "RangeBRC":
+            attacks.brc_attack.attack(args.attack_name, db, args.output_file_path)
+        elif args.attack_name == "SRC":
+            srcortools.attack(args.output_file_path, db)
+
+        else:
+            print("I don't know this attack")
@@ -15,22 +15,22 @@
 ## limitations under the License.
 ##
 from ers.structures.point import Point
-from ers.structures.range_tree import RangeTree
+from ers.structures.point_array import PointArray
+from ers.structures.implicit_range_tree import ImplicitRangeTree, brc_range_cover_arrays
+from ers.structures.columnar_multimap import take_slices
+from attacks.range_leakage import RangeLeakage
+from ers.schemes.common.leakage_trace import LeakageTrace
+from attacks.graph import CSRGraph, build_csr_adjacency, grid_graph_to_arr
 from typing import *
 
 import numpy as np
-import networkx as nx
 from matplotlib import cm
-from tqdm import tqdm, trange
+from tqdm import tqdm
 import matplotlib.pyplot as plt
-from collections import defaultdict
 from matplotlib.ticker import LinearLocator
 
 import multiprocessing
-import functools
-import itertools
 import time
-import math
 import csv
 
 
@@ -89,72 +89,91 @@ def draw_vol_arr(arr, name:str):
 def next_power_of_2(x):  
     return 2**(x - 1).bit_length()
 
-def draw_brc_graph(G, edge_counts, interior):
-    color_map = []
-    for node in G:
-        if node in interior:
-            color_map.append("red")
-        else:
-            color_map.append("#A0CBE2")
-
-    edge_map = []
-    for edge in G.edges:
-        if edge_counts[frozenset(edge)] == 1:
-            edge_map.append("red")
-        elif edge_counts[frozenset(edge)] == 2:
-            edge_map.append("blue")
-        else:
-            edge_map.append("black")
-
-    pos = nx.kamada_kawai_layout(G)
-    labels = nx.get_node_attributes(G, "range_cover")
-    nx.draw(G, pos, node_color=color_map, edge_color=edge_map, labels=labels, font_color="black", font_size=10)
-    plt.show()
-
+def draw_brc_graph(G, edge_hits, interior, leakage):
+    # networkx is only needed for this debugging plot:
+    import networkx as nx
 
-def grid_graph_to_arr(G, corners, bound_x, bound_y):
-    bl = corners[0]
-    tr = corners[1]
-    tl = corners[2]
-    br = corners[3]
+    graph = nx.Graph()
+    graph.add_nodes_from(G.nodes().tolist())
+    for edge in G.edge_ids().tolist():
+        hits = edge_hits[edge] if edge < len(edge_hits) else 0
+        graph.add_edge(*G.edges[edge].tolist(), color={1: "red", 2: "blue"}.get(hits, "black"))
 
-    arr = np.zeros((bound_x, bound_y))
-    
-    bottom_axis = nx.shortest_path(G, source=bl, target=br)
-    top_axis = nx.shortest_path(G, source=tl, target=tr)
+    color_map = ["red" if interior[node] else "#A0CBE2" for node in graph]
+    edge_map = [graph.edges[edge]["color"] for edge in graph.edges]
+    labels = {node: (leakage.token(node),) for node in graph}
 
-    i = 0
-    for bot, top in zip(bottom_axis, top_axis):
-        arr[:, i] = list(map(lambda node: G.nodes[node]["volume"], nx.shortest_path(G, source=bot, target=top)))
-        i += 1
+    pos = nx.kamada_kawai_layout(graph)
+    nx.draw(graph, pos, node_color=color_map, edge_color=edge_map, labels=labels, font_color="black", font_size=10)
+    plt.show()
 
-    return arr
 
+# Read-only state of the Q_process workers. It is installed by
+# init_q_worker when the pool starts; forked workers share the arrays
+# with the parent instead of receiving them with every task, and only the
+# slices a chunk of queries needs are turned into Python lists.
+_q_state = None
+
+def init_q_worker(indptr, neighbors, edge_ids, query_offsets, query_tokens):
+    global _q_state
+    _q_state = (indptr, neighbors, edge_ids, query_offsets, query_tokens)
+
+def Q_process(span):
+    """
+    Processes the queries with indices in [start, end). Returns the interior
+    token ids, the ids of the edges to remove and the ids of the edges that
+    lie along a block slice (once per query they appear in).
+    """
+    start, end = span
+    indptr, neighbors, edge_ids, query_offsets, query_tokens = _q_state
+
+    offsets = query_offsets[start:end + 1].tolist()
+    chunk_tokens = query_tokens[offsets[0]:offsets[-1]]
+    tokens = chunk_tokens.tolist()
+    base = offsets[0]
+
+    # The adjacency of the tokens of this chunk only, indexed locally:
+    chunk_nodes = np.unique(chunk_tokens)
+    local = dict(zip(chunk_nodes.tolist(), range(len(chunk_nodes))))
+    chunk_neighbors, chunk_indptr = take_slices(neighbors, indptr, chunk_nodes)
+    chunk_edge_ids, _ = take_slices(edge_ids, indptr, chunk_nodes)
+    chunk_neighbors = chunk_neighbors.tolist()
+    chunk_edge_ids = chunk_edge_ids.tolist()
+    chunk_indptr = chunk_indptr.tolist()
 
-def Q_process(the_input):
-    S, E = the_input
+    interior = set()
+    edges_to_remove = set()
+    to_add = []
+    for lo, hi in zip(offsets, offsets[1:]):
+        S = tokens[lo - base:hi - base]
+        members = set(S)
 
-    query_edges = set(filter(lambda edge: edge[0] in S and edge[1] in S, E))
-    query_G = nx.Graph()
-    query_G.add_edges_from(query_edges)
+        # The induced subgraph of the query, from the neighbors of its tokens:
+        degree = {}
+        query_edges = []
+        for u in S:
+            i = local[u]
+            for k in range(chunk_indptr[i], chunk_indptr[i + 1]):
+                v = chunk_neighbors[k]
+                if v in members:
+                    degree[u] = degree.get(u, 0) + 1
+                    if u < v:
+                        query_edges.append((chunk_edge_ids[k], u, v))
 
-    min_degree_node = min(query_G.nodes, key=lambda x: query_G.degree[x])
-    min_degree = query_G.degree[min_degree_node]
-    corners = set(filter(lambda x: query_G.degree[x] == min_degree, query_G.nodes))
+        min_degree = min(degree.values())
+        corners = {u for u, d in degree.items() if d == min_degree}
 
-    # Remove the corners and add them to I:
-    I = S.difference(corners)
+        # Remove the corners and add them to I:
+        interior.update(members.difference(corners))
 
-    # Remove all edges between the interior nodes:
-    edges_to_remove = list(filter(lambda edge: edge[0] not in corners and edge[1] not in corners, query_edges))
+        # Remove all edges between the interior nodes:
+        edges_to_remove.update(e for e, u, v in query_edges if u not in corners and v not in corners)
 
-    # Look at all edges that are along the same block slice:
-    to_add = []
-    if len(corners) == 2:
-        for edge in query_edges:
-            to_add.append(frozenset(edge))
+        # Look at all edges that are along the same block slice:
+        if len(corners) == 2:
+            to_add.extend(e for e, _, _ in query_edges)
 
-    return (I, edges_to_remove, to_add)
+    return (interior, edges_to_remove, to_add)
 
 def range_tree_brc_reconstruction_attack(db: Multimap, bound_x, bound_y, output_file_path):
     dataset = np.ones((bound_x, bound_y), dtype=int)
@@ -162,130 +181,80 @@ def range_tree_brc_reconstruction_attack(db: Multimap, bound_x, bound_y, output_
         dataset[tup[0], tup[1]] = db[tup]
     print(dataset)
 
-    prefix_sums = np.cumsum(np.cumsum(dataset, axis=0), axis=1) # Sum over rows
-
-    # Generate range tree:
-    x_tree_height = math.ceil(math.log2(bound_x))
-    y_tree_height = math.ceil(math.log2(bound_y))
-    x_tree = RangeTree.initialize_tree(x_tree_height)
-    y_tree = RangeTree.initialize_tree(y_tree_height)
-
-    @functools.lru_cache(maxsize=None)
-    def get_x_brc_range_cover(rng):
-        return x_tree.get_brc_range_cover(rng)
-
-    @functools.lru_cache(maxsize=None)
-    def get_y_brc_range_cover(rng):
-        return y_tree.get_brc_range_cover(rng)
+    print(f"Generating all possible queries for bounds x: {bound_x} / y: {bound_y}...")
+    leakage = RangeLeakage.from_dataset(dataset, brc_range_cover_arrays)
+    return brc_leakage_attack(leakage, bound_x, bound_y, output_file_path, dataset)
 
-    @functools.lru_cache(maxsize=None)
-    def get_prefix_sums_for_ranges(x_range, y_range):
-        add1 = prefix_sums[x_range[0] - 1, y_range[0] - 1] if (x_range[0] > 0 and y_range[0] > 0) else 0
-        add2 = prefix_sums[x_range[1],     y_range[1]]
-        sub1 = prefix_sums[x_range[1],     y_range[0] - 1] if (y_range[0] > 0) else 0
-        sub2 = prefix_sums[x_range[0] - 1, y_range[1]]     if (x_range[0] > 0) else 0
-        return add2 + add1 - sub1 - sub2
 
-    print(f"Generating all possible queries for bounds x: {bound_x} / y: {bound_y}...")
-    M = {}
-    T = {}
-    for x1 in trange(bound_x):
-        for x2 in range(x1, bound_x):
-            x_covers = get_x_brc_range_cover((x1, x2))
-            for y1 in range(bound_y):
-                for y2 in range(y1, bound_y):
-                    y_covers = get_y_brc_range_cover((y1, y2))
-                    prod_covers = frozenset(itertools.product(x_covers, y_covers))
-                    volume = 0
-                    for x_range, y_range in prod_covers:
-                        result = get_prefix_sums_for_ranges(x_range, y_range)
-                        volume += result
-
-                    M[prod_covers] = volume
-                    T[prod_covers] = tuple(prod_covers)
+def brc_leakage_attack(leakage, bound_x, bound_y, output_file_path, dataset=None):
+    """
+    Runs the attack on the leakage of every range query, given as a
+    RangeLeakage or a LeakageTrace. `dataset` is the ground truth to report
+    the reconstruction against, if known.
+    """
+    token_volumes = leakage.token_volumes
 
     # Attack starts here:
     print("Actual attack starting...")
     wall_time0 = time.time_ns()
     user_time0 = time.process_time_ns()
-    E = list(map(lambda search_tokens: tuple(search_tokens), filter(lambda search_tokens: len(search_tokens) == 2, M.keys())))
-    Q = list(filter(lambda search_tokens: len(search_tokens) >= 2, M.keys()))
+    query_lengths = leakage.query_lengths()
+    edge_queries = np.flatnonzero(query_lengths == 2)
+    edges = leakage.query_tokens[leakage.query_offsets[edge_queries, None] + np.arange(2)].astype(np.int64)
+    query_tokens, query_offsets = take_slices(
+        leakage.query_tokens, leakage.query_offsets, np.flatnonzero(query_lengths >= 2)
+    )
+    indptr, neighbors, edge_ids = build_csr_adjacency(edges, leakage.num_tokens)
 
     # Construct undirected graph G with edges the elements of E:
     print("Construct undirected graph G with edges the elements of E...")
-    G = nx.Graph()
-    G.add_edges_from(E)
-    G = G.subgraph(max(nx.connected_components(G), key=len)).copy()
+    G = CSRGraph(leakage.num_tokens, edges)
+    G.keep_largest_component()
 
     print("Loop over Q...")
-    interior = set()
-    edge_counts = defaultdict(lambda: 0)
-
-    with multiprocessing.Pool(processes=16) as pool:
-        for result in tqdm(pool.imap_unordered(Q_process, zip(Q, itertools.repeat(E)), 1000), total=len(Q)):
-            I, edges_to_remove, to_add = result
-
-            interior.update(I)
-            G.remove_edges_from(edges_to_remove)
-            for edge in to_add:
-                edge_counts[edge] += 1
-
-
-
-    def edge_is_blue(edge):
-        return edge_counts[frozenset(edge)] == 2
-
-    red_nodes = [(node, set(filter(lambda neighbor: edge_is_blue((node, neighbor)), G.neighbors(node)))) for node in interior if node in G]
-    
-    nodes_to_remove = set()
-    for red_node, blue_neighbors in red_nodes:
-        if len(blue_neighbors) == 0:
-            nodes_to_remove.add(red_node)
-            continue
-            
-        min_node = min(blue_neighbors, key=lambda x: M[frozenset([x])])
-        nodes_to_remove.update([n for n in blue_neighbors if n != min_node])
-
-    G.remove_nodes_from(nodes_to_remove)
-    G = G.subgraph(max(nx.connected_components(G), key=len)).copy()
-
-    for rn in interior:
-        if rn in G:
-            if G.degree(rn) == 2:
-                edges = list(G.edges(rn))
-                G.add_edge(edges[0][1], edges[1][1])
-                G.remove_node(rn)
-
-
-    # Add volumes to each node:
-    for node in G.nodes:
-        query = frozenset([node])
-        if query in M:
-            G.nodes[node]["range_cover"] = T[query]
-            G.nodes[node]["volume"] = M[query]
-
-
-    
-    bl = (((0,1), (0,1)),)
-    tr = (((bound_x - 2, bound_y - 1), (bound_x - 2, bound_y - 1)),)
-    tl = (((bound_x - 2, bound_y - 1), (0, 1)),)
-    br = (((0,1), (bound_x - 2, bound_y - 1)),)
-    c0 = None
-    c1 = None
-    c2 = None
-    c3 = None
-    for node in G.nodes:
-        if G.nodes[node]["range_cover"] == bl:
-            c0 = node
-        if G.nodes[node]["range_cover"] == tr:
-            c1 = node           
-        if G.nodes[node]["range_cover"] == tl:
-            c2 = node 
-        if G.nodes[node]["range_cover"] == br:
-            c3 = node 
+    interior = np.zeros(leakage.num_tokens, dtype=bool)
+    edge_hits = np.zeros(len(edges), dtype=np.int64)
+
+    num_queries = len(query_offsets) - 1
+    chunk_size = 1000
+    spans = [(i, min(i + chunk_size, num_queries)) for i in range(0, num_queries, chunk_size)]
+    init_args = (indptr, neighbors, edge_ids, query_offsets, query_tokens)
+    with multiprocessing.Pool(processes=16, initializer=init_q_worker, initargs=init_args) as pool:
+        with tqdm(total=num_queries) as progress:
+            for (start, end), result in zip(spans, pool.imap(Q_process, spans)):
+                I, edges_to_remove, to_add = result
+
+                interior[list(I)] = True
+                G.remove_edges(list(edges_to_remove))
+                edge_hits += np.bincount(np.asarray(to_add, dtype=np.int64), minlength=len(edges))
+                progress.update(end - start)
+
+    # Every red (interior) node keeps only its blue neighbor of least volume,
+    # or goes away if it has none:
+    red_nodes = interior & G.node_mask
+    blue_edges = G.edge_mask & (edge_hits == 2)
+    heads = np.concatenate([edges[blue_edges, 0], edges[blue_edges, 1]])
+    tails = np.concatenate([edges[blue_edges, 1], edges[blue_edges, 0]])
+    heads, tails = heads[red_nodes[heads]], tails[red_nodes[heads]]
+    order = np.lexsort((tails, token_volumes[tails], heads))
+    heads, tails = heads[order], tails[order]
+    min_node = np.concatenate([[True], heads[1:] != heads[:-1]])
+
+    nodes_to_remove = red_nodes.copy()
+    nodes_to_remove[heads] = False
+    nodes_to_remove[tails[~min_node]] = True
+
+    G.remove_nodes(nodes_to_remove)
+    G.keep_largest_component()
+    G.splice_out(np.flatnonzero(interior).tolist())
+
+    c0 = leakage.token_id(((0, 1), (0, 1)))
+    c1 = leakage.token_id(((bound_x - 2, bound_y - 1), (bound_x - 2, bound_y - 1)))
+    c2 = leakage.token_id(((bound_x - 2, bound_y - 1), (0, 1)))
+    c3 = leakage.token_id(((0, 1), (bound_x - 2, bound_y - 1)))
 
     # Do the swaps:
-    vol_arr = grid_graph_to_arr(G.copy(), [c0, c1, c2, c3], bound_x, bound_y)
+    vol_arr = grid_graph_to_arr(G, token_volumes, [c0, c1, c2, c3], bound_x, bound_y)
     x_max = bound_x - 1
     y_max = bound_y - 1
     for i in range(1, x_max, 2):
@@ -320,20 +289,22 @@ def range_tree_brc_reconstruction_attack(db: Multimap, bound_x, bound_y, output_
     # Disable numpy wrapping on print:
     np.set_printoptions(linewidth=np.inf)
 
-    dataset = dataset.astype(int)
     vol_arr = vol_arr.astype(int)
 
-    print("Original")
-    print("--------")
-    print(dataset)
+    if dataset is not None:
+        dataset = dataset.astype(int)
+        print("Original")
+        print("--------")
+        print(dataset)
 
     print("Reconstruction")
     print("--------------")
     print(vol_arr)
 
-    print("Are they equal?")
-    print("---------------")
-    print(np.array_equal(dataset,vol_arr))
+    if dataset is not None:
+        print("Are they equal?")
+        print("---------------")
+        print(np.array_equal(dataset,vol_arr))
 
     print("[*] Writing solution to %s file." % output_file_path)
     with open(output_file_path, 'w', newline='') as csvfile:
@@ -342,7 +313,7 @@ def range_tree_brc_reconstruction_attack(db: Multimap, bound_x, bound_y, output_
 
         for x in range(bound_x):
             for y in range(bound_y):
-                true_volume = dataset[x, y]
+                true_volume = dataset[x, y] if dataset is not None else ""
                 assigned_volume = vol_arr[x, y]
                 resultwriter.writerow([x, y, assigned_volume, true_volume, total_wall_time_ns, total_user_time_ns])
 
@@ -352,7 +323,11 @@ def range_tree_brc_reconstruction_attack(db: Multimap, bound_x, bound_y, output_
 
 
 def attack(name: str, db: Multimap, output_file_path):
-    scheme_constructor, attack_algorithm = RangeTree, range_tree_brc_reconstruction_attack
+    scheme_constructor, attack_algorithm = ImplicitRangeTree, range_tree_brc_reconstruction_attack
+
+    # A columnar dataset holds one row per record:
+    if isinstance(db, PointArray):
+        db = db.counts()
 
     bound_x = next_power_of_2(max(db.keys(), key=lambda p: p[0])[0])
     bound_y = next_power_of_2(max(db.keys(), key=lambda p: p[1])[1])
@@ -363,3 +338,18 @@ def attack(name: str, db: Multimap, output_file_path):
     A = attack_algorithm(db, bound_x, bound_y, output_file_path)
     draw_vol_arr(A, name)
     draw_vol_3d(A, bound_x, bound_y, name)
+
+
+def attack_trace(name: str, trace_path: str, output_file_path):
+    """
+    Runs the attack on a leakage trace of a Range-BRC scheme over a 2D domain,
+    issued with every range query.
+    """
+    trace = LeakageTrace.load(trace_path)
+    trace.check_token_bounds()
+    trace = trace.distinct()
+    bound_x, bound_y = trace.domain
+
+    A = brc_leakage_attack(trace, bound_x, bound_y, output_file_path)
+    draw_vol_arr(A, name)
+    draw_vol_3d(A, bound_x, bound_y, name)
@@ -0,0 +1,87 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+import argparse
+import pickle
+
+from ers.schemes.common.emm_engine import EMMEngine
+from ers.schemes.common.leakage_emm_engine import LeakageEMMEngine
+from ers.schemes.common.leakage_trace import all_range_queries, generate_leakage_trace, uniform_range_queries
+from ers.schemes.range_brc import RangeBRC
+from ers.schemes.range_urc import RangeURC
+from ers.schemes.qdag_src import QdagSRC
+from ers.schemes.quad_brc import QuadBRC
+from ers.schemes.tdag_src import TdagSRC
+from ers.schemes.linear import Linear
+from ers.structures.point_array import PointArray
+from ers.structures.columnar_multimap import ColumnarMultimap
+from ers.util.crypto import SecureRandom
+
+MAX_DOCUMENT_LENGTH = 16
+
+SCHEMES = {
+    "range_brc": RangeBRC,
+    "range_urc": RangeURC,
+    "qdag_src": QdagSRC,
+    "quad_brc": QuadBRC,
+    "tdag_src": TdagSRC,
+    "linear": Linear,
+}
+
+
+def next_power_of_2(x):
+    return 1 if x == 0 else 2**(x - 1).bit_length()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes the leakage trace of a scheme over a 2D database')
+    parser.add_argument('scheme_name', choices=list(SCHEMES))
+    parser.add_argument('db_file')
+    parser.add_argument('trace_file')
+    parser.add_argument('--uniform', type=int, default=None, metavar='N',
+                        help='issue N uniformly random range queries instead of every range query')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--encrypt', action='store_true',
+                        help='use the real EMM engine; the trace then has no plaintext token bounds, '
+                             'so it records the volume leakage but cannot be loaded by the attacks')
+    args = parser.parse_args()
+
+    print("Loading database...")
+    with open(args.db_file, "rb") as fp:
+        db = pickle.load(fp)
+
+    # Every record gets a random payload:
+    points = db if isinstance(db, PointArray) else PointArray.from_counts(db)
+    data = SecureRandom(MAX_DOCUMENT_LENGTH * len(points))
+    mm = ColumnarMultimap.from_fixed_width(points, data, MAX_DOCUMENT_LENGTH)
+    bound = max(next_power_of_2(coord + 1) for coord in points.max())
+    domain = (bound, bound)
+
+    print("Building index...")
+    engine = EMMEngine(bound, bound) if args.encrypt else LeakageEMMEngine(bound, bound)
+    scheme = SCHEMES[args.scheme_name](engine)
+    key = scheme.setup(16)
+    scheme.build_index(key, mm)
+
+    print("Issuing queries...")
+    if args.uniform is None:
+        queries = all_range_queries(domain)
+    else:
+        queries = uniform_range_queries(domain, args.uniform, args.seed)
+    trace = generate_leakage_trace(scheme, key, queries, domain)
+
+    print(f"Writing {trace.num_queries} queries over {trace.num_tokens} tokens to {args.trace_file}...")
+    trace.save(args.trace_file)
@@ -0,0 +1,256 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+from ers.structures.columnar_multimap import take_slices
+from typing import *
+
+import numpy as np
+
+
+def build_csr_adjacency(edges, num_nodes):
+    """
+    Returns the adjacency of an undirected graph in compressed sparse row
+    form. The neighbors of node u are neighbors[indptr[u]:indptr[u + 1]],
+    and edge_ids holds the row of `edges` that joins u to each of them.
+    """
+    heads = np.concatenate([edges[:, 0], edges[:, 1]])
+    tails = np.concatenate([edges[:, 1], edges[:, 0]])
+    edge_ids = np.tile(np.arange(len(edges), dtype=np.int64), 2)
+
+    order = np.argsort(heads, kind="stable")
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=num_nodes), out=indptr[1:])
+    return indptr, tails[order], edge_ids[order]
+
+
+class CSRGraph:
+    """
+    An undirected simple graph on the node ids 0..num_nodes - 1, stored as
+    an edge array with a CSR adjacency over it. Nodes and edges are deleted
+    by clearing masks, so edge ids stay valid for the life of the graph.
+
+    Like a graph built with add_edges_from, its nodes are the endpoints of
+    the initial edges; removing edges leaves their endpoints in the graph.
+    """
+
+    def __init__(self, num_nodes: int, edges: np.ndarray):
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.edge_mask = np.ones(len(self.edges), dtype=bool)
+        self.node_mask = np.zeros(num_nodes, dtype=bool)
+        self.node_mask[self.edges.ravel()] = True
+        self.__adjacency = None
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_mask)
+
+    def __contains__(self, node: int) -> bool:
+        return bool(self.node_mask[node])
+
+    def nodes(self) -> np.ndarray:
+        return np.flatnonzero(self.node_mask)
+
+    def edge_ids(self) -> np.ndarray:
+        return np.flatnonzero(self.edge_mask)
+
+    def adjacency(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the CSR (indptr, neighbors, edge_ids) of all edges ever added,
+        deleted ones included; filter them through edge_mask.
+        """
+        if self.__adjacency is None:
+            self.__adjacency = build_csr_adjacency(self.edges, self.num_nodes)
+        return self.__adjacency
+
+    def degrees(self) -> np.ndarray:
+        return np.bincount(self.edges[self.edge_mask].ravel(), minlength=self.num_nodes)
+
+    def neighbors(self, node: int) -> np.ndarray:
+        indptr, neighbors, edge_ids = self.adjacency()
+        lo, hi = indptr[node], indptr[node + 1]
+        return neighbors[lo:hi][self.edge_mask[edge_ids[lo:hi]]]
+
+    def add_edges(self, edges: np.ndarray):
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        self.__append_edges(edges, np.ones(len(edges), dtype=bool))
+        self.node_mask[edges.ravel()] = True
+
+    def __append_edges(self, edges, alive):
+        self.edges = np.concatenate([self.edges, np.asarray(edges, dtype=np.int64).reshape(-1, 2)])
+        self.edge_mask = np.concatenate([self.edge_mask, alive])
+        self.__adjacency = None
+
+    def remove_edges(self, edge_ids: np.ndarray):
+        self.edge_mask[edge_ids] = False
+
+    def remove_nodes(self, nodes: np.ndarray):
+        self.node_mask[nodes] = False
+        self.edge_mask &= self.node_mask[self.edges].all(axis=1)
+
+    def connected_components(self) -> np.ndarray:
+        """
+        Labels every node with the smallest node id of its component (and
+        removed nodes with -1). This is union-find run on all edges at once:
+        each round hooks the root of the larger id onto the smaller one for
+        every edge that still joins two trees, then compresses the paths.
+        """
+        parent = np.arange(self.num_nodes)
+        u, v = self.edges[self.edge_mask].T
+        while True:
+            ru, rv = parent[u], parent[v]
+            crossing = ru != rv
+            if not crossing.any():
+                break
+            np.minimum.at(parent, np.maximum(ru, rv)[crossing], np.minimum(ru, rv)[crossing])
+            while True:
+                grandparent = parent[parent]
+                if np.array_equal(grandparent, parent):
+                    break
+                parent = grandparent
+        return np.where(self.node_mask, parent, -1)
+
+    def keep_largest_component(self):
+        labels = self.connected_components()
+        sizes = np.bincount(labels[self.node_mask], minlength=self.num_nodes)
+        self.remove_nodes(labels != np.argmax(sizes))
+
+    def bfs_layers(self, sources: Iterable[int]) -> np.ndarray:
+        """
+        Returns the hop distance of every node from the nearest source, or
+        -1 if it cannot be reached. Each BFS layer is expanded at once.
+        """
+        indptr, neighbors, edge_ids = self.adjacency()
+        distances = np.full(self.num_nodes, -1, dtype=np.int64)
+        frontier = np.unique(np.asarray(list(sources), dtype=np.int64))
+        distances[frontier] = 0
+
+        layer = 0
+        while frontier.size:
+            layer += 1
+            reached, _ = take_slices(neighbors, indptr, frontier)
+            through, _ = take_slices(edge_ids, indptr, frontier)
+            reached = reached[self.edge_mask[through]]
+            frontier = np.unique(reached[distances[reached] < 0])
+            distances[frontier] = layer
+        return distances
+
+    def splice_out(self, nodes: Iterable[int]):
+        """
+        Visits `nodes` in order and replaces each one that currently has
+        exactly two neighbors by an edge between them (unless they are
+        already adjacent).
+        """
+        indptr, neighbors, edge_ids = self.adjacency()
+        degrees = self.degrees()
+
+        # Edges added along the way get ids from `base` on and are kept
+        # aside until the end, with the ids of the added edges of each node:
+        base = len(self.edges)
+        new_edges = []
+        new_alive = []
+        added = {}
+
+        def current_neighbors(node):
+            lo, hi = indptr[node], indptr[node + 1]
+            alive = self.edge_mask[edge_ids[lo:hi]]
+            result = dict(zip(neighbors[lo:hi][alive].tolist(), edge_ids[lo:hi][alive].tolist()))
+            for edge in added.get(node, ()):
+                if new_alive[edge - base]:
+                    a, b = new_edges[edge - base]
+                    result[b if a == node else a] = edge
+            return result
+
+        for node in nodes:
+            if not self.node_mask[node] or degrees[node] != 2:
+                continue
+            (a, edge_a), (b, edge_b) = current_neighbors(node).items()
+            for edge in (edge_a, edge_b):
+                if edge < base:
+                    self.edge_mask[edge] = False
+                else:
+                    new_alive[edge - base] = False
+            self.node_mask[node] = False
+
+            if b in current_neighbors(a):
+                degrees[a] -= 1
+                degrees[b] -= 1
+            else:
+                added.setdefault(a, []).append(base + len(new_edges))
+                added.setdefault(b, []).append(base + len(new_edges))
+                new_edges.append((a, b))
+                new_alive.append(True)
+
+        if new_edges:
+            self.__append_edges(new_edges, np.array(new_alive, dtype=bool))
+
+
+def grid_graph_positions(G: CSRGraph, corners, bound_x, bound_y):
+    """
+    Places the nodes of a bound_x by bound_y grid graph, or of a subgraph of
+    one. corners are the (bottom left, top right, top left, bottom right)
+    nodes, and the bottom side runs along the second axis. Returns
+    (nodes, rows, columns) of the nodes that could be placed.
+
+    The node in row r and column c is r + c hops away from the bottom left
+    corner and (bound_x - 1 - r) + (bound_y - 1 - c) hops away from the top
+    right one in the complete grid. In a subgraph these are lower bounds, so
+    they add up to the grid diameter exactly when both are exact, and
+    likewise for the other two corners. Only nodes whose four distances are
+    exact are placed, from their distances to the bottom corners; nodes
+    reached through detours are left out rather than placed wrongly.
+    """
+    bl, tr, tl, br = corners
+    nodes = G.nodes()
+    from_bl, from_tr, from_tl, from_br = (G.bfs_layers([corner])[nodes] for corner in (bl, tr, tl, br))
+
+    diameter = bound_x + bound_y - 2
+    twice_row = from_bl + from_br - (bound_y - 1)
+    twice_column = from_bl - from_br + (bound_y - 1)
+    placed = (
+        (from_bl >= 0) & (from_tr >= 0) & (from_tl >= 0) & (from_br >= 0)
+        & (from_bl + from_tr == diameter) & (from_tl + from_br == diameter)
+        & (twice_row % 2 == 0)
+        & (twice_row >= 0) & (twice_row < 2 * bound_x)
+        & (twice_column >= 0) & (twice_column < 2 * bound_y)
+    )
+    nodes, rows, columns = nodes[placed], twice_row[placed] // 2, twice_column[placed] // 2
+
+    # The distances cannot place two nodes in one cell, or adjacent nodes in
+    # cells that are not adjacent, unless G is not a subgraph of the grid;
+    # drop any such node all the same:
+    cells = rows * bound_y + columns
+    consistent = np.bincount(cells, minlength=bound_x * bound_y)[cells] == 1
+    position = np.full((G.num_nodes, 2), -1, dtype=np.int64)
+    position[nodes, 0], position[nodes, 1] = rows, columns
+    edges = G.edges[G.edge_mask]
+    both_placed = (position[edges[:, 0], 0] >= 0) & (position[edges[:, 1], 0] >= 0)
+    edges = edges[both_placed]
+    apart = np.abs(position[edges[:, 0]] - position[edges[:, 1]]).sum(axis=1) != 1
+    misplaced = np.zeros(G.num_nodes, dtype=bool)
+    misplaced[edges[apart].ravel()] = True
+    consistent &= ~misplaced[nodes]
+    return nodes[consistent], rows[consistent], columns[consistent]
+
+
+def grid_graph_to_arr(G: CSRGraph, volumes: np.ndarray, corners, bound_x, bound_y):
+    """
+    Lays the nodes of a grid graph out in an array of their volumes (see
+    grid_graph_positions); cells no node was placed in are 0.
+    """
+    nodes, rows, columns = grid_graph_positions(G, corners, bound_x, bound_y)
+    arr = np.zeros((bound_x, bound_y))
+    arr[rows, columns] = volumes[nodes]
+    return arr
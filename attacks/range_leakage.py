@@ -0,0 +1,213 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+from ers.structures.implicit_range_tree import URC_BATCH_SIZE
+from typing import *
+
+import numpy as np
+
+
+# Upper bound on the number of search tokens expanded per batch:
+EXPANSION_BATCH_SIZE = 1 << 22
+
+
+def axis_intervals(bound: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (starts, ends) of every interval [a, b] with 0 <= a <= b < bound,
+    ordered by a and then by b.
+    """
+    starts, ends = np.triu_indices(bound)
+    return starts.astype(np.int64), ends.astype(np.int64)
+
+
+def dyadic_node_ids(starts: np.ndarray, ends: np.ndarray, height: int) -> np.ndarray:
+    """
+    Numbers the nodes of a range tree of the given height level by level,
+    leaves first: the node of level l covering [s, e] gets the number of
+    nodes below level l plus s >> l.
+    """
+    # Node sizes are powers of two, so log2 is exact:
+    level = np.log2(ends - starts + 1).astype(np.int64)
+    level_offsets = (1 << (height + 1)) - (1 << (height + 1 - level))
+    return level_offsets + (starts >> level)
+
+
+def dyadic_node_ranges(height: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Inverse of dyadic_node_ids: returns (starts, ends) indexed by node id.
+    """
+    level = np.repeat(np.arange(height + 1), 1 << (height - np.arange(height + 1)))
+    index = np.concatenate([np.arange(1 << (height - l)) for l in range(height + 1)])
+    starts = index << level
+    return starts, starts + (1 << level) - 1
+
+
+class RangeLeakage:
+    """
+    The leakage of every 2D range query on a dataset under a product range
+    scheme, as arrays. Search tokens are pairs of x and y range tree nodes
+    and get the id x_node * num_y_nodes + y_node; the tokens of query q are
+    query_tokens[query_offsets[q]:query_offsets[q + 1]] in the order of the
+    cover product, and token_volumes[t] is the volume of token t.
+
+    Queries are numbered in the order of their (x1, x2, y1, y2) bounds.
+    """
+
+    def __init__(
+        self,
+        x_height: int,
+        y_height: int,
+        token_volumes: np.ndarray,
+        query_offsets: np.ndarray,
+        query_tokens: np.ndarray,
+    ):
+        self.x_height = x_height
+        self.y_height = y_height
+        self.token_volumes = token_volumes
+        self.query_offsets = query_offsets
+        self.query_tokens = query_tokens
+        self.x_node_ranges = dyadic_node_ranges(x_height)
+        self.y_node_ranges = dyadic_node_ranges(y_height)
+        self.num_y_nodes = len(self.y_node_ranges[0])
+
+    @classmethod
+    def from_dataset(
+        cls, dataset: np.ndarray, cover_arrays: Callable, max_tokens: Optional[int] = None
+    ) -> "RangeLeakage":
+        """
+        Computes the leakage of all queries over the 2D count array `dataset`.
+        `cover_arrays` is brc_range_cover_arrays or urc_range_cover_arrays;
+        queries with more than `max_tokens` tokens are left out.
+        """
+        bound_x, bound_y = dataset.shape
+        x_height = max(bound_x - 1, 0).bit_length()
+        y_height = max(bound_y - 1, 0).bit_length()
+
+        # Cover node ids of every interval, once per axis:
+        x_offsets, x_ids = cls.__axis_covers(bound_x, x_height, cover_arrays)
+        y_offsets, y_ids = cls.__axis_covers(bound_y, y_height, cover_arrays)
+
+        # The volume of every (x node, y node) pair from one prefix sum gather:
+        prefix_sums = np.zeros((bound_x + 1, bound_y + 1), dtype=np.int64)
+        prefix_sums[1:, 1:] = np.cumsum(np.cumsum(dataset, axis=0), axis=1)
+        # (nodes past the end of the dataset are clipped to it)
+        x_starts, x_ends = dyadic_node_ranges(x_height)
+        y_starts, y_ends = dyadic_node_ranges(y_height)
+        x_starts, x_ends = np.minimum(x_starts, bound_x), np.minimum(x_ends + 1, bound_x)
+        y_starts, y_ends = np.minimum(y_starts, bound_y), np.minimum(y_ends + 1, bound_y)
+        token_volumes = (
+            prefix_sums[np.ix_(x_ends, y_ends)]
+            - prefix_sums[np.ix_(x_starts, y_ends)]
+            - prefix_sums[np.ix_(x_ends, y_starts)]
+            + prefix_sums[np.ix_(x_starts, y_starts)]
+        ).ravel()
+        num_y_nodes = len(y_starts)
+
+        # Every query is a pair of intervals and its tokens are the product
+        # of their covers:
+        x_lengths, y_lengths = np.diff(x_offsets), np.diff(y_offsets)
+        x_rows, y_rows = np.arange(len(x_lengths)), np.arange(len(y_lengths))
+        if max_tokens is not None:
+            x_rows = x_rows[x_lengths <= max_tokens]
+            y_rows = y_rows[y_lengths <= max_tokens]
+        lengths = np.outer(x_lengths[x_rows], y_lengths[y_rows])
+        keep = lengths > 0
+        if max_tokens is not None:
+            keep &= lengths <= max_tokens
+        query_x, query_y = np.nonzero(keep)
+        lengths = lengths[query_x, query_y]
+        query_x, query_y = x_rows[query_x], y_rows[query_y]
+
+        query_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=query_offsets[1:])
+        query_tokens = np.empty(query_offsets[-1], dtype=np.int32)
+
+        first = 0
+        while first < len(lengths):
+            budget = query_offsets[first] + EXPANSION_BATCH_SIZE
+            last = int(np.searchsorted(query_offsets, budget, "right")) - 1
+            last = min(max(last, first + 1), len(lengths))
+            lo, hi = query_offsets[first], query_offsets[last]
+
+            rows = np.repeat(np.arange(first, last), lengths[first:last])
+            position = np.arange(lo, hi, dtype=np.int64) - query_offsets[rows]
+            width = y_lengths[query_y[rows]]
+            x_nodes = x_ids[x_offsets[query_x[rows]] + position // width]
+            y_nodes = y_ids[y_offsets[query_y[rows]] + position % width]
+            query_tokens[lo:hi] = x_nodes * num_y_nodes + y_nodes
+            first = last
+
+        return cls(x_height, y_height, token_volumes, query_offsets, query_tokens)
+
+    @staticmethod
+    def __axis_covers(bound, height, cover_arrays):
+        starts, ends = axis_intervals(bound)
+        lengths, node_ids = [], []
+        for chunk in range(0, len(starts), URC_BATCH_SIZE):
+            batch = slice(chunk, chunk + URC_BATCH_SIZE)
+            cover_starts, cover_ends, offsets = cover_arrays(starts[batch], ends[batch], height)
+            lengths.append(np.diff(offsets))
+            node_ids.append(dyadic_node_ids(cover_starts, cover_ends, height))
+
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(lengths), out=offsets[1:])
+        return offsets, np.concatenate(node_ids)
+
+    @property
+    def num_queries(self) -> int:
+        return len(self.query_offsets) - 1
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.token_volumes)
+
+    def query_lengths(self) -> np.ndarray:
+        return np.diff(self.query_offsets)
+
+    def query(self, q: int) -> np.ndarray:
+        return self.query_tokens[self.query_offsets[q]:self.query_offsets[q + 1]]
+
+    def observations(self, queries: Optional[Iterable[int]] = None) -> Iterator[Tuple[Tuple[int, ...], int]]:
+        """
+        Yields the (token ids, volume) leakage of the given queries (all of
+        them by default) one at a time, as an attacker would observe them.
+        """
+        if queries is None:
+            queries = range(self.num_queries)
+        for q in queries:
+            tokens = self.query(q)
+            yield tuple(tokens.tolist()), int(self.token_volumes[tokens].sum())
+
+    def token(self, token_id: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        Returns the (x range, y range) of a token id.
+        """
+        x_node, y_node = divmod(int(token_id), self.num_y_nodes)
+        x_starts, x_ends = self.x_node_ranges
+        y_starts, y_ends = self.y_node_ranges
+        return (
+            (int(x_starts[x_node]), int(x_ends[x_node])),
+            (int(y_starts[y_node]), int(y_ends[y_node])),
+        )
+
+    def token_id(self, token: Tuple[Tuple[int, int], Tuple[int, int]]) -> int:
+        """
+        Inverse of token: returns the id of an (x range, y range) token.
+        """
+        (x_start, x_end), (y_start, y_end) = token
+        x_node = dyadic_node_ids(np.array([x_start]), np.array([x_end]), self.x_height)[0]
+        y_node = dyadic_node_ids(np.array([y_start]), np.array([y_end]), self.y_height)[0]
+        return int(x_node * self.num_y_nodes + y_node)
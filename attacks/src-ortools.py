@@ -16,8 +16,12 @@
 ##
 from ortools.sat.python import cp_model
 from ortools.sat import sat_parameters_pb2
-from ers.schemes.common.emm import EMM, EMMEngine
+from ers.schemes.common.emm import EMM
+from ers.schemes.common.leakage_emm_engine import LeakageEMMEngine
+from ers.schemes.common.leakage_trace import LeakageTrace, generate_leakage_trace
 from ers.structures.point import Point
+from ers.structures.point_array import PointArray
+from ers.structures.columnar_multimap import ColumnarMultimap
 from ers.schemes.qdag_src import QdagSRC 
 from ers.structures.quad_tree_src import get_quad_divisions, get_intermediate_divisions
 from ers.structures.rect import Rect
@@ -26,6 +30,8 @@ from collections import defaultdict
 from ers.util.crypto import SecureRandom
 from tqdm import tqdm, trange
 
+import numpy as np
+
 #import util
 import unittest
 import secrets
@@ -44,18 +50,14 @@ MAX_DOCUMENT_LENGTH = 16
 def next_power_of_2(x):
     return 1 if x == 0 else 2**(x - 1).bit_length()
 
-def points_to_multimap(pts: List[List[int]]):
-    mm = defaultdict(list)
-
-    max_x = 0
-    max_y = 0
-    for x,y in pts:
-        mm[Point(x, y)].append(SecureRandom(MAX_DOCUMENT_LENGTH))
-        if x > max_x:
-            max_x = x
-        if y > max_y:
-            max_y = y
-    x_size, y_size = next_power_of_2(max_x), next_power_of_2(max_y)
+def points_to_multimap(pts: Iterable) -> Tuple[ColumnarMultimap, int, int]:
+    """
+    Stores one random record for every point in `pts`.
+    """
+    points = PointArray.from_points(pts, 2)
+    data = SecureRandom(MAX_DOCUMENT_LENGTH * len(points))
+    mm = ColumnarMultimap.from_fixed_width(points, data, MAX_DOCUMENT_LENGTH)
+    x_size, y_size = (next_power_of_2(coord) for coord in points.max())
     bound = max(x_size, y_size)
     return mm, bound, bound
 
@@ -97,11 +99,16 @@ def get_octo_divisions(plaintext_rect: Rect) -> Dict:
 def attack(output_file, db):
     mm, bound_x, bound_y = None, None, None
 
+    # A columnar dataset holds one row per record:
+    if isinstance(db, PointArray):
+        db = db.counts()
+
     mm, bound_x, bound_y = points_to_multimap(db)
 
 
     print("[*] Starting attack with the bounds x:", bound_x, "y:", bound_y)
-    emm_engine = EMMEngine(bound_x, bound_y)
+    # The attack only consumes leakage, so skip the cryptography:
+    emm_engine = LeakageEMMEngine(bound_x, bound_y)
     qdag_sse   = QdagSRC(emm_engine)
     qdag_key   = qdag_sse.setup(16)
     print("[*] Building index...")
@@ -109,32 +116,35 @@ def attack(output_file, db):
 
     # Generate all possible queries:
     print("[*] Generating queries (this will take a while)...")
+    queries = (
+        (point_a, point_b)
+        for point_a in tqdm(list((Point(x, y) for x in range(bound_x) for y in range(bound_y))))
+        for point_b in (Point(v, w) for v in range(point_a.x, bound_x) for w in range(point_a.y, bound_y))
+    )
+    trace = generate_leakage_trace(qdag_sse, qdag_key, queries, (bound_x, bound_y))
+    attack_leakage(output_file, trace)
+
+def attack_trace(output_file, trace_path):
+    """
+    Runs the attack on a leakage trace of QdagSRC issued with every range
+    query.
+    """
+    trace = LeakageTrace.load(trace_path)
+    trace.check_token_bounds()
+    attack_leakage(output_file, trace)
+
+def attack_leakage(output_file, trace: LeakageTrace):
+    # Every query uses a single token; count how often each one was used.
+    # The plaintext rects (in the QDAG's convention, which ends one past the
+    # last cell) are only needed to state the summation constraints:
+    counts = dict(enumerate(np.bincount(trace.query_tokens, minlength=trace.num_tokens).tolist()))
+    volumes = dict(enumerate(trace.token_volumes.tolist()))
     translation = {}
-    volumes = {}
     p_volumes = defaultdict(lambda: 0)
-    counts = defaultdict(lambda: 0)
-    p_counts = defaultdict(lambda: 0)
-
-    for point_a in tqdm(list((Point(x, y) for x in range(bound_x) for y in range(bound_y)))):
-        for point_b in (Point(v, w) for v in range(point_a.x, bound_x) for w in range(point_a.y, bound_y)):
-            plaintext_query  = Rect(point_a, Point(point_b.x + 1, point_b.y + 1))
-            ciphertext_query = qdag_sse.trapdoor(qdag_key, point_a, point_b)
-            if ciphertext_query not in translation:
-                ciphertext_response = qdag_sse.search(ciphertext_query)
-
-                # Capture the response volume:
-                response_volume = len(ciphertext_response)
-                plaintext_query  = Rect(point_a, point_b)
-
-                # Plaintext transaction matrices solely for human-readable output, not necessary for attack:
-                translation[ciphertext_query] = qdag_sse.qdag.get_single_range_cover(plaintext_query)
-                volumes[ciphertext_query] = response_volume
-
-                p_volumes[qdag_sse.qdag.get_single_range_cover(Rect(point_a, point_b))] = response_volume
-
-            # Count vector:
-            p_counts[qdag_sse.qdag.get_single_range_cover(Rect(point_a, point_b))] += 1
-            counts[ciphertext_query] += 1
+    for token, bounds in enumerate(trace.token_bounds.tolist()):
+        cover = Rect(Point(bounds[0], bounds[1]), Point(bounds[2] + 1, bounds[3] + 1))
+        translation[token] = cover
+        p_volumes[cover] = volumes[token]
 
     max_volume = max(p_volumes.values())
 
@@ -15,20 +15,19 @@
 ## limitations under the License.
 ##
 from ers.structures.point import Point
-from ers.structures.range_tree import RangeTree
+from ers.structures.point_array import PointArray
+from ers.structures.implicit_range_tree import ImplicitRangeTree, urc_range_cover_arrays
+from attacks.range_leakage import RangeLeakage
+from ers.schemes.common.leakage_trace import LeakageTrace
+from attacks.graph import CSRGraph, grid_graph_positions, grid_graph_to_arr
 from typing import *
 import numpy as np
-import networkx as nx
 from matplotlib import cm
-from tqdm import tqdm, trange
 import matplotlib.pyplot as plt
 from matplotlib.ticker import LinearLocator
 
 
-import functools
-import itertools
 import time
-import math
 import csv
 
 
@@ -90,23 +89,129 @@ def next_power_of_2(x):
 
 
 
-def grid_graph_to_arr(G, corners, bound_x, bound_y):
-    bl = corners[0]
-    tr = corners[1]
-    tl = corners[2]
-    br = corners[3]
-
-    arr = np.zeros((bound_x, bound_y))
-    
-    bottom_axis = nx.shortest_path(G, source=bl, target=br)
-    top_axis = nx.shortest_path(G, source=tl, target=tr)
-
-    i = 0
-    for bot, top in zip(bottom_axis, top_axis):
-        arr[:, i] = list(map(lambda node: G.nodes[node]["volume"], nx.shortest_path(G, source=bot, target=top)))
-        i += 1
-
-    return arr
+class StreamingTokenPairAttack:
+    """
+    The token-pair attack run online, on (search tokens, volume) pairs
+    observed one query at a time. Tokens may be any hashable values.
+
+    A single-token query reveals the volume of its token, and a two-token
+    query whose tokens both have a known volume is an edge of the grid
+    graph. The graph's components are kept in a union-find as edges arrive,
+    so the state is O(tokens) however many queries are observed;
+    reconstruct lays out the component of the grid corners on request.
+    """
+
+    def __init__(self, bound_x, bound_y):
+        self.bound_x = bound_x
+        self.bound_y = bound_y
+        self.token_ids = {}
+        self.volumes = []
+        self.known = []
+        self.neighbors = []
+        self.parent = []
+        self.size = []
+        self.num_observed = 0
+
+    def __token_id(self, token):
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = self.token_ids[token] = len(self.volumes)
+            self.volumes.append(0)
+            self.known.append(False)
+            self.neighbors.append(set())
+            self.parent.append(token_id)
+            self.size.append(1)
+        return token_id
+
+    def __find(self, u):
+        root = u
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[u] != root:
+            self.parent[u], u = root, self.parent[u]
+        return root
+
+    def __union(self, u, v):
+        u, v = self.__find(u), self.__find(v)
+        if u != v:
+            if self.size[u] < self.size[v]:
+                u, v = v, u
+            self.parent[v] = u
+            self.size[u] += self.size[v]
+
+    def observe(self, tokens: Iterable, volume: int):
+        """
+        Records one query's leakage. Queries of more than two tokens carry
+        nothing this attack uses.
+        """
+        self.num_observed += 1
+        tokens = set(tokens)
+        if len(tokens) == 1:
+            u = self.__token_id(tokens.pop())
+            if not self.known[u]:
+                self.volumes[u] = volume
+                self.known[u] = True
+                for v in self.neighbors[u]:
+                    if self.known[v]:
+                        self.__union(u, v)
+        elif len(tokens) == 2:
+            u, v = map(self.__token_id, tokens)
+            if v not in self.neighbors[u]:
+                self.neighbors[u].add(v)
+                self.neighbors[v].add(u)
+                if self.known[u] and self.known[v]:
+                    self.__union(u, v)
+
+    def observe_many(self, observations: Iterable[Tuple[Iterable, int]]):
+        for tokens, volume in observations:
+            self.observe(tokens, volume)
+
+    def reconstruct(self, corners) -> Tuple[np.ndarray, float]:
+        """
+        Lays out the component of the given (bottom left, top right, top
+        left, bottom right) corner tokens. Returns the volume array, with 0
+        in the cells that could not be placed yet, and the fraction of cells
+        that were placed.
+
+        Only cells whose position is certain are placed (see
+        grid_graph_positions), and only once their volume is known. The
+        layout is anchored at all four corners, so the coverage stays 0 until
+        every corner is connected to one component; a corner whose volume is
+        not known yet still anchors it through its edges.
+        """
+        arr = np.zeros((self.bound_x, self.bound_y))
+        if any(corner not in self.token_ids for corner in corners):
+            return arr, 0.0
+        corner_ids = [self.token_ids[corner] for corner in corners]
+
+        # The components each corner is part of or, if its volume is not
+        # known, adjacent to:
+        roots = None
+        for corner in corner_ids:
+            if self.known[corner]:
+                corner_roots = {self.__find(corner)}
+            else:
+                corner_roots = {self.__find(v) for v in self.neighbors[corner] if self.known[v]}
+            roots = corner_roots if roots is None else roots & corner_roots
+        if not roots:
+            return arr, 0.0
+        root = max(roots, key=lambda r: self.size[r])
+
+        in_component = [self.known[u] and self.__find(u) == root for u in range(len(self.parent))]
+        for corner in corner_ids:
+            in_component[corner] = True
+        edges = [
+            (u, v)
+            for u in range(len(self.neighbors)) if in_component[u]
+            for v in self.neighbors[u] if u < v and in_component[v]
+        ]
+        G = CSRGraph(len(self.parent), np.array(edges, dtype=np.int64))
+
+        nodes, rows, columns = grid_graph_positions(G, corner_ids, self.bound_x, self.bound_y)
+        known = np.asarray(self.known)[nodes]
+        arr[rows[known], columns[known]] = np.asarray(self.volumes)[nodes[known]]
+        coverage = int(np.count_nonzero(known)) / (self.bound_x * self.bound_y)
+        return arr, coverage
 
 
 def range_tree_urc_tokenpair_attack(db: Multimap, bound_x, bound_y, output_file_path):
@@ -115,89 +220,37 @@ def range_tree_urc_tokenpair_attack(db: Multimap, bound_x, bound_y, output_file_
         dataset[tup[0], tup[1]] = db[tup]
     print(dataset)
 
-    prefix_sums = np.cumsum(np.cumsum(dataset, axis=0), axis=1) # Sum over rows
-    #print(prefix_sums)
-
-    # Generate range tree:
-    x_tree_height = math.ceil(math.log2(bound_x))
-    y_tree_height = math.ceil(math.log2(bound_y))
-    x_tree = RangeTree.initialize_tree(x_tree_height)
-    y_tree = RangeTree.initialize_tree(y_tree_height)
-
-    @functools.lru_cache(maxsize=None)
-    def get_x_urc_range_cover(rng):
-        return x_tree.get_urc_range_cover(rng)
-
-    @functools.lru_cache(maxsize=None)
-    def get_y_urc_range_cover(rng):
-        return y_tree.get_urc_range_cover(rng)
+    print(f"Generating all possible queries for bounds x: {bound_x} / y: {bound_y}...")
+    leakage = RangeLeakage.from_dataset(dataset, urc_range_cover_arrays, max_tokens=2)
+    return tokenpair_leakage_attack(leakage, bound_x, bound_y, output_file_path, dataset)
 
-    @functools.lru_cache(maxsize=None)
-    def get_prefix_sums_for_ranges(x_range, y_range):
-        add1 = prefix_sums[x_range[0] - 1, y_range[0] - 1] if (x_range[0] > 0 and y_range[0] > 0) else 0
-        add2 = prefix_sums[x_range[1],     y_range[1]]
-        sub1 = prefix_sums[x_range[1],     y_range[0] - 1] if (y_range[0] > 0) else 0
-        sub2 = prefix_sums[x_range[0] - 1, y_range[1]]     if (x_range[0] > 0) else 0
-        return add2 + add1 - sub1 - sub2
 
-    print(f"Generating all possible queries for bounds x: {bound_x} / y: {bound_y}...")
-    M = {}
-    T = {}
-    for x1 in trange(bound_x):
-        for x2 in range(x1, bound_x):
-            x_covers = get_x_urc_range_cover((x1, x2))
-            if len(x_covers) <= 2:
-                for y1 in range(bound_y):
-                    for y2 in range(y1, bound_y):
-                        y_covers = get_y_urc_range_cover((y1, y2))
-                        if len(x_covers) * len(y_covers) <= 2:
-                            prod_covers = frozenset(itertools.product(x_covers, y_covers))
-                            volume = 0
-                            for x_range, y_range in prod_covers:
-                                result = get_prefix_sums_for_ranges(x_range, y_range)
-                                volume += result
-
-                            M[prod_covers] = volume
-                            T[prod_covers] = tuple(prod_covers)
+def tokenpair_leakage_attack(leakage, bound_x, bound_y, output_file_path, dataset=None):
+    """
+    Runs the attack on the leakage of every range query (those of more than
+    two tokens may be left out), given as a RangeLeakage or a LeakageTrace.
+    `dataset` is the ground truth to report the reconstruction against, if
+    known.
+    """
 
     # Attack starts here:
     wall_time0 = time.time_ns()
     user_time0 = time.process_time_ns()
-    Q_1 = set(map(lambda search_tokens: tuple(search_tokens)[0], filter(lambda search_tokens: len(search_tokens) == 1, M.keys())))
-    Q_2 = map(lambda search_tokens: tuple(search_tokens), filter(lambda search_tokens: len(search_tokens) == 2 and all(token in Q_1 for token in search_tokens), M.keys()))
+    query_lengths = leakage.query_lengths()
+    Q_1 = leakage.query_tokens[leakage.query_offsets[:-1][query_lengths == 1]]
+    Q_2 = leakage.query_tokens[leakage.query_offsets[:-1][query_lengths == 2, None] + np.arange(2)]
+    Q_2 = Q_2[np.isin(Q_2, Q_1).all(axis=1)]
 
     # Construct a graph from all queries of length 2:
-    G = nx.Graph()
-    G.add_edges_from(list(Q_2))
+    G = CSRGraph(leakage.num_tokens, Q_2)
 
     # Get the largest connected component of G:
-    largest_cc = G.subgraph(max(nx.connected_components(G), key=len)).copy()
-
-    # Add volumes to each node:
-    for node in largest_cc.nodes:
-        query = frozenset([node])
-        if query in M:
-            largest_cc.nodes[node]["range_cover"] = T[query]
-            largest_cc.nodes[node]["volume"] = M[query]
-
-    
-    bl = (((0,0), (0,0)),)
-    tr = (((bound_x - 1, bound_y - 1), (bound_x - 1, bound_y - 1)),)
-    tl = (((bound_x - 1, bound_y - 1), (0, 0)),)
-    br = (((0,0), (bound_x - 1, bound_y - 1)),)
-    c0 = None
-    c1 = None
-    c2 = None
-    c3 = None
-    for node in largest_cc.nodes:
-        if largest_cc.nodes[node]["range_cover"] == bl:
-            c0 = node
-        if largest_cc.nodes[node]["range_cover"] == tr:
-            c1 = node           
-        if largest_cc.nodes[node]["range_cover"] == tl:
-            c2 = node 
-        if largest_cc.nodes[node]["range_cover"] == br:
-            c3 = node 
+    G.keep_largest_component()
+
+    c0 = leakage.token_id(((0, 0), (0, 0)))
+    c1 = leakage.token_id(((bound_x - 1, bound_y - 1), (bound_x - 1, bound_y - 1)))
+    c2 = leakage.token_id(((bound_x - 1, bound_y - 1), (0, 0)))
+    c3 = leakage.token_id(((0, 0), (bound_x - 1, bound_y - 1)))
 
 
     wall_time1 = time.time_ns()
@@ -207,25 +260,27 @@ def range_tree_urc_tokenpair_attack(db: Multimap, bound_x, bound_y, output_file_
     print("Wall time:", total_wall_time_ns, "ns")
     print("User time:", total_user_time_ns, "ns")
 
-    vol_arr = grid_graph_to_arr(largest_cc.copy(), [c0, c1, c2, c3], bound_x, bound_y)
+    vol_arr = grid_graph_to_arr(G, leakage.token_volumes, [c0, c1, c2, c3], bound_x, bound_y)
 
     # Disable numpy wrapping on print:
     np.set_printoptions(linewidth=np.inf)
 
-    dataset = dataset.astype(int)
     vol_arr = vol_arr.astype(int)
 
-    print("Original")
-    print("--------")
-    print(dataset)
+    if dataset is not None:
+        dataset = dataset.astype(int)
+        print("Original")
+        print("--------")
+        print(dataset)
 
     print("Reconstruction")
     print("--------------")
     print(vol_arr)
 
-    print("Are they equal?")
-    print("---------------")
-    print(np.array_equal(dataset,vol_arr))
+    if dataset is not None:
+        print("Are they equal?")
+        print("---------------")
+        print(np.array_equal(dataset,vol_arr))
 
     print("[*] Writing solution to %s file." % output_file_path)
     with open(output_file_path, 'w', newline='') as csvfile:
@@ -234,7 +289,7 @@ def range_tree_urc_tokenpair_attack(db: Multimap, bound_x, bound_y, output_file_
 
         for x in range(bound_x):
             for y in range(bound_y):
-                true_volume = dataset[x, y]
+                true_volume = dataset[x, y] if dataset is not None else ""
                 assigned_volume = vol_arr[x, y]
                 resultwriter.writerow([x, y, assigned_volume, true_volume, total_wall_time_ns, total_user_time_ns])
 
@@ -243,7 +298,11 @@ def range_tree_urc_tokenpair_attack(db: Multimap, bound_x, bound_y, output_file_
 
 
 def attack(name: str, db: Multimap, output_file_path):
-    scheme_constructor, attack_algorithm = RangeTree, range_tree_urc_tokenpair_attack
+    scheme_constructor, attack_algorithm = ImplicitRangeTree, range_tree_urc_tokenpair_attack
+
+    # A columnar dataset holds one row per record:
+    if isinstance(db, PointArray):
+        db = db.counts()
 
     bound_x = next_power_of_2(max(db.keys(), key=lambda p: p[0])[0])
     bound_y = next_power_of_2(max(db.keys(), key=lambda p: p[1])[1])
@@ -254,3 +313,18 @@ def attack(name: str, db: Multimap, output_file_path):
     A = attack_algorithm(db, bound_x, bound_y, output_file_path)
     draw_vol_arr(A, name)
     draw_vol_3d(A, bound_x, bound_y, name)
+
+
+def attack_trace(name: str, trace_path: str, output_file_path):
+    """
+    Runs the attack on a leakage trace of a Range-URC scheme over a 2D domain,
+    issued with every range query.
+    """
+    trace = LeakageTrace.load(trace_path)
+    trace.check_token_bounds()
+    trace = trace.distinct()
+    bound_x, bound_y = trace.domain
+
+    A = tokenpair_leakage_attack(trace, bound_x, bound_y, output_file_path)
+    draw_vol_arr(A, name)
+    draw_vol_3d(A, bound_x, bound_y, name)
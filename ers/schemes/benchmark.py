@@ -15,10 +15,12 @@
 ## limitations under the License.
 ##
 
-from .common.emm_engine import EMMEngine
+from .common.emm_engine import EMMEngine, LABEL_FORMAT_LEGACY, LABEL_FORMAT_COUNTER
 from .common.emm import EMM
 from ..structures.point import Point
 from ..structures.point_3d import Point3D
+from ..structures.point_array import PointArray
+from ..structures.columnar_multimap import ColumnarMultimap, take_slices
 
 from .range_brc import RangeBRC
 from .range_brc_3d import RangeBRC3D
@@ -36,11 +38,13 @@ from .quad_brc_3d import QuadBRC3D
 from .tdag_src import TdagSRC
 from .tdag_src_3d import TdagSRC3D
 
+from .range_nd import RangeBRCND, RangeURCND, TdagSRCND
+
 
 from ..util.crypto import SecureRandom
 
 from typing import *
-from math import ceil, log
+from math import ceil, log, prod
 from collections import defaultdict
 from itertools import accumulate
 import secrets
@@ -53,6 +57,7 @@ import sys
 from tqdm import tqdm
 import pickle
 
+import numpy as np
 import matplotlib.pyplot as plt
 
 Multimap = Dict[Point, List[bytes]]
@@ -62,45 +67,56 @@ BOUND_Y = 2 ** 3
 DOC_LENGTH = 10
 NUM_QUERIES = 100
 NUM_PROCESSES = 16
+# Set to a label width (e.g. 16) to benchmark schemes on a CompactEDB:
+COMPACT_LABEL_BYTES = None
 
 
 def next_power_of_2(x):
     return 1 if x == 0 else 2 ** (x - 1).bit_length()
 
 
-def points_to_multimap(pts: List[List[int]]):
-    mm = defaultdict(list)
+def coordinate_payload_multimap(points: PointArray) -> ColumnarMultimap:
+    """
+    Builds a columnar multimap storing, for every record, its coordinates
+    as text ("x y" or "x y z"). The text is formatted once per distinct
+    point and gathered into the payload buffer for its records.
+    """
+    unique, inverse = np.unique(points.coords(), axis=0, return_inverse=True)
+    texts = [" ".join(map(str, coords)).encode("utf-8") for coords in unique.tolist()]
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+    data, value_offsets = take_slices(
+        np.frombuffer(b"".join(texts), dtype=np.uint8), text_offsets, inverse.reshape(-1)
+    )
+    return ColumnarMultimap.from_records(points, data, value_offsets)
 
-    max_x = 0
-    max_y = 0
-    for x, y in pts:
-        mm[Point(x, y)].append(bytes(str(x) + " " + str(y), 'utf-8'))
-        if x > max_x:
-            max_x = x
-        if y > max_y:
-            max_y = y
-    x_size, y_size = next_power_of_2(max_x), next_power_of_2(max_y)
-    bound = max(x_size, y_size)
-    return mm, bound
 
+def points_nd_to_multimap(pts: Union[PointArray, List[List[int]]], num_axes: int = None):
+    points = pts if isinstance(pts, PointArray) else PointArray.from_points(pts, num_axes)
+    bound = max(next_power_of_2(coord) for coord in points.max())
+    return coordinate_payload_multimap(points), bound
 
-def points_3d_to_multimap(pts: List[List[int]]):
-    mm = defaultdict(list)
 
-    max_x = 0
-    max_y = 0
-    max_z = 0
-    for x, y, z in pts:
-        mm[Point3D(x, y, z)].append(bytes(str(x) + " " + str(y)+ " " + str(z), 'utf-8'))
-        if x > max_x:
-            max_x = x
-        if y > max_y:
-            max_y = y
-        if z > max_z:
-            max_z = z
-    x_size, y_size, z_size = next_power_of_2(max_x), next_power_of_2(max_y), next_power_of_2(max_z)
-    bound = max(x_size, y_size, z_size)
-    return mm, bound
+def points_to_multimap(pts: Union[PointArray, List[List[int]]]):
+    return points_nd_to_multimap(pts, 2)
+
+
+def points_3d_to_multimap(pts: Union[PointArray, List[List[int]]]):
+    return points_nd_to_multimap(pts, 3)
+
+
+def measure_encrypted_db_size(encrypted_db) -> int:
+    """
+    Returns the number of bytes used by an encrypted index.
+    """
+    if hasattr(encrypted_db, "nbytes"):
+        return encrypted_db.nbytes
+    return sum(
+        (
+            sys.getsizeof(k) + sys.getsizeof(v)
+            for k, v in encrypted_db.items()
+        )
+    )
 
 
 def generate_random_database(
@@ -145,29 +161,34 @@ def generate_random_3d_point(bound_x: int, bound_y: int, bound_z: int) -> Point3
     return Point3D(secrets.randbelow(bound_x), secrets.randbelow(bound_y), secrets.randbelow(bound_z))
 
 
+def order_query_corners(p1, p2):
+    """
+    Returns the corners of the box spanned by `p1` and `p2` as a
+    (lower, upper) pair. Points are immutable, so swapped coordinates go
+    into new points.
+    """
+    if all(a <= b for a, b in zip(p1, p2)):
+        return (p1, p2)
+    point_type = type(p1)
+    return (
+        point_type(*(min(a, b) for a, b in zip(p1, p2))),
+        point_type(*(max(a, b) for a, b in zip(p1, p2))),
+    )
+
+
 def generate_random_query(bound_x: int, bound_y: int) -> Tuple[Point, Point]:
     p1 = generate_random_point(bound_x, bound_y)
     p2 = generate_random_point(bound_x, bound_y)
 
     # Guarantee that query satisfies "dominates" assumption:
-    if p1.x > p2.x:
-        p1.x, p2.x = p2.x, p1.x
-    if p1.y > p2.y:
-        p1.y, p2.y = p2.y, p1.y
-
-    return (p1, p2)
+    return order_query_corners(p1, p2)
 
 def generate_random_small_query(bound_x: int, bound_y: int) -> Tuple[Point, Point]:
     p1 = generate_random_point(bound_x-1, bound_y-1)
     p2 = Point(random.randint(p1.x, min(int(p1.x+bound_x*0.3),bound_x-1)), random.randint(p1.y, min(int(p1.y+bound_y*0.3),bound_y-1)))
     #print(p1,p2)
     # Guarantee that query satisfies "dominates" assumption:
-    if p1.x > p2.x:
-        p1.x, p2.x = p2.x, p1.x
-    if p1.y > p2.y:
-        p1.y, p2.y = p2.y, p1.y
-
-    return (p1, p2)
+    return order_query_corners(p1, p2)
 
 def generate_random_target_query(bound_x: int, bound_y: int, target:int) -> Tuple[Point, Point]:
     p1 = generate_random_point(int(bound_x*(1-(target**0.5)*0.01)), int(bound_y*(1-(target**0.5)*0.01)))
@@ -177,26 +198,21 @@ def generate_random_target_query(bound_x: int, bound_y: int, target:int) -> Tupl
 
     #print(p1,p2)
     # Guarantee that query satisfies "dominates" assumption:
-    if p1.x > p2.x:
-        p1.x, p2.x = p2.x, p1.x
-    if p1.y > p2.y:
-        p1.y, p2.y = p2.y, p1.y
-
-    return (p1, p2)
+    return order_query_corners(p1, p2)
 
 def generate_random_3d_query(bound_x: int, bound_y: int, bound_z: int) -> Tuple[Point3D, Point3D]:
     p1 = generate_random_3d_point(bound_x, bound_y, bound_z)
     p2 = generate_random_3d_point(bound_x, bound_y, bound_z)
 
     # Guarantee that query satisfies "dominates" assumption:
-    if p1.x > p2.x:
-        p1.x, p2.x = p2.x, p1.x
-    if p1.y > p2.y:
-        p1.y, p2.y = p2.y, p1.y
-    if p1.z > p2.z:
-        p1.z, p2.z = p2.z, p1.z
+    return order_query_corners(p1, p2)
 
-    return (p1, p2)
+
+def generate_random_nd_query(bound: int, num_axes: int) -> Tuple[tuple, tuple]:
+    corners = [
+        sorted((secrets.randbelow(bound), secrets.randbelow(bound))) for _ in range(num_axes)
+    ]
+    return tuple(lo for lo, _ in corners), tuple(hi for _, hi in corners)
 
 
 # note: include token db for storage measurement for DPRF
@@ -213,11 +229,9 @@ def run_benchmarks(schemes, datasets, run_query, benchmark):
 
     i = 0
     for ds, bound in datasets:
-        is_2d_database = isinstance(list(ds.keys())[0], Point)
-        if is_2d_database:
-            print(f"2d database: {bound} x {bound}")
-        else:
-            print(f"3d database: {bound} x {bound} x {bound}")
+        num_dims = len(next(iter(ds.keys())))
+        is_2d_database = num_dims == 2
+        print(f"{num_dims}d database: " + " x ".join([str(bound)] * num_dims))
 
         bucks = defaultdict(list)
         ten_bucks = defaultdict(list)
@@ -231,9 +245,12 @@ def run_benchmarks(schemes, datasets, run_query, benchmark):
                 bucks[percent_bucket].append((p1,p2))
         else:
             for ps in tqdm(range(NUM_QUERIES*100000)):
-                p1, p2 = generate_random_3d_query(bound, bound, bound)
-                range_size = (p2.x - p1.x) * (p2.y - p1.y) * (p2.z - p1.z)
-                percent_bucket = (int(100* range_size / (bound * bound*bound)))
+                if num_dims == 3:
+                    p1, p2 = generate_random_3d_query(bound, bound, bound)
+                else:
+                    p1, p2 = generate_random_nd_query(bound, num_dims)
+                range_size = prod(b - a for a, b in zip(p1, p2))
+                percent_bucket = (int(100* range_size / (bound ** num_dims)))
                 ten_bucks[10*int(percent_bucket/10)].append((p1,p2))
                 bucks[percent_bucket].append((p1,p2))
 
@@ -255,7 +272,7 @@ def run_benchmarks(schemes, datasets, run_query, benchmark):
 
             t0 = time.time_ns()
             print("Building index...")
-            s = scheme(EMMEngine(bound, bound))
+            s = scheme(EMMEngine(bound, bound, compact_label_bytes=COMPACT_LABEL_BYTES))
             key = s.setup(16)
             s.build_index(key, ds)
             t1 = time.time_ns()
@@ -275,12 +292,7 @@ def run_benchmarks(schemes, datasets, run_query, benchmark):
                     false_positive_s.build_index(false_positive_key, ds)
 
             print("Accumulating storage results...")
-            encrypted_db_size = sum(
-                        (
-                            sys.getsizeof(k) + sys.getsizeof(v)
-                            for k, v in s.encrypted_db.items()
-                        )
-                    )
+            encrypted_db_size = measure_encrypted_db_size(s.encrypted_db)
 
             if run_query:
                 print("Running query benchmarks!...")
@@ -296,7 +308,7 @@ def run_benchmarks(schemes, datasets, run_query, benchmark):
                         if is_2d_database:
                             range_size = (p2.x - p1.x) * (p2.y - p1.y)
                         else:
-                            range_size = (p2.x - p1.x) * (p2.y - p1.y) * (p2.z - p1.z)
+                            range_size = prod(b - a for a, b in zip(p1, p2))
 
                         t0 = time.time_ns()
                         to_be_sent = s.trapdoor(key, p1, p2)
@@ -402,6 +414,44 @@ def run_benchmarks(schemes, datasets, run_query, benchmark):
     )
 
 
+def run_label_encoding_benchmark(
+    postings_lengths: Sequence[int] = tuple(2 ** i for i in range(6, 15)),
+    label_formats: Sequence[int] = (LABEL_FORMAT_LEGACY, LABEL_FORMAT_COUNTER),
+):
+    """
+    Measures EMMEngine build/search time for a single label as its postings
+    list grows. Time per value should stay flat for LABEL_FORMAT_COUNTER and
+    grow linearly for LABEL_FORMAT_LEGACY.
+    """
+    results = defaultdict(list)
+    for label_format in label_formats:
+        engine = EMMEngine(BOUND_X, BOUND_Y, label_format=label_format)
+        key = engine.setup(16)
+        for length in postings_lengths:
+            plaintext_mm = {b"label": [SecureRandom(DOC_LENGTH) for _ in range(length)]}
+
+            t0 = time.time_ns()
+            encrypted_db = engine.build_index(key, plaintext_mm)
+            t1 = time.time_ns()
+            build_time = t1 - t0
+
+            token = engine.trapdoor(key, b"label")
+            t0 = time.time_ns()
+            response = engine.search(token, encrypted_db)
+            t1 = time.time_ns()
+            search_time = t1 - t0
+
+            assert len(response) == length
+            results[label_format].append((length, build_time, search_time))
+
+    print("LabelFormat,PostingsLength,BuildTimeNS,SearchTimeNS,BuildNSPerValue,SearchNSPerValue")
+    for label_format, rows in results.items():
+        for length, build_time, search_time in rows:
+            print(f"{label_format},{length},{build_time},{search_time},{build_time // length},{search_time // length}")
+
+    return results
+
+
 def running_avg(numbers):
     for count in range(1, len(numbers) + 1):
         yield sum(numbers[:count]) / count
@@ -420,34 +470,36 @@ if __name__ == "__main__":
     data_file = args.dataset
     datasets = []
 
+    if data_file == "label_encoding":
+        run_label_encoding_benchmark()
+        sys.exit(0)
+
     NUM_QUERIES = int(args.num_queries)
     print("NUM_QUERIES", NUM_QUERIES)
     if "pickle" in data_file:
         with open(data_file, 'rb') as f:
             dpts = pickle.load(f)
 
-
-        pts = []
-
         if "gowalla_" in data_file or "spitz" in data_file:
-            pts = dpts
+            pts = PointArray.from_points(dpts)
         else:
-            for i in dpts:
-                for j in range(dpts[i]):
-                    pts.append(i)
+            pts = PointArray.from_counts(dpts)
     else:
         with open(data_file) as fp:
-            pts = json.load(fp)
+            pts = PointArray.from_points(json.load(fp))
 
-    num_dims = len(pts[0])
+    num_dims = pts.num_axes
 
     if int(args.num_records) == -1:
         args.num_records = len(pts)
 
     if num_dims == 2:
-        datasets.append(points_to_multimap(random.sample(pts, int(args.num_records))))
+        sample = random.sample(range(len(pts)), int(args.num_records))
+        datasets.append(points_to_multimap(pts[np.array(sample, dtype=np.int64)]))
     elif num_dims == 3:
         datasets.append(points_3d_to_multimap(pts[0 : int(args.num_records)]))
+    else:
+        datasets.append(points_nd_to_multimap(pts[0 : int(args.num_records)]))
 
     scheme_dict = {
         "range_brc": RangeBRC,
@@ -461,6 +513,9 @@ if __name__ == "__main__":
         "quad_brc_3d": QuadBRC3D,
         "tdag_src":TdagSRC,
         "tdag_src_3d":TdagSRC3D,
+        "range_brc_nd": RangeBRCND,
+        "range_urc_nd": RangeURCND,
+        "tdag_src_nd": TdagSRCND,
 
     }
     schemes = [scheme_dict[args.scheme_name]]
@@ -0,0 +1,160 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_TRUNCATED_LABEL_BYTES = 16
+
+
+class CompactEDB:
+    """
+    An in-memory encrypted index stored in a few flat arrays instead of a
+    dict of `bytes` objects.
+
+    Labels are truncated to `label_bytes` bytes and kept in a sorted NumPy
+    array; the ciphertexts are concatenated into one `bytes` heap, with
+    `offsets[i]:offsets[i + 1]` delimiting the value of the i-th label.
+    Lookups binary-search the label array with `np.searchsorted`, and
+    `get_many` resolves a whole batch of labels with one call.
+
+    Truncation is safe because labels are uniformly distributed hash
+    outputs; a collision among the stored labels is detected when the index
+    is built.
+    """
+
+    def __init__(self, labels: np.ndarray, offsets: np.ndarray, heap: bytes):
+        self.labels = labels
+        self.offsets = offsets
+        self.heap = heap
+        self.label_bytes = labels.dtype.itemsize
+
+    @classmethod
+    def from_dict(
+        cls,
+        encrypted_db: Dict[bytes, bytes],
+        label_bytes: int = DEFAULT_TRUNCATED_LABEL_BYTES,
+    ) -> "CompactEDB":
+        """
+        Packs the output of `EMMEngine.build_index` into a `CompactEDB`.
+        """
+        truncated = np.array(
+            [label[:label_bytes] for label in encrypted_db.keys()],
+            dtype=f"S{label_bytes}",
+        )
+        values = list(encrypted_db.values())
+
+        order = np.argsort(truncated, kind="stable")
+        labels = truncated[order]
+        if len(labels) > 1 and np.any(labels[1:] == labels[:-1]):
+            raise ValueError(
+                f"Labels collide when truncated to {label_bytes} bytes; use a larger width"
+            )
+
+        lengths = np.fromiter(
+            (len(values[i]) for i in order), dtype=np.int64, count=len(values)
+        )
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        heap = b"".join(values[i] for i in order)
+        return cls(labels, offsets, heap)
+
+    def _truncate(self, label: bytes) -> Optional[bytes]:
+        if len(label) < self.label_bytes:
+            return None
+        return label[: self.label_bytes]
+
+    def _value(self, position: int) -> bytes:
+        return self.heap[self.offsets[position] : self.offsets[position + 1]]
+
+    def get(self, label: bytes, default=None):
+        probe = self._truncate(label)
+        if probe is None or len(self.labels) == 0:
+            return default
+        position = int(np.searchsorted(self.labels, probe))
+        # NumPy drops trailing NUL bytes when it hands out an element of an
+        # "S" array, so compare against the probe with those removed:
+        if position < len(self.labels) and self.labels[position] == probe.rstrip(b"\x00"):
+            return self._value(position)
+        return default
+
+    def get_many(self, labels: List[bytes]) -> List[Optional[bytes]]:
+        """
+        Looks up a batch of labels at once; outputs the value of each label,
+        or None for labels that are not in the index.
+        """
+        if len(labels) == 0:
+            return []
+        if len(self.labels) == 0:
+            return [None] * len(labels)
+
+        probes = np.array(
+            [label[: self.label_bytes] for label in labels], dtype=self.labels.dtype
+        )
+        positions = np.searchsorted(self.labels, probes)
+        np.minimum(positions, len(self.labels) - 1, out=positions)
+        found = (self.labels[positions] == probes).tolist()
+        starts = self.offsets[positions].tolist()
+        ends = self.offsets[positions + 1].tolist()
+
+        heap = self.heap
+        label_bytes = self.label_bytes
+        return [
+            heap[start:end] if is_found and len(label) >= label_bytes else None
+            for label, is_found, start, end in zip(labels, found, starts, ends)
+        ]
+
+    def __getitem__(self, label: bytes) -> bytes:
+        value = self.get(label)
+        if value is None:
+            raise KeyError(label)
+        return value
+
+    def __contains__(self, label: bytes) -> bool:
+        return self.get(label) is not None
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def items(self) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        Iterates over (truncated label, value) pairs.
+        """
+        for position in range(len(self.labels)):
+            yield self.labels[position].ljust(self.label_bytes, b"\x00"), self._value(position)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for position in range(len(self.labels)):
+            yield self.labels[position].ljust(self.label_bytes, b"\x00")
+
+    def keys(self) -> Iterator[bytes]:
+        return iter(self)
+
+    def values(self) -> Iterator[bytes]:
+        for position in range(len(self.labels)):
+            yield self._value(position)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes held by the index arrays and the heap.
+        """
+        return self.labels.nbytes + self.offsets.nbytes + len(self.heap)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + self.nbytes
@@ -17,26 +17,188 @@
 
 from ...util.crypto import (
     SecureRandom,
-    HashKDF,
-    HMAC,
-    Hash,
     SymmetricEncrypt,
     SymmetricDecrypt,
+    HashKDF,
+    Hash,
+    HMACContext,
+    SymmetricContext,
 )
 
-from typing import List, Dict, Set
+from .compact_edb import CompactEDB
+from .mmap_edb import MmapEDB, write_mmap_edb
+
+from typing import Iterable, List, Dict, Optional, Set, Tuple, Union
 from tqdm import tqdm
 
+import multiprocessing
+import struct
+
 PURPOSE_HMAC = "hmac"
 PURPOSE_ENCRYPT = "encryption"
+PURPOSE_LENGTH_HINT = "length"
+
+# Ciphertext label formats. Each value stored under a search token is placed
+# at Hash(token + encode(index)):
+#
+#   LABEL_FORMAT_LEGACY  - encode(index) = bytes(index), i.e. `index` zero
+#                          bytes. Hash input grows with the position in the
+#                          postings list. Kept so old indexes can be read.
+#   LABEL_FORMAT_COUNTER - encode(index) = 8-byte big-endian counter.
+LABEL_FORMAT_LEGACY = 0
+LABEL_FORMAT_COUNTER = 1
+DEFAULT_LABEL_FORMAT = LABEL_FORMAT_COUNTER
+
+_COUNTER = struct.Struct(">Q")
+
+# Suffix of the label holding a token's postings list length (see
+# `length_hint_label`). It cannot collide with an index label: it is not 8
+# bytes long like a counter, and it is not all zero bytes like a legacy one.
+LENGTH_HINT_SUFFIX = b"length"
+
+# Shards handed out per worker in a parallel build; more shards than workers
+# keeps the pool busy when postings list lengths are skewed.
+SHARDS_PER_PROCESS = 4
+
+
+def encode_label_counter(index: int, label_format: int = DEFAULT_LABEL_FORMAT) -> bytes:
+    """
+    Encodes the position of a value in a postings list for the given label
+    format.
+    """
+    if label_format == LABEL_FORMAT_COUNTER:
+        return _COUNTER.pack(index)
+    elif label_format == LABEL_FORMAT_LEGACY:
+        return bytes(index)
+    else:
+        raise ValueError(f"Unknown label format: {label_format}")
+
+
+def ciphertext_label(search_token: bytes, index: int, label_format: int) -> bytes:
+    """
+    Outputs the label under which the `index`-th value for `search_token` is
+    stored.
+    """
+    return Hash(search_token + encode_label_counter(index, label_format))
+
+
+def length_hint_label(search_token: bytes) -> bytes:
+    """
+    Outputs the label under which the postings list length of
+    `search_token` is stored when an index is built with length hints.
+    """
+    return Hash(search_token + LENGTH_HINT_SUFFIX)
+
+
+def _length_hint_key(search_token: bytes) -> bytes:
+    """
+    Outputs the AES key a length hint is encrypted under. It is derived from
+    the search token, so the server can only decrypt the hint of a token it
+    has been given.
+    """
+    return HashKDF(search_token, PURPOSE_LENGTH_HINT)[:16]
+
+
+def encrypt_length_hint(search_token: bytes, length: int, value_length: int) -> bytes:
+    """
+    Encrypts the postings list length of `search_token`. The plaintext is
+    zero-padded to `value_length` bytes so the hint has the same size as the
+    ciphertext of a value of that length.
+    """
+    plaintext = _COUNTER.pack(length).ljust(value_length, b"\x00")
+    return SymmetricEncrypt(_length_hint_key(search_token), plaintext)
 
-DO_NOT_ENCRYPT = False
+
+def decrypt_length_hint(search_token: bytes, hint: bytes) -> int:
+    """
+    Outputs the postings list length stored in a hint from
+    `encrypt_length_hint`.
+    """
+    plaintext = SymmetricDecrypt(_length_hint_key(search_token), hint)
+    return _COUNTER.unpack_from(plaintext)[0]
+
+
+def _encrypt_postings(
+    hmac_context: HMACContext,
+    symmetric_context: SymmetricContext,
+    label_format: int,
+    store_length_hint: bool,
+    label: bytes,
+    values: List[bytes],
+    encrypted_db: Dict[bytes, bytes],
+) -> None:
+    """
+    Encrypts the postings list of a single label into `encrypted_db`.
+    """
+    token = hmac_context.digest(label)
+    ct_values = symmetric_context.encrypt_many(values)
+    for index, ct_value in enumerate(ct_values):
+        encrypted_db[ciphertext_label(token, index, label_format)] = ct_value
+    if store_length_hint and len(values) > 0:
+        encrypted_db[length_hint_label(token)] = encrypt_length_hint(
+            token, len(values), len(values[0])
+        )
+
+
+def _encrypt_shard(shard) -> Dict[bytes, bytes]:
+    """
+    Worker entry point for parallel builds; encrypts a list of
+    (label, values) pairs.
+    """
+    hmac_key, enc_key, label_format, store_length_hints, items = shard
+    hmac_context = HMACContext(hmac_key)
+    symmetric_context = SymmetricContext(enc_key)
+    encrypted_shard = {}
+    for label, values in items:
+        _encrypt_postings(
+            hmac_context,
+            symmetric_context,
+            label_format,
+            store_length_hints,
+            label,
+            values,
+            encrypted_shard,
+        )
+    return encrypted_shard
 
 
 class EMMEngine:
-    def __init__(self, max_x: int, max_y: int):
+    def __init__(
+        self,
+        max_x: int,
+        max_y: int,
+        label_format: int = DEFAULT_LABEL_FORMAT,
+        num_processes: int = 1,
+        compact_label_bytes: Optional[int] = None,
+        store_length_hints: bool = False,
+    ):
+        """
+        `num_processes` > 1 encrypts the index in a pool of that many worker
+        processes. The output has the same labels and plaintext values as a
+        serial build.
+
+        If `compact_label_bytes` is set, `build_index` outputs a `CompactEDB`
+        with labels truncated to that many bytes instead of a dict.
+
+        If `store_length_hints` is set, the index also stores the postings
+        list length of every token, so `count` answers in O(1) per token.
+        Each hint is encrypted under a key derived from the token and padded
+        to the size of the token's first value ciphertext, so the server can
+        only read it once it is given the token. Hints do add one entry per
+        non-empty postings list to the index.
+        """
         self.MAX_X = max_x
         self.MAX_Y = max_y
+        # Fail early on an unknown format rather than on the first search:
+        encode_label_counter(0, label_format)
+        self.label_format = label_format
+        self.num_processes = num_processes
+        self.compact_label_bytes = compact_label_bytes
+        self.store_length_hints = store_length_hints
+        # Keyed crypto contexts of the most recently used key, derived once
+        # and reused until a different key is passed in:
+        self._context_key = None
+        self._key_contexts = None
 
     def setup(self, security_parameter: int) -> bytes:
         """
@@ -50,26 +212,109 @@ class EMMEngine:
         """
         Outputs an encrypted index I.
         """
-        hmac_key = HashKDF(key, PURPOSE_HMAC)
-        enc_key = HashKDF(key, PURPOSE_ENCRYPT)
-
         print("Encrypting with Pi_bas...")
-        if not DO_NOT_ENCRYPT:
+        if self.num_processes > 1:
+            hmac_key, enc_key = self._subkeys(key)
+            encrypted_db = self._build_index_parallel(hmac_key, enc_key, plaintext_mm)
+        else:
+            hmac_context, symmetric_context = self._contexts(key)
             encrypted_db = {}
             for label, values in tqdm(plaintext_mm.items()):
-                token = HMAC(hmac_key, label)
-                for index, value in enumerate(values):
-                    ct_label = Hash(token + bytes(index))
-                    ct_value = SymmetricEncrypt(enc_key, value)
-                    encrypted_db[ct_label] = ct_value
-            return encrypted_db
-        else:
-            print("WARNING: Not encrypting!")
-            return {}
+                _encrypt_postings(
+                    hmac_context,
+                    symmetric_context,
+                    self.label_format,
+                    self.store_length_hints,
+                    label,
+                    values,
+                    encrypted_db,
+                )
+
+        if self.compact_label_bytes is not None:
+            return CompactEDB.from_dict(encrypted_db, self.compact_label_bytes)
+        return encrypted_db
+
+    def _build_index_parallel(
+        self, hmac_key: bytes, enc_key: bytes, plaintext_mm: Dict[bytes, List[bytes]]
+    ) -> Dict[bytes, bytes]:
+        """
+        Partitions the labels of `plaintext_mm` into shards, encrypts each shard
+        in a worker process and merges the resulting encrypted shards.
+        """
+        items = list(plaintext_mm.items())
+        num_shards = min(len(items), self.num_processes * SHARDS_PER_PROCESS)
+        shards = [
+            (
+                hmac_key,
+                enc_key,
+                self.label_format,
+                self.store_length_hints,
+                items[i::num_shards],
+            )
+            for i in range(num_shards)
+        ]
+
+        encrypted_db = {}
+        with multiprocessing.Pool(processes=self.num_processes) as pool:
+            for encrypted_shard in tqdm(
+                pool.imap_unordered(_encrypt_shard, shards), total=num_shards
+            ):
+                encrypted_db.update(encrypted_shard)
+        return encrypted_db
+
+    def save_index(self, encrypted_db: Union[Dict[bytes, bytes], CompactEDB], path: str) -> None:
+        """
+        Writes an encrypted index produced by `build_index` to `path` in the
+        memory-mapped index format (see mmap_edb.py). The labels of a
+        CompactEDB are stored truncated, as they are held in memory.
+        """
+        write_mmap_edb(path, encrypted_db, self.label_format)
+
+    def open_index(self, path: str) -> MmapEDB:
+        """
+        Opens an index written by `save_index`. The result can be passed to
+        `search` (or as a scheme's `encrypted_db`) in place of a dict.
+        """
+        encrypted_db = MmapEDB(path)
+        if encrypted_db.label_format != self.label_format:
+            encrypted_db.close()
+            raise ValueError(
+                f"Index {path} uses label format {encrypted_db.label_format}, "
+                f"but this engine uses {self.label_format}"
+            )
+        return encrypted_db
+
+    def ciphertext_label(self, search_token: bytes, index: int) -> bytes:
+        """
+        Outputs the label under which the `index`-th value for `search_token`
+        is stored.
+        """
+        return ciphertext_label(search_token, index, self.label_format)
+
+    def _subkeys(self, key: bytes) -> Tuple[bytes, bytes]:
+        """
+        Outputs the (HMAC, encryption) subkeys derived from `key`.
+        """
+        return HashKDF(key, PURPOSE_HMAC), HashKDF(key, PURPOSE_ENCRYPT)
+
+    def _contexts(self, key: bytes) -> Tuple[HMACContext, SymmetricContext]:
+        """
+        Outputs the keyed HMAC and cipher contexts for `key`. Only the contexts
+        of the last key are kept, so they are rederived when the key changes.
+        """
+        if self._key_contexts is None or key != self._context_key:
+            hmac_key, enc_key = self._subkeys(key)
+            self._key_contexts = (HMACContext(hmac_key), SymmetricContext(enc_key))
+            self._context_key = key
+        return self._key_contexts
 
     def trapdoor(self, key: bytes, label: bytes) -> bytes:
-        hmac_key = HashKDF(key, PURPOSE_HMAC)
-        return HMAC(hmac_key, label)
+        hmac_context, _ = self._contexts(key)
+        return hmac_context.digest(label)
+
+    def trapdoor_many(self, key: bytes, labels: List[bytes]) -> List[bytes]:
+        hmac_context, _ = self._contexts(key)
+        return hmac_context.digest_many(labels)
 
     def search(
         self, search_token: bytes, encrypted_db: dict[bytes, bytes]
@@ -79,21 +324,99 @@ class EMMEngine:
         # Iterate until can't find any more records:
         index = 0
         while True:
-            ct_label = Hash(search_token + bytes(index))
-            if ct_label in encrypted_db:
-                data = encrypted_db[ct_label]
-                if not isinstance(data, list):
-                    data = [data]
-                results.update(data)
-            else:
+            data = encrypted_db.get(self.ciphertext_label(search_token, index))
+            if data is None:
                 break
+            if not isinstance(data, list):
+                data = [data]
+            results.update(data)
             index += 1
 
         return results
 
+    def search_many(
+        self, search_tokens: Iterable[bytes], encrypted_db, count_only: bool = False
+    ) -> Union[Set[bytes], int]:
+        """
+        Searches for several tokens at once and outputs the union of their
+        responses (or only its size if `count_only` is set).
+
+        All tokens are probed together, one postings list position per round,
+        so an index with a batched `get_many` (e.g. CompactEDB) resolves each
+        round with a single call. Responses are merged into one set in place.
+        """
+        active_tokens = list(dict.fromkeys(search_tokens))
+        get_many = getattr(encrypted_db, "get_many", None)
+
+        results = set()
+        count = 0
+        if count_only and self.store_length_hints:
+            hint_labels = [length_hint_label(token) for token in active_tokens]
+            if get_many is not None:
+                hints = get_many(hint_labels)
+            else:
+                hints = [encrypted_db.get(hint_label) for hint_label in hint_labels]
+
+            # Tokens without a hint have no values or come from an index built
+            # without hints; only the latter need to be walked:
+            unhinted_tokens = []
+            for token, hint in zip(active_tokens, hints):
+                if hint is None:
+                    unhinted_tokens.append(token)
+                else:
+                    count += decrypt_length_hint(token, hint)
+            active_tokens = unhinted_tokens
+
+        index = 0
+        while active_tokens:
+            ct_labels = [
+                ciphertext_label(token, index, self.label_format)
+                for token in active_tokens
+            ]
+            if get_many is not None:
+                found = get_many(ct_labels)
+            else:
+                found = [encrypted_db.get(ct_label) for ct_label in ct_labels]
+
+            next_tokens = []
+            for token, data in zip(active_tokens, found):
+                if data is None:
+                    continue
+                next_tokens.append(token)
+                if isinstance(data, list):
+                    if count_only:
+                        count += len(data)
+                    else:
+                        results.update(data)
+                elif count_only:
+                    count += 1
+                else:
+                    results.add(data)
+            active_tokens = next_tokens
+            index += 1
+
+        return count if count_only else results
+
+    def count(self, search_token: bytes, encrypted_db) -> int:
+        """
+        Outputs the number of values `search` would return for
+        `search_token`, without building the response set.
+        """
+        if self.store_length_hints:
+            hint = encrypted_db.get(length_hint_label(search_token))
+            if hint is not None:
+                return decrypt_length_hint(search_token, hint)
+
+        count = 0
+        index = 0
+        while True:
+            data = encrypted_db.get(self.ciphertext_label(search_token, index))
+            if data is None:
+                break
+            count += len(data) if isinstance(data, list) else 1
+            index += 1
+        return count
+
     def resolve(self, key: bytes, results: Set[bytes]) -> Set[bytes]:
-        enc_key = HashKDF(key, PURPOSE_ENCRYPT)
-        pt_values = set()
-        for ct_value in results:
-            pt_values.add(SymmetricDecrypt(enc_key, ct_value))
-        return pt_values
+        _, symmetric_context = self._contexts(key)
+        return set(symmetric_context.decrypt_many(results))
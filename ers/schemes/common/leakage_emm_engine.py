@@ -0,0 +1,89 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from .emm_engine import EMMEngine
+
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+
+class LeakageEMMEngine(EMMEngine):
+    """
+    A drop-in replacement for EMMEngine that produces the same leakage (which
+    search tokens a query uses and how many values each token returns)
+    without doing any cryptography.
+
+    The "encrypted" index maps integer token IDs to postings list lengths.
+    Token IDs are assigned to plaintext labels in the order they are first
+    seen, so they are deterministic for a given build. Search responses are
+    sets of (token ID, index) pairs, which keeps response sizes and the
+    union semantics of multi-token schemes identical to EMMEngine.
+
+    Only use this for leakage simulation (e.g. attack experiments); nothing
+    is hidden from the server.
+    """
+
+    def __init__(self, max_x: int, max_y: int):
+        super().__init__(max_x, max_y)
+        self.token_ids: Dict[bytes, int] = {}
+
+    def _token_id(self, label: bytes) -> int:
+        token_id = self.token_ids.get(label)
+        if token_id is None:
+            token_id = len(self.token_ids)
+            self.token_ids[label] = token_id
+        return token_id
+
+    def build_index(
+        self, key: bytes, plaintext_mm: Dict[bytes, List[bytes]]
+    ) -> Dict[int, int]:
+        """
+        Outputs a leakage index mapping token IDs to postings list lengths.
+        """
+        leakage_db = {}
+        for label, values in plaintext_mm.items():
+            if len(values) > 0:
+                leakage_db[self._token_id(label)] = len(values)
+        return leakage_db
+
+    def trapdoor(self, key: bytes, label: bytes) -> int:
+        return self._token_id(label)
+
+    def trapdoor_many(self, key: bytes, labels: List[bytes]) -> List[int]:
+        return [self._token_id(label) for label in labels]
+
+    def count(self, search_token: int, leakage_db: Dict[int, int]) -> int:
+        return leakage_db.get(search_token, 0)
+
+    def search(
+        self, search_token: int, leakage_db: Dict[int, int]
+    ) -> Set[Tuple[int, int]]:
+        return {(search_token, index) for index in range(leakage_db.get(search_token, 0))}
+
+    def search_many(
+        self, search_tokens: Iterable[int], leakage_db: Dict[int, int], count_only: bool = False
+    ) -> Union[Set[Tuple[int, int]], int]:
+        search_tokens = set(search_tokens)
+        if count_only:
+            return sum(leakage_db.get(token, 0) for token in search_tokens)
+
+        results = set()
+        for token in search_tokens:
+            results.update((token, index) for index in range(leakage_db.get(token, 0)))
+        return results
+
+    def resolve(self, key: bytes, results: Set[Tuple[int, int]]) -> Set[Tuple[int, int]]:
+        return set(results)
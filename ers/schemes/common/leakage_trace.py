@@ -0,0 +1,325 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+from .leakage_emm_engine import LeakageEMMEngine
+from ...structures.columnar_multimap import take_slices
+from ...structures.point import Point
+from ...structures.point_3d import Point3D
+from ...util.labels import KIND_INTERVALS, KIND_POINT, decode_label
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
+
+import itertools
+import random
+import struct
+
+import numpy as np
+
+# On-disk layout of a leakage trace (all integers little-endian):
+#
+#   header        - magic, format version, number of axes, number of
+#                   queries, number of distinct tokens, total number of
+#                   query tokens
+#   domain        - int64[num_axes]: the domain size along each axis
+#   query_offsets - int64[num_queries + 1]: query q used the tokens
+#                   query_tokens[query_offsets[q]:query_offsets[q + 1]]
+#   query_volumes - int64[num_queries]: the response volume of each query
+#   query_bounds  - int64[num_queries, 2 * num_axes]: the plaintext query,
+#                   as its start coordinates followed by its end coordinates
+#   token_volumes - int64[num_tokens]: the volume a token returns on its own
+#   token_bounds  - int64[num_tokens, 2 * num_axes]: the plaintext node of
+#                   each token like query_bounds, or -1 when it is not known
+#   query_tokens  - int32[num_query_tokens]: token ids, in increasing order
+#                   within each query
+#
+# Queries are numbered in the order they were issued and tokens in the order
+# they were first used, both from 0. Every column starts at a multiple of 8
+# bytes, so each can be memory-mapped as a NumPy array. The plaintext columns
+# are ground truth for evaluating attacks; attacks proper read only the
+# volumes and token ids.
+MAGIC = b"ERSLEAK\x00"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sIIQQQ")
+
+UNKNOWN_BOUND = -1
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _column_layout(num_axes, num_queries, num_tokens, num_query_tokens):
+    """
+    Returns (name, dtype, shape, offset) of every column, in file order.
+    """
+    columns = [
+        ("domain", "<i8", (num_axes,)),
+        ("query_offsets", "<i8", (num_queries + 1,)),
+        ("query_volumes", "<i8", (num_queries,)),
+        ("query_bounds", "<i8", (num_queries, 2 * num_axes)),
+        ("token_volumes", "<i8", (num_tokens,)),
+        ("token_bounds", "<i8", (num_tokens, 2 * num_axes)),
+        ("query_tokens", "<i4", (num_query_tokens,)),
+    ]
+    layout = []
+    offset = _HEADER.size
+    for name, dtype, shape in columns:
+        offset = _aligned(offset)
+        layout.append((name, dtype, shape, offset))
+        offset += np.dtype(dtype).itemsize * int(np.prod(shape))
+    return layout
+
+
+class LeakageTrace:
+    """
+    The leakage of a sequence of range queries: the tokens each query used,
+    the response volumes, and the volume of every token, as arrays. Traces
+    are written with `save` and opened memory-mapped with `load`.
+    """
+
+    def __init__(
+        self,
+        domain: Sequence[int],
+        query_offsets: np.ndarray,
+        query_tokens: np.ndarray,
+        query_volumes: np.ndarray,
+        query_bounds: np.ndarray,
+        token_volumes: np.ndarray,
+        token_bounds: np.ndarray,
+    ):
+        self.domain = tuple(int(size) for size in domain)
+        self.query_offsets = query_offsets
+        self.query_tokens = query_tokens
+        self.query_volumes = query_volumes
+        self.query_bounds = query_bounds
+        self.token_volumes = token_volumes
+        self.token_bounds = token_bounds
+
+    @property
+    def num_axes(self) -> int:
+        return len(self.domain)
+
+    @property
+    def num_queries(self) -> int:
+        return len(self.query_offsets) - 1
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.token_volumes)
+
+    def query_lengths(self) -> np.ndarray:
+        return np.diff(self.query_offsets)
+
+    def query(self, q: int) -> np.ndarray:
+        return self.query_tokens[self.query_offsets[q]:self.query_offsets[q + 1]]
+
+    def observations(self, queries: Optional[Iterable[int]] = None) -> Iterator[Tuple[Tuple[int, ...], int]]:
+        """
+        Yields the (token ids, volume) leakage of the given queries (all of
+        them by default), in order.
+        """
+        if queries is None:
+            queries = range(self.num_queries)
+        for q in queries:
+            yield tuple(self.query(q).tolist()), int(self.query_volumes[q])
+
+    def check_token_bounds(self) -> None:
+        """
+        Raises ValueError if some token has no plaintext bounds, as in traces
+        generated with a real (encrypting) EMM engine. Attacks that locate
+        tokens by their plaintext node cannot run on such traces.
+        """
+        if (self.token_bounds == UNKNOWN_BOUND).any():
+            raise ValueError(
+                "The trace has no plaintext token bounds; generate it with a "
+                "LeakageEMMEngine to attack it"
+            )
+
+    def token(self, token_id: int) -> Tuple[Tuple[int, int], ...]:
+        """
+        Returns the plaintext node of a token as one (start, end) interval
+        per axis.
+        """
+        bounds = self.token_bounds[token_id].tolist()
+        return tuple(zip(bounds[:self.num_axes], bounds[self.num_axes:]))
+
+    def token_id(self, intervals: Sequence[Tuple[int, int]]) -> Optional[int]:
+        """
+        Returns the id of the token whose plaintext node is the product of
+        the given (start, end) intervals, or None if no token has it.
+        """
+        bounds = [start for start, _ in intervals] + [end for _, end in intervals]
+        matches = np.flatnonzero((self.token_bounds == bounds).all(axis=1))
+        return int(matches[0]) if len(matches) else None
+
+    def distinct(self) -> "LeakageTrace":
+        """
+        Returns the trace of the first query with each set of tokens, for
+        attacks that expect to see every query once.
+        """
+        offsets = self.query_offsets.tolist()
+        seen = set()
+        keep = []
+        for q in range(self.num_queries):
+            key = self.query_tokens[offsets[q]:offsets[q + 1]].tobytes()
+            if key not in seen:
+                seen.add(key)
+                keep.append(q)
+
+        query_tokens, query_offsets = take_slices(self.query_tokens, self.query_offsets, keep)
+        return LeakageTrace(
+            self.domain,
+            query_offsets,
+            query_tokens,
+            self.query_volumes[keep],
+            self.query_bounds[keep],
+            self.token_volumes,
+            self.token_bounds,
+        )
+
+    def save(self, path: str) -> None:
+        arrays = vars(self)
+        layout = _column_layout(self.num_axes, self.num_queries, self.num_tokens, len(self.query_tokens))
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(
+                MAGIC, FORMAT_VERSION, self.num_axes,
+                self.num_queries, self.num_tokens, len(self.query_tokens),
+            ))
+            for name, dtype, shape, offset in layout:
+                f.write(b"\x00" * (offset - f.tell()))
+                f.write(np.ascontiguousarray(arrays[name], dtype=dtype).reshape(shape).tobytes())
+
+    @classmethod
+    def load(cls, path: str) -> "LeakageTrace":
+        """
+        Opens a trace written by `save`. The columns are memory-mapped, so
+        this takes the same time whatever the size of the trace.
+        """
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"{path} is not a leakage trace file")
+        magic, version, num_axes, num_queries, num_tokens, num_query_tokens = _HEADER.unpack(header)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} leakage trace file")
+
+        columns = {
+            name: np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+            if np.prod(shape) > 0 else np.zeros(shape, dtype=dtype)
+            for name, dtype, shape, offset in _column_layout(num_axes, num_queries, num_tokens, num_query_tokens)
+        }
+        return cls(**columns)
+
+
+def _make_point(coords: Sequence[int]):
+    return {2: Point, 3: Point3D}.get(len(coords), lambda *coords: coords)(*coords)
+
+
+def all_range_queries(domain: Sequence[int]) -> Iterator[Tuple[tuple, tuple]]:
+    """
+    Yields every range query over the domain, as (start, end) points.
+    """
+    axis_intervals = [
+        [(lo, hi) for lo in range(size) for hi in range(lo, size)] for size in domain
+    ]
+    for intervals in itertools.product(*axis_intervals):
+        yield _make_point([lo for lo, _ in intervals]), _make_point([hi for _, hi in intervals])
+
+
+def uniform_range_queries(
+    domain: Sequence[int], num_queries: int, seed: Optional[int] = None
+) -> Iterator[Tuple[tuple, tuple]]:
+    """
+    Yields `num_queries` range queries whose intervals along each axis are
+    drawn uniformly from all the intervals of that axis.
+    """
+    rng = random.Random(seed)
+    for _ in range(num_queries):
+        intervals = []
+        for size in domain:
+            # The interval [lo, hi] is the (lo + 1)-th of those starting at
+            # lo, and size - lo intervals start at each lo:
+            index = rng.randrange(size * (size + 1) // 2)
+            lo = 0
+            while index >= size - lo:
+                index -= size - lo
+                lo += 1
+            intervals.append((lo, lo + index))
+        yield _make_point([lo for lo, _ in intervals]), _make_point([hi for _, hi in intervals])
+
+
+def _label_bounds(label: bytes) -> Sequence[int]:
+    kind, coords = decode_label(label)
+    if kind == KIND_INTERVALS:
+        return list(coords[0::2]) + list(coords[1::2])
+    if kind == KIND_POINT:
+        return list(coords) * 2
+    return list(coords)
+
+
+def generate_leakage_trace(
+    scheme, key: bytes, queries: Iterable[Tuple[tuple, tuple]], domain: Sequence[int]
+) -> LeakageTrace:
+    """
+    Issues `queries` against a built instance of any scheme in ers.schemes
+    and records its leakage. With a LeakageEMMEngine the plaintext node of
+    each token is recovered from its label (schemes whose labels end one
+    past the node set label_end_exclusive); with any other engine the token
+    bounds are left unknown.
+    """
+    num_axes = len(domain)
+    token_ids = {}
+    tokens = []
+    query_offsets = [0]
+    query_tokens = []
+    query_volumes = []
+    query_bounds = []
+
+    for p1, p2 in queries:
+        trapdoor = scheme.trapdoor(key, p1, p2)
+        used = trapdoor if isinstance(trapdoor, (set, frozenset, list, tuple)) else [trapdoor]
+        ids = set()
+        for token in used:
+            token_id = token_ids.get(token)
+            if token_id is None:
+                token_id = token_ids[token] = len(tokens)
+                tokens.append(token)
+            ids.add(token_id)
+
+        query_tokens.extend(sorted(ids))
+        query_offsets.append(len(query_tokens))
+        query_volumes.append(scheme.count(trapdoor))
+        query_bounds.append(list(p1) + list(p2))
+
+    engine = scheme.emm_engine
+    token_volumes = [engine.count(token, scheme.encrypted_db) for token in tokens]
+    token_bounds = np.full((len(tokens), 2 * num_axes), UNKNOWN_BOUND, dtype=np.int64)
+    if isinstance(engine, LeakageEMMEngine):
+        labels = {token_id: label for label, token_id in engine.token_ids.items()}
+        for i, token in enumerate(tokens):
+            token_bounds[i] = _label_bounds(labels[token])
+        if getattr(scheme, "label_end_exclusive", False):
+            token_bounds[:, num_axes:] -= 1
+
+    return LeakageTrace(
+        domain,
+        np.array(query_offsets, dtype=np.int64),
+        np.array(query_tokens, dtype=np.int32),
+        np.array(query_volumes, dtype=np.int64),
+        np.array(query_bounds, dtype=np.int64).reshape(-1, 2 * num_axes),
+        np.array(token_volumes, dtype=np.int64),
+        token_bounds,
+    )
@@ -0,0 +1,229 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from typing import Dict, Iterator, Optional, Tuple
+
+import mmap
+import os
+import struct
+
+# On-disk layout of an encrypted index (all integers little-endian):
+#
+#   header - magic, format version, EMM label format, label width,
+#            number of slots, number of entries, table offset, heap offset
+#   table  - `num_slots` fixed-width slots of an open-addressing hash table
+#            with linear probing. Each slot holds
+#                label (label_width bytes) | heap offset (uint64) |
+#                value length (uint32) | occupied flag (uint32)
+#   heap   - every ciphertext value, stored back to back
+#
+# Labels are uniformly distributed hash outputs, so their first eight bytes
+# are used directly as the slot hash. The table is kept at most half full so
+# probe sequences stay short.
+#
+# The stored labels may be truncated (e.g. when a CompactEDB is saved); the
+# label width in the header is then the truncation width, and lookups
+# truncate longer labels to it before probing.
+MAGIC = b"ERSEDB\x00\x00"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sIIIQQQQ")
+_SLOT_METADATA = struct.Struct("<QII")
+_SLOT_HASH = struct.Struct("<Q")
+
+SLOT_EMPTY = 0
+SLOT_OCCUPIED = 1
+
+MAX_LOAD_FACTOR = 0.5
+
+
+def _num_slots_for(num_entries: int) -> int:
+    num_slots = 1
+    while num_slots * MAX_LOAD_FACTOR < max(num_entries, 1):
+        num_slots *= 2
+    return num_slots
+
+
+def write_mmap_edb(
+    path: str, encrypted_db: Dict[bytes, bytes], label_format: int
+) -> None:
+    """
+    Writes the output of `EMMEngine.build_index` (a dict or a CompactEDB) to
+    `path` in the memory-mapped index format. All labels must have the same
+    width, of at least 8 bytes.
+    """
+    num_entries = len(encrypted_db)
+    label_width = len(next(iter(encrypted_db))) if num_entries > 0 else 0
+    if num_entries > 0 and label_width < _SLOT_HASH.size:
+        raise ValueError(f"Labels must be at least {_SLOT_HASH.size} bytes wide")
+    num_slots = _num_slots_for(num_entries)
+    slot_size = label_width + _SLOT_METADATA.size
+
+    table_offset = _HEADER.size
+    heap_offset = table_offset + num_slots * slot_size
+    heap_size = sum(len(value) for value in encrypted_db.values())
+    total_size = heap_offset + heap_size
+
+    with open(path, "w+b") as f:
+        f.truncate(total_size)
+        with mmap.mmap(f.fileno(), total_size) as mm:
+            _HEADER.pack_into(
+                mm,
+                0,
+                MAGIC,
+                FORMAT_VERSION,
+                label_format,
+                label_width,
+                num_slots,
+                num_entries,
+                table_offset,
+                heap_offset,
+            )
+
+            mask = num_slots - 1
+            cursor = 0
+            for label, value in encrypted_db.items():
+                if len(label) != label_width:
+                    raise ValueError("All labels must have the same width")
+
+                mm[heap_offset + cursor : heap_offset + cursor + len(value)] = value
+
+                slot = _SLOT_HASH.unpack_from(label)[0] & mask
+                while True:
+                    slot_offset = table_offset + slot * slot_size
+                    _, _, flag = _SLOT_METADATA.unpack_from(mm, slot_offset + label_width)
+                    if flag == SLOT_EMPTY:
+                        break
+                    slot = (slot + 1) & mask
+
+                mm[slot_offset : slot_offset + label_width] = label
+                _SLOT_METADATA.pack_into(
+                    mm, slot_offset + label_width, cursor, len(value), SLOT_OCCUPIED
+                )
+                cursor += len(value)
+            mm.flush()
+
+
+class MmapEDB:
+    """
+    A read-only encrypted index opened from a file written by
+    `write_mmap_edb`.
+
+    The file is mapped with `mmap`, so opening it is independent of the index
+    size, lookups only touch the pages they probe, and several processes
+    opening the same file share it through the page cache. It supports the
+    dict operations `EMMEngine.search` uses (`get`, `in`, `[]`).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size < _HEADER.size:
+            self._file.close()
+            raise ValueError(f"{path} is not an encrypted index file")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            version,
+            self.label_format,
+            self.label_width,
+            self.num_slots,
+            self.num_entries,
+            self._table_offset,
+            self._heap_offset,
+        ) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} encrypted index file")
+
+        self._slot_size = self.label_width + _SLOT_METADATA.size
+        self._mask = self.num_slots - 1
+
+    def _find_slot(self, label: bytes) -> Optional[Tuple[int, int]]:
+        """
+        Probes the table for `label`, truncated to the stored label width;
+        outputs the (heap offset, length) of its value, or None if it is not
+        in the index.
+        """
+        if len(label) < self.label_width or self.num_entries == 0:
+            return None
+        label = label[: self.label_width]
+
+        mm = self._mm
+        label_width = self.label_width
+        slot = _SLOT_HASH.unpack_from(label)[0] & self._mask
+        while True:
+            slot_offset = self._table_offset + slot * self._slot_size
+            offset, length, flag = _SLOT_METADATA.unpack_from(mm, slot_offset + label_width)
+            if flag == SLOT_EMPTY:
+                return None
+            if mm[slot_offset : slot_offset + label_width] == label:
+                return offset, length
+            slot = (slot + 1) & self._mask
+
+    def get(self, label: bytes, default=None):
+        found = self._find_slot(label)
+        if found is None:
+            return default
+        offset, length = found
+        start = self._heap_offset + offset
+        return self._mm[start : start + length]
+
+    def __getitem__(self, label: bytes) -> bytes:
+        value = self.get(label)
+        if value is None:
+            raise KeyError(label)
+        return value
+
+    def __contains__(self, label: bytes) -> bool:
+        return self._find_slot(label) is not None
+
+    def __len__(self) -> int:
+        return self.num_entries
+
+    def items(self) -> Iterator[Tuple[bytes, bytes]]:
+        mm = self._mm
+        for slot in range(self.num_slots):
+            slot_offset = self._table_offset + slot * self._slot_size
+            offset, length, flag = _SLOT_METADATA.unpack_from(
+                mm, slot_offset + self.label_width
+            )
+            if flag == SLOT_OCCUPIED:
+                start = self._heap_offset + offset
+                yield mm[slot_offset : slot_offset + self.label_width], mm[start : start + length]
+
+    def __iter__(self) -> Iterator[bytes]:
+        for label, _ in self.items():
+            yield label
+
+    def keys(self) -> Iterator[bytes]:
+        return iter(self)
+
+    def values(self) -> Iterator[bytes]:
+        for _, value in self.items():
+            yield value
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
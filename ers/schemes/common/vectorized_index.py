@@ -0,0 +1,249 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from ...structures.columnar_multimap import ColumnarMultimap
+from ...util.labels import KIND_INTERVALS
+
+from typing import Dict, Hashable, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+# The ranges of the nodes on each coordinate's root-to-leaf path, as
+# (lo, hi, valid) arrays of shape (number of coordinates, path length).
+# Unused slots (shorter paths, absent middle nodes) have valid == False.
+Paths = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# Upper bound on the number of (point, label) pairs materialized at once by
+# build_interval_multimap:
+PAIRS_PER_BLOCK = 1 << 22
+
+
+def split_multimap(plaintext_mm: Mapping[Hashable, List[bytes]], num_axes: int):
+    """
+    Splits a point multimap into a (number of points, num_axes) coordinate
+    array, the number of values of every point and all the values
+    concatenated, in iteration order. Points may be Point/Point3D objects or
+    coordinate tuples; a ColumnarMultimap is split without going through
+    per-point objects.
+    """
+    if isinstance(plaintext_mm, ColumnarMultimap):
+        return (
+            plaintext_mm.coords()[:, :num_axes],
+            plaintext_mm.record_counts(),
+            plaintext_mm.payloads(),
+        )
+    coords = np.array(
+        [_point_coords(point, num_axes) for point in plaintext_mm.keys()],
+        dtype=np.int64,
+    ).reshape(-1, num_axes)
+    lengths = np.fromiter(
+        (len(vals) for vals in plaintext_mm.values()), dtype=np.int64, count=len(coords)
+    )
+    flat_values = [val for vals in plaintext_mm.values() for val in vals]
+    return coords, lengths, flat_values
+
+
+def _point_coords(point, num_axes: int) -> Tuple[int, ...]:
+    if isinstance(point, tuple):
+        return point[:num_axes]
+    return tuple(getattr(point, axis) for axis in "xyz"[:num_axes])
+
+
+def _path_depth(domain_size: int) -> int:
+    # Number of nodes on the longest root-to-leaf path:
+    return (domain_size - 1).bit_length() + 1
+
+
+def dyadic_paths(coords: np.ndarray, domain_size: int) -> Paths:
+    """
+    Vectorized ImplicitRangeTree.get_dyadic_path: the ranges of the range
+    tree nodes over [0, domain_size - 1] from the root down to each
+    coordinate's leaf.
+    """
+    coords = np.asarray(coords, dtype=np.int64)
+    depth = _path_depth(domain_size)
+    lo_out = np.zeros((len(coords), depth), dtype=np.int64)
+    hi_out = np.zeros((len(coords), depth), dtype=np.int64)
+    valid = np.zeros((len(coords), depth), dtype=bool)
+
+    lo = np.zeros(len(coords), dtype=np.int64)
+    hi = np.full(len(coords), domain_size - 1, dtype=np.int64)
+    active = np.ones(len(coords), dtype=bool)
+    for step in range(depth):
+        lo_out[:, step], hi_out[:, step], valid[:, step] = lo, hi, active
+        active = active & (lo != hi)
+        mid = (lo + hi) >> 1
+        right = coords > mid
+        lo = np.where(right, mid + 1, lo)
+        hi = np.where(right, hi, mid)
+    return lo_out, hi_out, valid
+
+
+def tdag_paths(coords: np.ndarray, domain_size: int) -> Paths:
+    """
+    Vectorized Tdag.get_ancestor_ranges: the ranges of the TDAG nodes over
+    [0, 2^height - 1] (the domain rounded up to a power of two) containing
+    each coordinate, from the root down to its leaf, every middle node
+    right after its dyadic parent. See Tdag for the node layout.
+    """
+    coords = np.asarray(coords, dtype=np.int64)
+    height = (domain_size - 1).bit_length()
+    lo_out = np.zeros((len(coords), 2 * (height + 1)), dtype=np.int64)
+    hi_out = np.zeros((len(coords), 2 * (height + 1)), dtype=np.int64)
+    valid = np.zeros((len(coords), 2 * (height + 1)), dtype=bool)
+
+    for step, level in enumerate(range(height, -1, -1)):
+        lo = (coords >> level) << level
+        lo_out[:, 2 * step], hi_out[:, 2 * step] = lo, lo + (1 << level) - 1
+        valid[:, 2 * step] = True
+        if level >= 2:
+            quarter = 1 << (level - 2)
+            lo_out[:, 2 * step + 1] = lo + quarter
+            hi_out[:, 2 * step + 1] = lo + 3 * quarter - 1
+            offset = coords - lo
+            valid[:, 2 * step + 1] = (offset >= quarter) & (offset < 3 * quarter)
+    return lo_out, hi_out, valid
+
+
+def _dense_node_ids(paths: Paths) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Numbers the distinct ranges of an axis densely. Returns the per-slot ids
+    (-1 where invalid) and the (lo, hi) range of every id.
+    """
+    lo, hi, valid = paths
+    span = int(hi.max(initial=0)) + 1
+    keys = lo[valid] * span + hi[valid]
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    ids = np.full(lo.shape, -1, dtype=np.int64)
+    ids[valid] = inverse.reshape(-1)
+    return ids, unique_keys // span, unique_keys % span
+
+
+def encode_interval_labels(ranges: Sequence[Tuple[np.ndarray, np.ndarray]]) -> List[bytes]:
+    """
+    Vectorized labels.encode_intervals for arrays of ranges, one per axis.
+    """
+    num_coords = 2 * len(ranges)
+    dtype = np.dtype([("kind", "u1"), ("n", "u1"), ("coords", "<i4", (num_coords,))])
+    records = np.zeros(len(ranges[0][0]), dtype=dtype)
+    records["kind"] = KIND_INTERVALS
+    records["n"] = num_coords
+    for axis, (lo, hi) in enumerate(ranges):
+        records["coords"][:, 2 * axis] = lo
+        records["coords"][:, 2 * axis + 1] = hi
+    buffer = records.tobytes()
+    width = dtype.itemsize
+    return [buffer[i:i + width] for i in range(0, len(buffer), width)]
+
+
+def _group_by_key(keys: np.ndarray, num_keys: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (sorted keys, order): a stable sort of the keys. Sorting the keys
+    packed together with their positions as plain integers is much faster
+    than a stable argsort, so that is done whenever it cannot overflow.
+    """
+    size = max(len(keys), 1)
+    if num_keys * size >= 2 ** 63:
+        order = np.argsort(keys, kind="stable")
+        return keys[order], order
+    packed = np.sort(keys * size + np.arange(len(keys)))
+    return packed // size, packed % size
+
+
+def build_interval_multimap(
+    lengths: np.ndarray, flat_values: List[bytes], axis_paths: Sequence[Paths]
+) -> Dict[bytes, List[bytes]]:
+    """
+    Builds the plaintext multimap of a product-of-trees scheme: every point
+    is stored under the label of every combination of one node from each
+    axis path. Point i owns the next lengths[i] entries of `flat_values`
+    (see split_multimap). Values keep their insertion order within a label,
+    as if the points had been visited one by one.
+    """
+    axis_ids, axis_ranges = [], []
+    for paths in axis_paths:
+        ids, lo, hi = _dense_node_ids(paths)
+        axis_ids.append(ids)
+        axis_ranges.append((lo, hi))
+    radices = [len(lo) for lo, _ in axis_ranges]
+    num_labels = int(np.prod(radices, dtype=object))
+
+    # Hold the values in an object array so groups can be gathered with one
+    # fancy index:
+    lengths = np.asarray(lengths, dtype=np.int64)
+    value_starts = np.concatenate(([0], np.cumsum(lengths)))
+    values = np.empty(int(value_starts[-1]), dtype=object)
+    values[:] = flat_values
+    single_valued = bool((lengths == 1).all())
+
+    num_points = len(lengths)
+    pairs_per_point = max(int(np.prod([ids.shape[1] for ids in axis_ids])), 1)
+    block = max(PAIRS_PER_BLOCK // pairs_per_point, 1)
+
+    modified_db = {}
+    for block_start in range(0, num_points, block):
+        block_end = min(block_start + block, num_points)
+
+        # Label keys of all (point, node per axis) combinations of the block,
+        # numbered in mixed radix over the per-axis node ids:
+        keys, valid = np.zeros((block_end - block_start,) + (1,) * len(axis_ids), dtype=np.int64), True
+        for axis, ids in enumerate(axis_ids):
+            shape = [block_end - block_start] + [1] * len(axis_ids)
+            shape[axis + 1] = ids.shape[1]
+            ids = ids[block_start:block_end].reshape(shape)
+            keys = keys * radices[axis] + ids
+            valid = valid & (ids >= 0)
+        points = np.broadcast_to(
+            np.arange(block_start, block_end).reshape((-1,) + (1,) * len(axis_ids)),
+            keys.shape,
+        )[valid]
+        keys = keys[valid]
+
+        # Group by label, keeping the point order within each label (the
+        # combinations are listed point by point):
+        keys, order = _group_by_key(keys, num_labels)
+        points = points[order]
+        group_starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+        if single_valued:
+            grouped_values = values[value_starts[points]].tolist()
+            value_bounds = np.append(group_starts, len(keys)).tolist()
+        else:
+            counts = lengths[points]
+            ends = np.cumsum(counts)
+            value_index = np.repeat(value_starts[points] - ends + counts, counts)
+            value_index += np.arange(len(value_index))
+            grouped_values = values[value_index].tolist()
+            value_bounds = np.concatenate(([0], ends))[np.append(group_starts, len(keys))].tolist()
+
+        # Recover each label's node ids from its key:
+        label_keys = keys[group_starts]
+        ranges = []
+        for radix, (lo, hi) in zip(reversed(radices), reversed(axis_ranges)):
+            node_id = label_keys % radix
+            label_keys = label_keys // radix
+            ranges.append((lo[node_id], hi[node_id]))
+        labels = encode_interval_labels(ranges[::-1])
+
+        for label, start, end in zip(labels, value_bounds, value_bounds[1:]):
+            bucket = modified_db.get(label)
+            if bucket is None:
+                modified_db[label] = grouped_values[start:end]
+            else:
+                bucket.extend(grouped_values[start:end])
+
+    return modified_db
@@ -42,21 +42,19 @@ class Linear3D(EMM):
         self.encrypted_db = self.emm_engine.build_index(key, modified_db)
 
     def trapdoor(self, key: bytes, p1: Point3D, p2: Point3D) -> Set[bytes]:
-        trapdoors = set()
-
-        for point in (
-            Point3D(x, y,z) for x in range(p1.x, p2.x + 1) for y in range(p1.y, p2.y + 1) for z in range(p1.z, p2.z + 1)
-        ):
-            new_trp = self.emm_engine.trapdoor(key, bytes(point))
-            trapdoors.add(new_trp)
-        return trapdoors
+        labels = [
+            bytes(Point3D(x, y, z))
+            for x in range(p1.x, p2.x + 1)
+            for y in range(p1.y, p2.y + 1)
+            for z in range(p1.z, p2.z + 1)
+        ]
+        return set(self.emm_engine.trapdoor_many(key, labels))
 
     def search(self, trapdoors: Set[bytes]) -> Set[bytes]:
-        results = set()
-        for trpdr in trapdoors:
-            result = self.emm_engine.search(trpdr, self.encrypted_db)
-            results = results.union(result)
-        return results
+        return self.emm_engine.search_many(trapdoors, self.encrypted_db)
+
+    def count(self, trapdoors: Set[bytes]) -> int:
+        return self.emm_engine.search_many(trapdoors, self.encrypted_db, count_only=True)
 
 
 class Linear(EMM):
@@ -76,18 +74,13 @@ class Linear(EMM):
         self.encrypted_db = self.emm_engine.build_index(key, modified_db)
 
     def trapdoor(self, key: bytes, p1: Point, p2: Point) -> Set[bytes]:
-        trapdoors = set()
-
-        for point in (
-            Point(x, y) for x in range(p1.x, p2.x + 1) for y in range(p1.y, p2.y + 1)
-        ):
-            new_trp = self.emm_engine.trapdoor(key, bytes(point))
-            trapdoors.add(new_trp)
-        return trapdoors
+        labels = [
+            bytes(Point(x, y)) for x in range(p1.x, p2.x + 1) for y in range(p1.y, p2.y + 1)
+        ]
+        return set(self.emm_engine.trapdoor_many(key, labels))
 
     def search(self, trapdoors: Set[bytes]) -> Set[bytes]:
-        results = set()
-        for trpdr in trapdoors:
-            result = self.emm_engine.search(trpdr, self.encrypted_db)
-            results = results.union(result)
-        return results
+        return self.emm_engine.search_many(trapdoors, self.encrypted_db)
+
+    def count(self, trapdoors: Set[bytes]) -> int:
+        return self.emm_engine.search_many(trapdoors, self.encrypted_db, count_only=True)
@@ -18,16 +18,19 @@
 from ..structures.point import Point
 from ..structures.rect import Rect
 from ..structures.quad_tree_src import QuadTreeSRC
+from ..util.labels import encode_rect
 from .common.emm import EMM
 from .common.emm_engine import EMMEngine
 
 from typing import Dict, List
 
 import math
-import struct
 from collections import defaultdict
 
 class QdagSRC(EMM):
+    # QDAG nodes end one past their last cell, and so do their labels:
+    label_end_exclusive = True
+
     def __init__(self, emm_engine: EMMEngine, encrypted_db: Dict[bytes, bytes] = {}):
         self.encrypted_db = encrypted_db
         self.qdag = None
@@ -60,7 +63,7 @@ class QdagSRC(EMM):
 
     @classmethod
     def convert_query_to_bytes(self, p1: Point, p2: Point) -> bytes:
-        return struct.pack("iiii", p1.x, p1.y, p2.x, p2.y)
+        return encode_rect((p1.x, p1.y), (p2.x, p2.y))
 
     def _convert_rect_to_bytes(self, rect: Rect):
         """
@@ -76,4 +79,7 @@ class QdagSRC(EMM):
         )
 
     def search(self, trapdoor):
-        return self.emm_engine.search(trapdoor, self.encrypted_db)
\ No newline at end of file
+        return self.emm_engine.search(trapdoor, self.encrypted_db)
+
+    def count(self, trapdoor) -> int:
+        return self.emm_engine.count(trapdoor, self.encrypted_db)
\ No newline at end of file
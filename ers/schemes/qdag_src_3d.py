@@ -18,6 +18,7 @@
 from ..structures.point_3d import Point3D
 from ..structures.rect_3d import Rect3D
 from ..structures.quad_tree_3d_src import QuadTreeSRC3D
+from ..util.labels import encode_rect
 from .common.emm import EMM
 from .common.emm_engine import EMMEngine
 
@@ -27,10 +28,11 @@ import math
 
 from collections import defaultdict
 
-import struct
-
 
 class QdagSRC3D(EMM):
+    # QDAG nodes end one past their last cell, and so do their labels:
+    label_end_exclusive = True
+
     def __init__(self, emm_engine: EMMEngine, encrypted_db: Dict[bytes, bytes] = {}):
         self.encrypted_db = encrypted_db
         self.qdag = None
@@ -67,14 +69,9 @@ class QdagSRC3D(EMM):
         Converts a `Rect` to its serialized byte representation for storage in
         an encrypted DB.
         """
-        return struct.pack(
-            "iiiiii",
-            rect.start.x,
-            rect.start.y,
-            rect.start.z,
-            rect.end.x,
-            rect.end.y,
-            rect.end.z,
+        return encode_rect(
+            (rect.start.x, rect.start.y, rect.start.z),
+            (rect.end.x, rect.end.y, rect.end.z),
         )
 
     def trapdoor(self, key: bytes, p1: Point3D, p2: Point3D) -> bytes:
@@ -83,3 +80,6 @@ class QdagSRC3D(EMM):
 
     def search(self, trapdoor):
         return self.emm_engine.search(trapdoor, self.encrypted_db)
+
+    def count(self, trapdoor) -> int:
+        return self.emm_engine.count(trapdoor, self.encrypted_db)
@@ -20,13 +20,13 @@ from .common.emm import EMM
 from ..structures.point import Point
 from ..structures.quad_tree import QuadTree
 from ..structures.rect import Rect
+from ..util.labels import encode_rect
 
 from typing import Dict, List, Set
 from collections import defaultdict
 from tqdm import tqdm
 import itertools
 import math
-import struct
 
 
 
@@ -64,7 +64,7 @@ class QuadBRC(EMM):
 
     @classmethod
     def convert_query_to_bytes(self, p1: Point, p2: Point) -> bytes:
-        return struct.pack("iiii", p1.x, p1.y, p2.x, p2.y)
+        return encode_rect((p1.x, p1.y), (p2.x, p2.y))
 
     @staticmethod
     def _convert_rect_to_bytes(rect: Rect):
@@ -75,22 +75,14 @@ class QuadBRC(EMM):
         return QuadBRC.convert_query_to_bytes(rect.start, rect.end)
 
     def trapdoor(self, key: bytes, p1: Point, p2: Point) -> Set[bytes]:
-        trapdoors = set()
-        range_covers = self.qdag.get_brc_range_cover(Rect(p1, Point(p2.x, p2.y)))
-        #print("Range Cover")
-        #for i in range_covers:
-        #    print(i)
-        for rect_rc in range_covers:
-            token_bytes = QuadBRC._convert_rect_to_bytes(rect_rc)
-            new_trp = self.emm_engine.trapdoor(key, token_bytes)
-            trapdoors.add(new_trp)
-        return trapdoors
+        labels = []
+        for node in self.qdag.iter_brc_range_cover_ids(Rect(p1, Point(p2.x, p2.y))):
+            start_x, start_y, end_x, end_y = self.qdag.node_bounds(node)
+            labels.append(encode_rect((start_x, start_y), (end_x, end_y)))
+        return set(self.emm_engine.trapdoor_many(key, labels))
 
     def search(self, trapdoors: Set[bytes]) -> Set[bytes]:
-        results = set()
-        #print("results")
-        for trpdr in trapdoors:
-            result = self.emm_engine.search(trpdr, self.encrypted_db)
-            #print(len(result))
-            results = results.union(result)
-        return results
+        return self.emm_engine.search_many(trapdoors, self.encrypted_db)
+
+    def count(self, trapdoors: Set[bytes]) -> int:
+        return self.emm_engine.search_many(trapdoors, self.encrypted_db, count_only=True)
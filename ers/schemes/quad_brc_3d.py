@@ -20,7 +20,7 @@ from ..structures.rect_3d import Rect3D
 from ..structures.quad_tree_3d import QuadTree3D
 from .common.emm import EMM
 from .common.emm_engine import EMMEngine
-from ..util.serialization import ObjectToBytes
+from ..util.labels import encode_rect
 
 
 from typing import Dict, List
@@ -28,8 +28,6 @@ from typing import Dict, List
 import math
 
 from collections import defaultdict
-
-import struct
 from tqdm import tqdm
 
 
@@ -72,14 +70,9 @@ class QuadBRC3D(EMM):
         Converts a `Rect3D` to its serialized byte representation for storage in
         an encrypted DB.
         """
-        return struct.pack(
-            "iiiiii",
-            rect.start.x,
-            rect.start.y,
-            rect.start.z,
-            rect.end.x,
-            rect.end.y,
-            rect.end.z,
+        return encode_rect(
+            (rect.start.x, rect.start.y, rect.start.z),
+            (rect.end.x, rect.end.y, rect.end.z),
         )
 
     def trapdoor(self, key: bytes, p1: Point3D, p2: Point3D) -> bytes:
@@ -94,8 +87,7 @@ class QuadBRC3D(EMM):
         return trapdoors
 
     def search(self, trapdoor):
-        results = set()
-        for trpdr in trapdoor:
-            result = self.emm_engine.search(trpdr, self.encrypted_db)
-            results = results.union(result)
-        return results
+        return self.emm_engine.search_many(trapdoor, self.encrypted_db)
+
+    def count(self, trapdoor) -> int:
+        return self.emm_engine.search_many(trapdoor, self.encrypted_db, count_only=True)
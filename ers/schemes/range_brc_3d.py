@@ -16,94 +16,20 @@
 ##
 
 from .common.emm_engine import EMMEngine
-from .common.emm import EMM
-from ..structures.point_3d import Point3D
-from ..structures.range_tree import RangeTree
-from ..util.serialization import ObjectToBytes
+from .range_nd import RangeBRCND
 
-from typing import Dict, List, Set
+from typing import Dict, Optional, Sequence
 
-import itertools
-import math
 
-from collections import defaultdict
+class RangeBRC3D(RangeBRCND):
+    """
+    RangeBRC over 3D points.
+    """
 
-from tqdm import tqdm
-
-
-class RangeBRC3D(EMM):
-    def __init__(self, emm_engine: EMMEngine, encrypted_db: Dict[bytes, bytes] = {}):
-        self.encrypted_db = encrypted_db
-        self.x_tree = None
-        self.y_tree = None
-        self.z_tree = None
-        super().__init__(emm_engine)
-
-    @classmethod
-    def descend_tree(self, val: int, rnge: List[int]) -> List[int]:
-        rnges = []
-        while rnge != [val, val]:
-            rnges.append(rnge)
-            if val <= ((rnge[0] + rnge[1]) // 2):
-                rnge = [rnge[0], ((rnge[0] + rnge[1]) // 2)]
-            else:
-                rnge = [((rnge[0] + rnge[1]) // 2) + 1, rnge[1]]
-
-        rnges.append([val, val])
-        return rnges
-
-    def build_index(self, key: bytes, plaintext_mm: Dict[Point3D, List[bytes]]) -> EMM:
-        """
-        Outputs an encrypted index using the Naive Linear scheme, where each file in
-        the plaintext multimap is associated with the single Point3D where the file lives.
-        """
-        x_tree_height = math.ceil(math.log2(self.emm_engine.MAX_X))
-        y_tree_height = math.ceil(math.log2(self.emm_engine.MAX_Y))
-        z_tree_height = math.ceil(math.log2(self.emm_engine.MAX_Y))
-
-        self.x_tree = RangeTree.initialize_tree(x_tree_height)
-        self.y_tree = RangeTree.initialize_tree(y_tree_height)
-        self.z_tree = RangeTree.initialize_tree(z_tree_height)
-
-        modified_db = defaultdict(list)
-        for point, vals in tqdm(plaintext_mm.items()):
-            full_x_range = [0, self.emm_engine.MAX_X - 1]
-            x_roots = RangeBRC3D.descend_tree(point.x, full_x_range)
-            for x_root in x_roots:
-                full_y_range = [0, self.emm_engine.MAX_Y - 1]
-                y_roots = RangeBRC3D.descend_tree(point.y, full_y_range)
-                for y_root in y_roots:
-                    full_z_range = [0, self.emm_engine.MAX_Y - 1]
-                    z_roots = RangeBRC3D.descend_tree(point.z, full_z_range)
-                    for z_root in z_roots:
-                        label = ObjectToBytes([x_root, y_root, z_root])
-                        modified_db[label].extend(vals)
-
-        self.encrypted_db = self.emm_engine.build_index(key, modified_db)
-
-    def generate_cover(self, p1: Point3D, p2: Point3D) -> Set[bytes]:
-        x_covers = self.x_tree.get_brc_range_cover((p1.x, p2.x))
-        y_covers = self.y_tree.get_brc_range_cover((p1.y, p2.y))
-        z_covers = self.z_tree.get_brc_range_cover((p1.z, p2.z))
-
-        covers = []
-        for x_c in x_covers:
-            for y_c in y_covers:
-                for z_c in z_covers:
-                    covers.append([x_c,y_c,z_c])
-        return covers
-
-    def trapdoor(self, key: bytes, p1: Point3D, p2: Point3D) -> Set[bytes]:
-        trapdoors = set()
-        for c1, c2,c3 in self.generate_cover(p1, p2):
-            token_bytes = ObjectToBytes([c1,c2,c2])
-            new_trp = self.emm_engine.trapdoor(key, token_bytes)
-            trapdoors.add(new_trp)
-        return trapdoors
-
-    def search(self, trapdoors: Set[bytes]) -> Set[bytes]:
-        results = set()
-        for trpdr in trapdoors:
-            result = self.emm_engine.search(trpdr, self.encrypted_db)
-            results = results.union(result)
-        return results
+    def __init__(
+        self,
+        emm_engine: EMMEngine,
+        encrypted_db: Dict[bytes, bytes] = {},
+        domain: Optional[Sequence[int]] = None,
+    ):
+        super().__init__(emm_engine, encrypted_db, num_axes=3, domain=domain)
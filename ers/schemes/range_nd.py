@@ -0,0 +1,214 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from .common.emm_engine import EMMEngine
+from .common.emm import EMM
+from .common.vectorized_index import (
+    Paths,
+    build_interval_multimap,
+    dyadic_paths,
+    encode_interval_labels,
+    split_multimap,
+    tdag_paths,
+)
+from ..structures.columnar_multimap import ColumnarMultimap
+from ..structures.implicit_range_tree import brc_range_cover_arrays, urc_range_cover_arrays
+from ..structures.tdag import Tdag
+
+from typing import Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+import abc
+import itertools
+
+import numpy as np
+
+# Per-axis covers of a batch of intervals, as (cover_starts, cover_ends,
+# offsets): the cover of interval i is cover_starts[offsets[i]:offsets[i + 1]]
+# (and likewise for cover_ends).
+Covers = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class ProductRangeScheme(EMM, abc.ABC):
+    """
+    A range scheme over d-dimensional points with one tree per axis: every
+    point is stored under the label of every combination of one node from
+    each axis path, and a box query is answered with the cross product of
+    its per-axis covers. Subclasses choose the tree (axis_paths) and the
+    cover (axis_covers).
+
+    Points may be Point/Point3D objects or coordinate tuples of any arity.
+    The number of axes is taken from the indexed data unless given. Axis i
+    spans [0, domain[i] - 1], rounded up to a power of two; by default
+    the domain is (MAX_X, MAX_Y) and further axes are as long as the
+    longest of those.
+    """
+
+    def __init__(
+        self,
+        emm_engine: EMMEngine,
+        encrypted_db: Dict[bytes, bytes] = {},
+        num_axes: Optional[int] = None,
+        domain: Optional[Sequence[int]] = None,
+    ):
+        self.encrypted_db = encrypted_db
+        self.num_axes = num_axes
+        self.domain = None if domain is None else tuple(domain)
+        super().__init__(emm_engine)
+
+    @abc.abstractmethod
+    def axis_paths(self, coords: np.ndarray, domain_size: int) -> Paths:
+        pass
+
+    @abc.abstractmethod
+    def axis_covers(self, starts: np.ndarray, ends: np.ndarray, height: int) -> Covers:
+        pass
+
+    def axis_heights(self) -> List[int]:
+        if self.num_axes is None:
+            raise ValueError("The number of axes is not known before build_index")
+        if self.domain is not None:
+            sizes = self.domain
+        else:
+            side = max(self.emm_engine.MAX_X, self.emm_engine.MAX_Y)
+            sizes = (self.emm_engine.MAX_X, self.emm_engine.MAX_Y) + (side,) * self.num_axes
+        return [(size - 1).bit_length() for size in sizes[:self.num_axes]]
+
+    def build_index(self, key: bytes, plaintext_mm: Mapping) -> EMM:
+        if self.num_axes is None:
+            if isinstance(plaintext_mm, ColumnarMultimap):
+                self.num_axes = plaintext_mm.num_axes
+            else:
+                self.num_axes = len(next(iter(plaintext_mm), (0, 0)))
+
+        coords, lengths, values = split_multimap(plaintext_mm, self.num_axes)
+        modified_db = build_interval_multimap(
+            lengths,
+            values,
+            [
+                self.axis_paths(coords[:, axis], 1 << height)
+                for axis, height in enumerate(self.axis_heights())
+            ],
+        )
+
+        self.encrypted_db = self.emm_engine.build_index(key, modified_db)
+
+    def cover_labels_many(self, starts, ends) -> Tuple[List[bytes], np.ndarray]:
+        """
+        Returns the labels of the covers of many box queries at once, given
+        as (number of queries, num_axes) arrays of inclusive corners. The
+        labels of query i are labels[offsets[i]:offsets[i + 1]], in
+        itertools.product order of the per-axis covers.
+        """
+        starts = np.asarray(starts, dtype=np.int64).reshape(len(starts), -1)
+        ends = np.asarray(ends, dtype=np.int64).reshape(len(ends), -1)
+        if self.num_axes is None:
+            self.num_axes = starts.shape[1]
+
+        covers = [
+            self.axis_covers(starts[:, axis], ends[:, axis], height)
+            for axis, height in enumerate(self.axis_heights())
+        ]
+        counts = [np.diff(offsets) for _, _, offsets in covers]
+        totals = np.prod(counts, axis=0)
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(totals, out=offsets[1:])
+
+        # Decompose each label's position within its query in mixed radix,
+        # the last axis varying fastest:
+        query = np.repeat(np.arange(len(starts)), totals)
+        local = np.arange(offsets[-1], dtype=np.int64) - offsets[query]
+        ranges = []
+        for (cover_starts, cover_ends, cover_offsets), count in zip(covers[::-1], counts[::-1]):
+            radix = count[query]
+            index = cover_offsets[query] + local % radix
+            local //= radix
+            ranges.append((cover_starts[index], cover_ends[index]))
+        return encode_interval_labels(ranges[::-1]), offsets
+
+    def cover_labels(self, p1, p2) -> List[bytes]:
+        labels, _ = self.cover_labels_many([tuple(p1)], [tuple(p2)])
+        return labels
+
+    def generate_cover(self, p1, p2):
+        if self.num_axes is None:
+            self.num_axes = len(p1)
+        axis_covers = []
+        for start, end, height in zip(p1, p2, self.axis_heights()):
+            cover_starts, cover_ends, _ = self.axis_covers(
+                np.array([start]), np.array([end]), height
+            )
+            axis_covers.append(list(zip(cover_starts.tolist(), cover_ends.tolist())))
+        return itertools.product(*axis_covers)
+
+    def trapdoor(self, key: bytes, p1, p2) -> Set[bytes]:
+        return set(self.emm_engine.trapdoor_many(key, self.cover_labels(p1, p2)))
+
+    def search(self, trapdoors: Set[bytes]) -> Set[bytes]:
+        return self.emm_engine.search_many(trapdoors, self.encrypted_db)
+
+    def count(self, trapdoors: Set[bytes]) -> int:
+        return self.emm_engine.search_many(trapdoors, self.encrypted_db, count_only=True)
+
+
+class RangeBRCND(ProductRangeScheme):
+    """
+    A range tree per axis, queried with best range covers.
+    """
+
+    def axis_paths(self, coords: np.ndarray, domain_size: int) -> Paths:
+        return dyadic_paths(coords, domain_size)
+
+    def axis_covers(self, starts: np.ndarray, ends: np.ndarray, height: int) -> Covers:
+        return brc_range_cover_arrays(starts, ends, height)
+
+
+class RangeURCND(ProductRangeScheme):
+    """
+    A range tree per axis, queried with uniform range covers.
+    """
+
+    def axis_paths(self, coords: np.ndarray, domain_size: int) -> Paths:
+        return dyadic_paths(coords, domain_size)
+
+    def axis_covers(self, starts: np.ndarray, ends: np.ndarray, height: int) -> Covers:
+        return urc_range_cover_arrays(starts, ends, height)
+
+
+class TdagSRCND(ProductRangeScheme):
+    """
+    A TDAG per axis, queried with single range covers: every query maps to
+    exactly one label, so trapdoors are single tokens.
+    """
+
+    def axis_paths(self, coords: np.ndarray, domain_size: int) -> Paths:
+        return tdag_paths(coords, domain_size)
+
+    def axis_covers(self, starts: np.ndarray, ends: np.ndarray, height: int) -> Covers:
+        lo, hi = Tdag(height).get_single_range_covers(starts, ends)
+        return lo, hi, np.arange(len(lo) + 1, dtype=np.int64)
+
+    def generate_cover(self, p1, p2):
+        return next(super().generate_cover(p1, p2))
+
+    def trapdoor(self, key: bytes, p1, p2) -> bytes:
+        return self.emm_engine.trapdoor(key, self.cover_labels(p1, p2)[0])
+
+    def search(self, trapdoor: bytes) -> Set[bytes]:
+        return self.emm_engine.search(trapdoor, self.encrypted_db)
+
+    def count(self, trapdoor: bytes) -> int:
+        return self.emm_engine.count(trapdoor, self.encrypted_db)
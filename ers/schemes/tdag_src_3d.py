@@ -15,87 +15,21 @@
 ## limitations under the License.
 ##
 
-from __future__ import annotations
-
-from ..util.serialization import ObjectToBytes
 from .common.emm_engine import EMMEngine
-from .common.emm import EMM
-from ..structures.point_3d import Point3D
-from ..structures.tdag import Tdag
-from ..util.serialization import ObjectToBytes
-
-
-from collections import defaultdict
-
-from tqdm import tqdm
-import collections
-
-import math
-
-class TdagSRC3D(EMM):
-    def __init__(self, emm_engine: EMMEngine, encrypted_db: Dict[bytes, bytes] = {}):
-        self.encrypted_db = encrypted_db
-        super().__init__(emm_engine)
-
-    @classmethod
-    def descend_tree(self, val: int, rnge: List[int]) -> List[int]:
-        rnges = []
-        while rnge != [val, val]:
-            if rnge not in rnges:
-                rnges.append(rnge)
-
-            middle = ((rnge[0] + rnge[1]) // 2)
-
-            mid_0 = (middle  - ((rnge[0] + rnge[1]) // 4))
-            mid_1 = (middle  + ((rnge[0] + rnge[1]) // 4))+1
-
-
-            if val >= mid_0 and val <= mid_1 and (rnge[1] - rnge[0]) > 1:
-                if [mid_0, mid_1] not in rnges:
-                    rnges.append([mid_0, mid_1])
-    
-            if val <= ((rnge[0] + rnge[1]) // 2):
-                rnge = [rnge[0], ((rnge[0] + rnge[1]) // 2)]
-            else:
-                rnge = [((rnge[0] + rnge[1]) // 2) + 1, rnge[1]]
-
-
-        rnges.append([val, val])
-        return rnges
-    def build_index(self, key: bytes, plaintext_mm: Dict[Point3D, List[bytes]]) -> Dict[Tuple[int, int], int]:
-        # At the moment we only support squares
-        x_tree_height = math.ceil(math.log2(self.emm_engine.MAX_X))
-        y_tree_height = math.ceil(math.log2(self.emm_engine.MAX_Y))
-
-        self.x_tree = Tdag.initialize_tree(x_tree_height)
-        self.y_tree = Tdag.initialize_tree(y_tree_height)
-        self.z_tree = Tdag.initialize_tree(y_tree_height)
-
-        modified_db = defaultdict(list)
-        for point, vals in tqdm(plaintext_mm.items()):
-            full_x_range = [0, self.emm_engine.MAX_X - 1]
-            x_roots = TdagSRC3D.descend_tree(point.x, full_x_range)
-            for root in x_roots:
-                full_y_range = [0, self.emm_engine.MAX_Y - 1]
-                y_path = TdagSRC3D.descend_tree(point.y, full_y_range)
-                for y_node in y_path:
-                    full_z_range = [0, self.emm_engine.MAX_Y - 1]
-                    z_path = TdagSRC3D.descend_tree(point.z, full_z_range)
-                    for z_node in z_path:
-                        label = ObjectToBytes([root, y_node, z_node])
-                        modified_db[label].extend(vals)
+from .range_nd import TdagSRCND
 
-        self.encrypted_db = self.emm_engine.build_index(key, modified_db)
+from typing import Dict, Optional, Sequence
 
-    def generate_cover(self, p1: Point3D, p2: Point3D):
-        x_cover = self.x_tree.get_single_range_cover((p1.x, p2.x))
-        y_cover = self.y_tree.get_single_range_cover((p1.y, p2.y))
-        z_cover = self.z_tree.get_single_range_cover((p1.z, p2.z))
-        return (x_cover, y_cover, z_cover)
 
-    def trapdoor(self, key, p1: Point3D, p2: Point3D) -> List[Tuple[int, int]]:
-        cover = self.generate_cover(p1, p2)
-        return self.emm_engine.trapdoor(key, ObjectToBytes(cover))
+class TdagSRC3D(TdagSRCND):
+    """
+    TdagSRC over 3D points.
+    """
 
-    def search(self, trapdoor) -> ResolveDone:
-        return self.emm_engine.search(trapdoor, self.encrypted_db)
+    def __init__(
+        self,
+        emm_engine: EMMEngine,
+        encrypted_db: Dict[bytes, bytes] = {},
+        domain: Optional[Sequence[int]] = None,
+    ):
+        super().__init__(emm_engine, encrypted_db, num_axes=3, domain=domain)
@@ -0,0 +1,166 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from .point_array import PointArray
+
+from collections.abc import Mapping
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+
+def take_slices(
+    data: np.ndarray, offsets: np.ndarray, index: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gathers the variable-length slices data[offsets[i]:offsets[i + 1]] for
+    every i in `index`, concatenated. Returns (data, offsets) of the result.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    index = np.asarray(index, dtype=np.int64)
+    starts = offsets[index]
+    lengths = offsets[index + 1] - starts
+    new_offsets = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    positions = np.repeat(starts - new_offsets[:-1], lengths)
+    positions += np.arange(len(positions), dtype=np.int64)
+    return np.asarray(data)[positions], new_offsets
+
+
+class ColumnarMultimap(Mapping):
+    """
+    A plaintext multimap from points to record payloads, stored as columns:
+    the distinct points (a PointArray, sorted), the records of each point as
+    ranges of `record_offsets`, and the payloads of all records concatenated
+    in one byte buffer delimited by `value_offsets`.
+
+    It can be passed to any scheme's build_index in place of a
+    Dict[Point, List[bytes]]: iterating it yields Points, and the payload
+    lists are materialized one group at a time.
+    """
+
+    def __init__(
+        self,
+        points: PointArray,
+        record_offsets: np.ndarray,
+        data: np.ndarray,
+        value_offsets: np.ndarray,
+    ):
+        self.points = points
+        self.record_offsets = np.asarray(record_offsets, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.uint8)
+        self.value_offsets = np.asarray(value_offsets, dtype=np.int64)
+        self._index = None
+
+    @classmethod
+    def from_records(cls, points: PointArray, data, value_offsets) -> "ColumnarMultimap":
+        """
+        Groups records by point. Record i is located at points[i] and its
+        payload is data[value_offsets[i]:value_offsets[i + 1]]; records of
+        the same point keep their relative order.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = np.frombuffer(data, dtype=np.uint8)
+        order = np.lexsort(points.columns()[::-1])
+        columns = [column[order] for column in points.columns()]
+        boundaries = np.ones(len(order), dtype=bool)
+        if len(order) > 0:
+            boundaries[1:] = np.any([column[1:] != column[:-1] for column in columns], axis=0)
+        group_starts = np.flatnonzero(boundaries)
+
+        data, value_offsets = take_slices(data, value_offsets, order)
+        return cls(
+            PointArray(*(column[group_starts] for column in columns)),
+            np.append(group_starts, len(order)),
+            data,
+            value_offsets,
+        )
+
+    @classmethod
+    def from_fixed_width(cls, points: PointArray, data, width: int) -> "ColumnarMultimap":
+        """
+        Like from_records, for payloads that are all `width` bytes long.
+        """
+        return cls.from_records(
+            points, data, np.arange(len(points) + 1, dtype=np.int64) * width
+        )
+
+    @classmethod
+    def from_multimap(cls, plaintext_mm: Mapping) -> "ColumnarMultimap":
+        """
+        Converts a Dict[Point, List[bytes]] (or Point3D keyed) multimap.
+        """
+        counts = {point: len(values) for point, values in plaintext_mm.items()}
+        payloads = [value for values in plaintext_mm.values() for value in values]
+        lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=len(payloads))
+        value_offsets = np.zeros(len(payloads) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=value_offsets[1:])
+        return cls.from_records(
+            PointArray.from_counts(counts), b"".join(payloads), value_offsets
+        )
+
+    @property
+    def num_axes(self) -> int:
+        return self.points.num_axes
+
+    @property
+    def num_records(self) -> int:
+        return int(self.record_offsets[-1])
+
+    def coords(self) -> np.ndarray:
+        return self.points.coords()
+
+    def record_counts(self) -> np.ndarray:
+        """
+        Returns the number of records of every point.
+        """
+        return np.diff(self.record_offsets)
+
+    def payloads(self, start: int = 0, end: int = None) -> List[bytes]:
+        """
+        Returns the payloads of records start..end (in group order) as bytes.
+        """
+        end = self.num_records if end is None else end
+        bounds = self.value_offsets[start:end + 1]
+        buffer = self.data[bounds[0]:bounds[-1]].tobytes() if end > start else b""
+        bounds = (bounds - bounds[0]).tolist()
+        return [buffer[lo:hi] for lo, hi in zip(bounds, bounds[1:])]
+
+    def group(self, index: int) -> List[bytes]:
+        return self.payloads(int(self.record_offsets[index]), int(self.record_offsets[index + 1]))
+
+    def items(self) -> Iterator:
+        for index, point in enumerate(self.points):
+            yield point, self.group(index)
+
+    def values(self) -> Iterator[List[bytes]]:
+        for index in range(len(self)):
+            yield self.group(index)
+
+    def __getitem__(self, point) -> List[bytes]:
+        if self._index is None:
+            self._index = {point: index for index, point in enumerate(self.points)}
+        return self.group(self._index[point])
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __repr__(self):
+        return f"ColumnarMultimap({len(self)} points, {self.num_records} records)"
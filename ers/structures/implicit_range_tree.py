@@ -0,0 +1,359 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Number of intervals get_urc_range_covers processes per vectorized pass:
+URC_BATCH_SIZE = 1 << 13
+
+
+class ImplicitRangeTree:
+    """
+    A drop-in replacement for RangeTree over the domain [0, 2^height - 1]
+    that never materializes its nodes.
+
+    A node is identified by its (level, index) pair: it covers the range
+    [index * 2^level, (index + 1) * 2^level - 1], the root being
+    (height, 0) and the leaves (0, x). Covers and paths are computed with
+    integer bit arithmetic in O(height) steps, without recursion or
+    caching.
+    """
+
+    def __init__(self, height: int, level: Optional[int] = None, index: int = 0):
+        self.tree_height = height
+        self.height = height if level is None else level
+        self.index = index
+        self.range = (index << self.height, ((index + 1) << self.height) - 1)
+
+    @property
+    def left(self) -> Optional["ImplicitRangeTree"]:
+        if self.height == 0:
+            return None
+        return ImplicitRangeTree(self.tree_height, self.height - 1, 2 * self.index)
+
+    @property
+    def right(self) -> Optional["ImplicitRangeTree"]:
+        if self.height == 0:
+            return None
+        return ImplicitRangeTree(self.tree_height, self.height - 1, 2 * self.index + 1)
+
+    def get_range_cover(self, query_range: Tuple[int, int]) -> List[Tuple[int, Tuple[int, int]]]:
+        """
+        Returns the maximal nodes below this one that lie inside
+        `query_range`, as (level, range) pairs ordered left to right.
+        """
+        if self.interval_contains_interval(query_range, self.range):
+            return [(self.height, self.range)]
+
+        lo = max(query_range[0], self.range[0])
+        hi = min(query_range[1], self.range[1])
+        result = []
+        while lo <= hi:
+            # Largest aligned block starting at lo that still fits in [lo, hi]:
+            level = (lo & -lo).bit_length() - 1 if lo > 0 else self.height
+            level = min(level, (hi - lo + 1).bit_length() - 1)
+            end = lo + (1 << level) - 1
+            result.append((level, (lo, end)))
+            lo = end + 1
+        return result
+
+    def get_single_range_cover(self, query_range: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """
+        Returns the smallest node containing `query_range`, or None if the
+        query does not fit in this subtree.
+        """
+        if not self.interval_contains_interval(self.range, query_range):
+            return None
+
+        start, end = query_range
+        if start <= end:
+            # The lowest common ancestor sits just above the highest bit in
+            # which the two endpoints differ:
+            level = (start ^ end).bit_length()
+            lo = (start >> level) << level
+            return (lo, lo + (1 << level) - 1)
+
+        # Inverted queries are contained by several nodes; descend preferring
+        # the left child, as the recursive tree does.
+        level, lo = self.height, self.range[0]
+        while level > 0:
+            half = 1 << (level - 1)
+            if lo <= start and lo + half - 1 >= end:
+                pass
+            elif lo + half <= start and lo + 2 * half - 1 >= end:
+                lo += half
+            else:
+                break
+            level -= 1
+        return (lo, lo + (1 << level) - 1)
+
+    def get_brc_range_cover(
+        self, query_range: Tuple[int, int]
+    ) -> List[Tuple[int, int]]:
+        range_cover = self.get_range_cover(query_range)
+        return self.__remove_height_metadata(range_cover)
+
+    def get_urc_range_cover(
+        self, query_range: Tuple[int, int]
+    ) -> List[Tuple[int, int]]:
+        """
+        Returns the URC cover of `query_range`: the BRC cover in which the
+        last non-leaf node is split into its two children, appended at the
+        end, until every level up to the highest one is present.
+
+        The splits are replayed in a single pass: the non-leaf nodes of the
+        cover always sit on a stack in list order, so the next node to split
+        is its top, and per-level counts track the missing levels.
+        """
+        cover = self.get_range_cover(query_range)
+        if not cover:
+            return []
+
+        counts = [0] * (self.height + 1)
+        for level, _ in cover:
+            counts[level] += 1
+        max_level = max(level for level, _ in cover)
+        missing = counts[:max_level + 1].count(0)
+
+        alive = [True] * len(cover)
+        non_leaves = [i for i, (level, _) in enumerate(cover) if level > 0]
+        while missing > 0:
+            i = non_leaves.pop()
+            level, (lo, hi) = cover[i]
+            alive[i] = False
+            counts[level] -= 1
+            if counts[level] == 0:
+                missing += 1
+
+            child_level = level - 1
+            if counts[child_level] == 0:
+                missing -= 1
+            counts[child_level] += 2
+            mid = lo + (hi - lo) // 2
+            cover.append((child_level, (lo, mid)))
+            cover.append((child_level, (mid + 1, hi)))
+            alive.extend((True, True))
+            if child_level > 0:
+                non_leaves.extend((len(cover) - 2, len(cover) - 1))
+
+            while counts[max_level] == 0:
+                max_level -= 1
+                missing -= 1
+
+        return [rng for (_, rng), keep in zip(cover, alive) if keep]
+
+    def get_urc_range_covers(
+        self, query_ranges: Iterable[Tuple[int, int]]
+    ) -> List[List[Tuple[int, int]]]:
+        """
+        Batched version of get_urc_range_cover.
+        """
+        query_ranges = np.asarray(list(query_ranges), dtype=np.int64).reshape(-1, 2)
+        result = []
+        for chunk in range(0, len(query_ranges), URC_BATCH_SIZE):
+            batch = query_ranges[chunk:chunk + URC_BATCH_SIZE]
+            cover_starts, cover_ends, offsets = urc_range_cover_arrays(
+                batch[:, 0], batch[:, 1], self.height, self.range[0]
+            )
+            cover = list(zip(cover_starts.tolist(), cover_ends.tolist()))
+            offsets = offsets.tolist()
+            result.extend(
+                cover[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)
+            )
+        return result
+
+    def get_range_cover_bits(
+        self, query_range: Tuple[int, int]
+    ) -> List[List[int]]:
+        """
+        Returns, for each node of the range cover, the left (0) / right (1)
+        turns leading to it from this node.
+        """
+        result = []
+        for level, (lo, _) in self.get_range_cover(query_range):
+            depth = self.height - level
+            index = lo >> level
+            result.append([(index >> (depth - 1 - i)) & 1 for i in range(depth)])
+        return result
+
+    def get_dyadic_path(self, value: int) -> List[Tuple[int, int]]:
+        """
+        Returns the ranges of the nodes from this node down to the leaf
+        holding `value`.
+        """
+        return [
+            ((value >> level) << level, (((value >> level) + 1) << level) - 1)
+            for level in range(self.height, -1, -1)
+        ]
+
+    def __remove_height_metadata(self, range_cover):
+        return [rng for _, rng in range_cover]
+
+    def __str__(self):
+        return "ImplicitRangeTree(height={}, range={})".format(self.height, self.range)
+
+    @classmethod
+    def initialize_tree(cls, height: int) -> "ImplicitRangeTree":
+        return cls(height)
+
+    @classmethod
+    def interval_contains_interval(
+        cls, main: Tuple[int, int], secondary: Tuple[int, int]
+    ) -> bool:
+        return (main[0] <= secondary[0]) and (main[1] >= secondary[1])
+
+
+def _floor_log2(values: np.ndarray) -> np.ndarray:
+    # frexp is exact for integers below 2^53:
+    return np.frexp(values.astype(np.float64))[1].astype(np.int64) - 1
+
+
+def brc_range_cover_arrays(
+    starts: np.ndarray, ends: np.ndarray, height: int, domain_start: int = 0
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes the BRC covers of the intervals [starts[i], ends[i]] over the
+    (sub)tree of the given height whose range starts at `domain_start`, for
+    a whole array of intervals at once, in the same order as
+    ImplicitRangeTree.get_brc_range_cover: each step takes, for every
+    interval, the largest aligned block at its current start that fits.
+
+    Returns (cover_starts, cover_ends, offsets) like urc_range_cover_arrays.
+    """
+    lo = np.maximum(np.asarray(starts, dtype=np.int64), domain_start)
+    hi = np.minimum(np.asarray(ends, dtype=np.int64), domain_start + (1 << height) - 1)
+    rows = np.flatnonzero(lo <= hi)
+    lo, hi = lo[rows], hi[rows]
+
+    row_chunks, start_chunks, end_chunks = [], [], []
+    while len(rows):
+        relative = lo - domain_start
+        level = np.where(relative > 0, _floor_log2(relative & -relative), height)
+        level = np.minimum(level, _floor_log2(hi - lo + 1))
+        end = lo + (np.int64(1) << level) - 1
+        row_chunks.append(rows)
+        start_chunks.append(lo)
+        end_chunks.append(end)
+
+        remaining = end < hi
+        rows, lo, hi = rows[remaining], end[remaining] + 1, hi[remaining]
+
+    # Blocks were emitted step by step; a stable sort by interval keeps them
+    # left to right within each cover:
+    cover_rows = np.concatenate(row_chunks) if row_chunks else np.zeros(0, dtype=np.int64)
+    order = np.argsort(cover_rows, kind="stable")
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cover_rows, minlength=len(starts)), out=offsets[1:])
+    if not row_chunks:
+        return cover_rows, cover_rows, offsets
+    return np.concatenate(start_chunks)[order], np.concatenate(end_chunks)[order], offsets
+
+
+def urc_range_cover_arrays(
+    starts: np.ndarray, ends: np.ndarray, height: int, domain_start: int = 0
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes the URC covers of the intervals [starts[i], ends[i]] over the
+    (sub)tree of the given height whose range starts at `domain_start`, for
+    a whole array of intervals at once, in the same order as
+    ImplicitRangeTree.get_urc_range_cover: every row of the padded per-cover
+    arrays below replays its splits in lockstep with the others.
+
+    Returns (cover_starts, cover_ends, offsets): the cover of interval i is
+    cover_starts[offsets[i]:offsets[i + 1]] (and likewise for cover_ends).
+    """
+    lo = np.maximum(np.asarray(starts, dtype=np.int64), domain_start)
+    hi = np.minimum(np.asarray(ends, dtype=np.int64), domain_start + (1 << height) - 1)
+    n = len(lo)
+
+    capacity = 2 * height + 2
+    levels = np.zeros((n, capacity), dtype=np.int8)
+    node_starts = np.zeros((n, capacity), dtype=np.int64)
+    alive = np.zeros((n, capacity), dtype=bool)
+    non_leaves = np.zeros((n, capacity), dtype=np.int32)
+    lengths = np.zeros(n, dtype=np.int64)
+    stack_sizes = np.zeros(n, dtype=np.int64)
+    counts = np.zeros((n, height + 1), dtype=np.int32)
+
+    def push(rows, columns, new_levels, new_starts):
+        levels[rows, columns] = new_levels
+        node_starts[rows, columns] = new_starts
+        alive[rows, columns] = True
+        counts[rows, new_levels] += 1
+        splittable = new_levels > 0
+        rows, columns = rows[splittable], columns[splittable]
+        non_leaves[rows, stack_sizes[rows]] = columns
+        stack_sizes[rows] += 1
+
+    # BRC covers, left to right: the largest aligned block starting at lo
+    # that fits in [lo, hi].
+    rows = np.nonzero(lo <= hi)[0]
+    while rows.size:
+        cur = lo[rows]
+        alignment = np.where(cur > 0, _floor_log2(cur & -cur), height)
+        level = np.minimum(alignment, _floor_log2(hi[rows] - cur + 1))
+        push(rows, lengths[rows], level, cur)
+        lengths[rows] += 1
+        lo[rows] = cur + (1 << level)
+        rows = rows[lo[rows] <= hi[rows]]
+
+    present = counts > 0
+    max_level = height - np.argmax(present[:, ::-1], axis=1)
+    missing = ((~present) & (np.arange(height + 1) <= max_level[:, None])).sum(axis=1)
+
+    rows = np.nonzero((lengths > 0) & (missing > 0))[0]
+    while rows.size:
+        needed = int(lengths[rows].max()) + 2
+        if needed > capacity:
+            extra = max(needed, 2 * capacity) - capacity
+            padding = ((0, 0), (0, extra))
+            levels = np.pad(levels, padding)
+            node_starts = np.pad(node_starts, padding)
+            alive = np.pad(alive, padding)
+            non_leaves = np.pad(non_leaves, padding)
+            capacity += extra
+
+        # Split the top of each stack:
+        stack_sizes[rows] -= 1
+        column = non_leaves[rows, stack_sizes[rows]]
+        level = levels[rows, column].astype(np.int64)
+        start = node_starts[rows, column]
+        alive[rows, column] = False
+        counts[rows, level] -= 1
+        missing[rows] += counts[rows, level] == 0
+
+        child_level = level - 1
+        missing[rows] -= counts[rows, child_level] == 0
+        column = lengths[rows]
+        push(rows, column, child_level, start)
+        push(rows, column + 1, child_level, start + (1 << child_level))
+        lengths[rows] += 2
+
+        emptied = rows[counts[rows, max_level[rows]] == 0]
+        while emptied.size:
+            max_level[emptied] -= 1
+            missing[emptied] -= 1
+            emptied = emptied[counts[emptied, max_level[emptied]] == 0]
+
+        rows = rows[missing[rows] > 0]
+
+    cover_starts = node_starts[alive]
+    cover_ends = cover_starts + (1 << levels[alive].astype(np.int64)) - 1
+    offsets = np.concatenate(([0], np.cumsum(alive.sum(axis=1))))
+    return cover_starts, cover_ends, offsets
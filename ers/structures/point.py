@@ -15,36 +15,51 @@
 ## limitations under the License.
 ##
 
-import functools
+import operator
 
-from ..util import serialization
+from ..util import labels
 
 
-@functools.total_ordering
-class Point:
+class Point(tuple):
     """
     A point representing an integer coordinate in a two-dimensional space.
+
+    Points are immutable tuples of their coordinates: they hash and compare
+    equal like those tuples, and unpack like them.
     """
 
-    def __init__(self, x: int, y: int):
-        self.x = int(x)
-        self.y = int(y)
+    __slots__ = ()
 
-    def __eq__(self, other):
-        if not isinstance(other, Point):
-            return False
-        return self.x == other.x and self.y == other.y
+    def __new__(cls, x: int, y: int):
+        return tuple.__new__(cls, (int(x), int(y)))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    x = property(operator.itemgetter(0))
+    y = property(operator.itemgetter(1))
 
     def __lt__(self, other):
         if not isinstance(other, Point):
             return NotImplemented
         return self.x < other.x and self.y < other.y
 
-    def __hash__(self):
-        return hash((self.x, self.y))
+    # The rest of the partial "dominates" order, as functools.total_ordering
+    # would derive it; tuple's lexicographic comparisons must not leak through.
+    def __le__(self, other):
+        result = self.__lt__(other)
+        return result if result is NotImplemented else result or self == other
+
+    def __gt__(self, other):
+        result = self.__le__(other)
+        return result if result is NotImplemented else not result
+
+    def __ge__(self, other):
+        result = self.__lt__(other)
+        return result if result is NotImplemented else not result
 
     def __bytes__(self):
-        return serialization.ObjectToBytes([self.x, self.y])
+        return labels.encode_point(self.x, self.y)
 
     def __str__(self):
         return "Point(" + str(self.x) + ", " + str(self.y) + ")"
@@ -54,7 +69,7 @@ class Point:
 
     @classmethod
     def from_bytes(self, b: bytes):
-        x, y = serialization.BytesToObject(b)
+        _, (x, y) = labels.decode_label(b)
         return self(x, y)
 
     def contained_by(self, bottom, top):
@@ -15,37 +15,49 @@
 ## limitations under the License.
 ##
 
-import functools
+import operator
 
-from ..util import serialization
+from ..util import labels
 
 
-@functools.total_ordering
-class Point3D:
+class Point3D(tuple):
     """
     A point representing an integer coordinate in a three-dimensional space.
+
+    Like Point, an immutable tuple of its coordinates.
     """
 
-    def __init__(self, x: int, y: int, z: int):
-        self.x = int(x)
-        self.y = int(y)
-        self.z = int(z)
+    __slots__ = ()
 
-    def __eq__(self, other):
-        if not isinstance(other, Point3D):
-            return False
-        return self.x == other.x and self.y == other.y and self.z == other.z
+    def __new__(cls, x: int, y: int, z: int):
+        return tuple.__new__(cls, (int(x), int(y), int(z)))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    x = property(operator.itemgetter(0))
+    y = property(operator.itemgetter(1))
+    z = property(operator.itemgetter(2))
 
     def __lt__(self, other):
         if not isinstance(other, Point3D):
             return NotImplemented
         return self.x < other.x and self.y < other.y and self.z < other.z
 
-    def __hash__(self):
-        return hash((self.x, self.y, self.z))
+    def __le__(self, other):
+        result = self.__lt__(other)
+        return result if result is NotImplemented else result or self == other
+
+    def __gt__(self, other):
+        result = self.__le__(other)
+        return result if result is NotImplemented else not result
+
+    def __ge__(self, other):
+        result = self.__lt__(other)
+        return result if result is NotImplemented else not result
 
     def __bytes__(self):
-        return serialization.ObjectToBytes([self.x, self.y, self.z])
+        return labels.encode_point(self.x, self.y, self.z)
 
     def __str__(self):
         return f"Point3D({self.x}, {self.y}, {self.z})"
@@ -55,7 +67,7 @@ class Point3D:
 
     @classmethod
     def from_bytes(self, b: bytes):
-        x, y, z = serialization.BytesToObject(b)
+        _, (x, y, z) = labels.decode_label(b)
         return self(x, y, z)
 
     def contained_by(self, bottom, top):
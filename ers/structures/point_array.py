@@ -0,0 +1,132 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from .point import Point
+from .point_3d import Point3D
+
+from typing import Dict, Iterable, Mapping, Tuple
+
+import numpy as np
+
+
+class PointArray:
+    """
+    A columnar collection of integer points of any dimension, stored as one
+    int32 NumPy column per axis. Meant for bulk datasets, where a Point
+    object per record would dominate memory; indexing and iteration
+    materialize Point/Point3D objects (coordinate tuples beyond 3D) on
+    demand.
+    """
+
+    __slots__ = ("_columns",)
+
+    def __init__(self, *columns):
+        if not columns:
+            raise ValueError("PointArray needs at least one column")
+        self._columns = tuple(np.ascontiguousarray(column, dtype=np.int32) for column in columns)
+        if any(len(column) != len(self._columns[0]) for column in self._columns):
+            raise ValueError("PointArray columns must have the same length")
+
+    @classmethod
+    def from_coords(cls, coords) -> "PointArray":
+        """
+        Builds a PointArray from a (number of points, number of axes) array.
+        """
+        coords = np.asarray(coords)
+        if coords.ndim != 2 or coords.shape[1] == 0:
+            raise ValueError("Expected an (n, number of axes) coordinate array")
+        return cls(*coords.T)
+
+    @classmethod
+    def from_points(cls, points: Iterable, num_axes: int = None) -> "PointArray":
+        """
+        Builds a PointArray from Point/Point3D objects or coordinate tuples.
+        """
+        coords = np.array([tuple(point) for point in points], dtype=np.int64)
+        if len(coords) == 0:
+            coords = coords.reshape(0, num_axes or 2)
+        return cls.from_coords(coords)
+
+    @classmethod
+    def from_counts(cls, counts: Mapping) -> "PointArray":
+        """
+        Expands a {point: multiplicity} dataset into one row per record.
+        """
+        points = PointArray.from_points(counts.keys())
+        repeats = np.fromiter(counts.values(), dtype=np.int64, count=len(points))
+        return cls(*(np.repeat(column, repeats) for column in points.columns()))
+
+    @property
+    def num_axes(self) -> int:
+        return len(self._columns)
+
+    @property
+    def x(self) -> np.ndarray:
+        return self._columns[0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self._columns[1]
+
+    @property
+    def z(self) -> np.ndarray:
+        return self._columns[2] if len(self._columns) > 2 else None
+
+    def columns(self) -> Tuple[np.ndarray, ...]:
+        return self._columns
+
+    def coords(self) -> np.ndarray:
+        """
+        Returns the points as an int64 (number of points, num_axes) array.
+        """
+        return np.stack(self._columns, axis=1).astype(np.int64)
+
+    def max(self):
+        """
+        Returns the largest coordinate along each axis.
+        """
+        return tuple(int(column.max()) for column in self._columns)
+
+    def _point_type(self):
+        return {2: Point, 3: Point3D}.get(self.num_axes, lambda *coords: coords)
+
+    def counts(self) -> Dict[tuple, int]:
+        """
+        Collapses the records into a {point: multiplicity} dict.
+        """
+        unique, counts = np.unique(self.coords(), axis=0, return_counts=True)
+        point_type = self._point_type()
+        return {
+            point_type(*coords): int(count)
+            for coords, count in zip(unique.tolist(), counts.tolist())
+        }
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self._point_type()(*(int(column[index]) for column in self._columns))
+        return PointArray(*(column[index] for column in self._columns))
+
+    def __iter__(self):
+        point_type = self._point_type()
+        for coords in zip(*(column.tolist() for column in self._columns)):
+            yield point_type(*coords)
+
+    def __repr__(self):
+        return f"PointArray({len(self)} points, {self.num_axes}D)"
@@ -18,43 +18,163 @@
 from .rect import Rect
 from .point import Point
 
-from typing import List, Set
+from typing import Iterator, List, Set, Tuple
 
 import math
 
+import numpy as np
+
 class QuadTree:
+    """
+    A quad tree over the square `bounding_box` of side 2^level, represented
+    implicitly. A node of level k is the aligned square of side 2^k whose
+    grid coordinates are (gx, gy); its corners are inclusive.
+    """
+
     def __init__(self, bounding_box: Rect, level: int):
         self.bounding_box = bounding_box
         self.level = level
+        self._level_offsets = [0]
+        for k in range(level + 1):
+            self._level_offsets.append(self._level_offsets[-1] + (1 << (level - k)) ** 2)
+
+    def node_id(self, level: int, grid_x: int, grid_y: int) -> int:
+        """
+        Numbers the nodes level by level, from the unit cells up: the node of
+        level k at grid coordinates (gx, gy) has id offset_k + gx * n_k + gy,
+        where n_k = 2^(level - k) is the number of level-k nodes per axis.
+        """
+        return self._level_offsets[level] + (grid_x << (self.level - level)) + grid_y
+
+    def node_bounds(self, node_id: int) -> Tuple[int, int, int, int]:
+        """
+        Returns the inclusive (start_x, start_y, end_x, end_y) of a node.
+        """
+        level = 0
+        while node_id >= self._level_offsets[level + 1]:
+            level += 1
+        grid_x, grid_y = divmod(
+            node_id - self._level_offsets[level], 1 << (self.level - level)
+        )
+        start_x = self.bounding_box.start.x + (grid_x << level)
+        start_y = self.bounding_box.start.y + (grid_y << level)
+        side = 1 << level
+        return start_x, start_y, start_x + side - 1, start_y + side - 1
+
+    def node_rect(self, node_id: int) -> Rect:
+        start_x, start_y, end_x, end_y = self.node_bounds(node_id)
+        return Rect(Point(start_x, start_y), Point(end_x, end_y))
 
     def get_brc_range_cover(self, query: Rect) -> List[Rect]:
-        res = self._get_brc_range_cover_helper(query, self.bounding_box)
-        return res
-
-    def _get_brc_range_cover_helper(
-        self, query: Rect, current_node: Rect
-    ) -> List[Rect]:
-
-        if query.contains_rect_inclusive(current_node):
-            return [current_node]
-        else:
-            # Is there any possibility that current_node has children part of the query
-            # range cover? (does current_node overlap query in any way?)
+        return [self.node_rect(node) for node in self.iter_brc_range_cover_ids(query)]
+
+    def iter_brc_range_cover_ids(self, query: Rect) -> Iterator[int]:
+        """
+        Yields the ids of the maximal quad tree nodes contained in `query`
+        (inclusive corners), in depth-first order with the children of a node
+        visited as (low x, low y), (low x, high y), (high x, low y),
+        (high x, high y). The traversal uses an explicit stack and only
+        descends into nodes that partially overlap the query, so every node
+        is yielded once.
+        """
+        origin_x, origin_y = self.bounding_box.start.x, self.bounding_box.start.y
+        query_start_x, query_start_y = query.start.x - origin_x, query.start.y - origin_y
+        query_end_x, query_end_y = query.end.x - origin_x, query.end.y - origin_y
+
+        stack = [(self.level, 0, 0)]
+        while stack:
+            level, grid_x, grid_y = stack.pop()
+            start_x, start_y = grid_x << level, grid_y << level
+            end_x, end_y = start_x + (1 << level) - 1, start_y + (1 << level) - 1
             if (
-                current_node.end.x < query.start.x
-                or current_node.end.y < query.start.y
-                or query.end.x < current_node.start.x
-                or query.end.y < current_node.start.y
+                end_x < query_start_x
+                or end_y < query_start_y
+                or query_end_x < start_x
+                or query_end_y < start_y
             ):
-                return []
-            else:
-                results = list()
-                for child_rect in current_node.divide():
-                    resp = self._get_brc_range_cover_helper(query, child_rect)
-                    if resp not in results:
-                        results.extend(resp)
-                return results
+                continue
+            if (
+                query_start_x <= start_x
+                and query_start_y <= start_y
+                and end_x <= query_end_x
+                and end_y <= query_end_y
+            ):
+                yield self.node_id(level, grid_x, grid_y)
+            elif level > 0:
+                # Pushed in reverse so the children are popped in order:
+                child_x, child_y = grid_x << 1, grid_y << 1
+                stack.append((level - 1, child_x + 1, child_y + 1))
+                stack.append((level - 1, child_x + 1, child_y))
+                stack.append((level - 1, child_x, child_y + 1))
+                stack.append((level - 1, child_x, child_y))
+
+    def get_brc_range_cover_ids(
+        self, starts: np.ndarray, ends: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched BRC cover: takes (n, 2) arrays of query start and (inclusive)
+        end corners and returns (ids, offsets), where the cover of query i is
+        ids[offsets[i]:offsets[i + 1]], ordered by decreasing level.
+
+        At level k the nodes inside a query form the grid rectangle
+        [ceil(start / 2^k), floor((end + 1) / 2^k) - 1] per axis; the maximal
+        ones are those outside the children of the level-(k + 1) rectangle,
+        which leaves at most four strips per level.
+        """
+        origin = np.array(
+            [self.bounding_box.start.x, self.bounding_box.start.y], dtype=np.int64
+        )
+        domain = 1 << self.level
+        starts = np.clip(np.asarray(starts, dtype=np.int64).reshape(-1, 2) - origin, 0, domain)
+        ends = np.clip(np.asarray(ends, dtype=np.int64).reshape(-1, 2) + 1 - origin, 0, domain)
+        num_queries = len(starts)
+        rows = np.arange(num_queries, dtype=np.int64)
+
+        query_chunks, id_chunks = [], []
+        inner_lo = np.zeros((num_queries, 2), dtype=np.int64)
+        inner_hi = np.zeros((num_queries, 2), dtype=np.int64)  # Exclusive, empty
+        for level in range(self.level, -1, -1):
+            lo = (starts + (1 << level) - 1) >> level
+            hi = np.maximum(ends >> level, lo)
+            count = 1 << (self.level - level)
+
+            # Rectangle minus the (possibly empty) inner rectangle, as strips
+            # [x0, x1) x [y0, y1):
+            has_inner = (inner_lo < inner_hi).all(axis=1)
+            in_lo = np.where(has_inner[:, None], inner_lo, hi)
+            in_hi = np.where(has_inner[:, None], inner_hi, hi)
+            strips = (
+                (lo[:, 0], in_lo[:, 0], lo[:, 1], hi[:, 1]),
+                (in_hi[:, 0], hi[:, 0], lo[:, 1], hi[:, 1]),
+                (in_lo[:, 0], in_hi[:, 0], lo[:, 1], in_lo[:, 1]),
+                (in_lo[:, 0], in_hi[:, 0], in_hi[:, 1], hi[:, 1]),
+            )
+            for x0, x1, y0, y1 in strips:
+                widths, heights = x1 - x0, y1 - y0
+                sizes = widths * heights
+                nonempty = np.flatnonzero(sizes > 0)
+                if len(nonempty) == 0:
+                    continue
+                sizes = sizes[nonempty]
+                query_index = np.repeat(rows[nonempty], sizes)
+                local = np.arange(sizes.sum(), dtype=np.int64) - np.repeat(
+                    np.cumsum(sizes) - sizes, sizes
+                )
+                strip_heights = np.repeat(heights[nonempty], sizes)
+                grid_x = np.repeat(x0[nonempty], sizes) + local // strip_heights
+                grid_y = np.repeat(y0[nonempty], sizes) + local % strip_heights
+                query_chunks.append(query_index)
+                id_chunks.append(self._level_offsets[level] + grid_x * count + grid_y)
+
+            inner_lo, inner_hi = lo << 1, hi << 1
 
+        if not id_chunks:
+            return np.zeros(0, dtype=np.int64), np.zeros(num_queries + 1, dtype=np.int64)
+        query_index = np.concatenate(query_chunks)
+        order = np.argsort(query_index, kind="stable")
+        offsets = np.zeros(num_queries + 1, dtype=np.int64)
+        np.cumsum(np.bincount(query_index, minlength=num_queries), out=offsets[1:])
+        return np.concatenate(id_chunks)[order], offsets
 
     def find_containing_range_covers(self, point: Point) -> Set[Rect]:
             x, y = point.x, point.y
@@ -17,179 +17,159 @@
 
 from .rect_3d import Rect3D
 from .point_3d import Point3D
+from .quad_tree_src import qdag_level_grid, qdag_level_offsets, qdag_level_starts
 
-from typing import Dict, List, Set
+from typing import List, Set, Tuple
 
-import math
+import numpy as np
 
-QDAG_ROOT = "__root__"
+class QuadTreeSRC3D:
+    """
+    A 3-dimensional QDAG over [0, 2^height)^3, represented implicitly.
 
+    As in the 2-dimensional QuadTreeSRC, the level-k nodes (k >= 1) of an
+    SRC QDAG are the cubes of side 2^k whose start coordinates are
+    multiples of 2^(k - 1), level 0 being the unit cells; without SRC only
+    the aligned octree cubes exist. No graph is stored: children and
+    containing covers are computed from a node's coordinates and level.
+    """
 
-class QuadTreeSRC3D:
     def __init__(self, height: int, is_src: bool):
+        self.height = height
         self.max_domain = 2 ** height
-        self.qdag_dict = QuadTreeSRC3D._build_quad_tree_src(height, is_src)
         self.is_src = is_src
-
-    def find_containing_range_covers(self, point: Point3D) -> Set[Rect3D]:
-        # Start at root:
-        root_rect_list = self.qdag_dict[
-            QDAG_ROOT
-        ]  # Everything is a list, so just grab the first elt
-        recursive_result = self._find_containing_range_covers_helper(
-            root_rect_list[0], point
+        self.root_rect = Rect3D(
+            Point3D(0, 0, 0),
+            Point3D(self.max_domain, self.max_domain, self.max_domain),
         )
-        return set(root_rect_list).union(recursive_result)
+        self._level_offsets = qdag_level_offsets(height, 3)
+
+    def get_children(self, rect: Rect3D) -> List[Rect3D]:
+        """
+        Returns the children of a QDAG node: its 8 octree divisions or, for
+        SRC nodes of side at least 4, all 27 direct and intermediate nodes.
+        """
+        if rect.x_length() <= 1:
+            return []
+        if self.is_src and rect.x_length() >= 4:
+            return get_all_child_nodes_in_rect3d(rect)
+        return get_child_nodes_in_rect3d(rect)
 
-    def _find_containing_range_covers_helper(
-        self, rect: Rect3D, point: Point3D
-    ) -> Set[Rect3D]:
+    def find_containing_range_covers(self, point: Point3D) -> Set[Rect3D]:
         result = set()
-        children_rect = self.qdag_dict[rect]
-        #print(rect, ":", children_rect)
-        for child in children_rect:
-            if child.contains_point(point):
-                # recur on containing child and add to overall result list
-                subresult = self._find_containing_range_covers_helper(child, point)
-                subresult.add(child)
-                result.update(subresult)
+        for level in range(self.height + 1):
+            side = 1 << level
+            for start_x in qdag_level_starts(point.x, level, self.max_domain, self.is_src):
+                for start_y in qdag_level_starts(point.y, level, self.max_domain, self.is_src):
+                    for start_z in qdag_level_starts(point.z, level, self.max_domain, self.is_src):
+                        result.add(
+                            Rect3D(
+                                Point3D(start_x, start_y, start_z),
+                                Point3D(start_x + side, start_y + side, start_z + side),
+                            )
+                        )
         return result
 
     def get_single_range_cover(self, query: Rect3D) -> Rect3D:
-        ### print("src:", query)
-        query = Rect3D(
-            query.start,
-            Point3D(query.end_x() + 1, query.end_y() + 1, query.end_z() + 1),
-        )
-        longest_side_length = max(query.x_length(), query.y_length(), query.z_length())
-        ### print("longest_side_length", longest_side_length)
-
-        # Find the next highest power of 2 closest to the longest side length.
-        # This is the side length of the range cover that we should pick (i.e.
-        # the smallest range that covers the entire query):
-        next_power_of_2 = 1
-        while next_power_of_2 < longest_side_length:
-            next_power_of_2 *= 2
-
-        if next_power_of_2 == 1:
-            p1 = query.start
-            p2 = Point3D(query.end_x(), query.end_y(), query.end_z())
-            return Rect3D(p1, p2)
-
-        # Find the lower-left point of the range cover by finding the nearest
-        # multiple of (next_power_of_2 / 2):
-        offset_multiple = next_power_of_2 // 2
-        ### print("offset_multiple", offset_multiple)
-        return self._get_single_range_cover_helper(
-            query, next_power_of_2, offset_multiple
-        )
-
-
-    def _get_single_range_cover_helper(
-        self, query: Rect3D, next_power_of_2: int, offset_multiple: int
-    ) -> Rect3D:
-        root_rect = self.qdag_dict[QDAG_ROOT][0]
-        # print("next_power_of_2", next_power_of_2)
-        # print("offset_multiple", offset_multiple)
-
-        # This is integer division:
-        left_cover_start_x = (
-            math.floor(query.start_x() / float(offset_multiple)) * offset_multiple
-        )
-        left_cover_start_y = (
-            math.floor(query.start_y() / float(offset_multiple)) * offset_multiple
-        )
-        left_cover_start_z = (
-            math.floor(query.start_z() / float(offset_multiple)) * offset_multiple
-        )
-
-        left_cover_end_x = left_cover_start_x + next_power_of_2
-        left_cover_end_y = left_cover_start_y + next_power_of_2
-        left_cover_end_z = left_cover_start_z + next_power_of_2
-
-        # Otherwise, try to shift the rectangle the other way:
-        right_cover_end_x = (
-            math.ceil(query.end_x() / float(offset_multiple)) * offset_multiple
+        """
+        Returns the smallest QDAG node covering `query`, whose end corner is
+        inclusive. For each side length 2^k, starting from the smallest one
+        that fits the query, each axis independently takes the start aligned
+        (to a multiple of 2^(k - 1)) at or before the query start if that
+        covers the query, and the one ending at or after the query end
+        otherwise.
+        """
+        side, cover = self._single_range_cover(
+            (query.start_x(), query.start_y(), query.start_z()),
+            (query.end_x() + 1, query.end_y() + 1, query.end_z() + 1),
         )
-        right_cover_end_y = (
-            math.ceil(query.end_y() / float(offset_multiple)) * offset_multiple
-        )
-        right_cover_end_z = (
-            math.ceil(query.end_z() / float(offset_multiple)) * offset_multiple
-        )
-
-        right_cover_start_x = right_cover_end_x - next_power_of_2
-        right_cover_start_y = right_cover_end_y - next_power_of_2
-        right_cover_start_z = right_cover_end_z - next_power_of_2
-
-        x_covers = [
-            (left_cover_start_x, left_cover_end_x),
-            (right_cover_start_x, right_cover_end_x),
-        ]
-        y_covers = [
-            (left_cover_start_y, left_cover_end_y),
-            (right_cover_start_y, right_cover_end_y),
-        ]
-        z_covers = [
-            (left_cover_start_z, left_cover_end_z),
-            (right_cover_start_z, right_cover_end_z),
-        ]
-        for start_x, end_x in x_covers:
-            for start_y, end_y in y_covers:
-                for start_z, end_z in z_covers:
-                    cover_start = Point3D(start_x, start_y, start_z)
-                    cover_end = Point3D(end_x, end_y, end_z)
-                    result_rect = Rect3D(cover_start, cover_end)
-                    if result_rect in root_rect and query in result_rect:
-                        return result_rect
-
-        return self._get_single_range_cover_helper(
-            query, next_power_of_2 * 2, offset_multiple * 2
-        )
-
-    @classmethod
-    def _build_quad_tree_src(
-        cls, height: int, is_src: bool
-    ) -> Dict[Rect3D, List[Rect3D]]:
-        root_rect = Rect3D(
-            Point3D(0, 0, 0), Point3D(2 ** height, 2 ** height, 2 ** height)
+        return Rect3D(Point3D(*cover), Point3D(*(start + side for start in cover)))
+
+    def _single_range_cover(self, starts: Tuple[int, ...], ends: Tuple[int, ...]):
+        longest_side_length = max(end - start for start, end in zip(starts, ends))
+        level = (longest_side_length - 1).bit_length()
+        if level == 0:
+            return 1, starts
+
+        while level <= self.height:
+            side, shift = 1 << level, level - 1
+            cover = []
+            for start, end in zip(starts, ends):
+                left = (start >> shift) << shift
+                right = (((end + side // 2 - 1) >> shift) << shift) - side
+                if left + side <= self.max_domain and end <= left + side:
+                    cover.append(left)
+                elif right >= 0 and right <= start:
+                    cover.append(right)
+                else:
+                    break
+            else:
+                return side, tuple(cover)
+            level += 1
+
+        raise ValueError("Query is not inside the QDAG domain")
+
+    def node_id(self, rect: Rect3D) -> int:
+        """
+        Numbers the nodes of the SRC QDAG level by level: the node of side
+        2^k starting at step * (gx, gy, gz) has id
+        offset_k + (gx * n_k + gy) * n_k + gz, where n_k is the number of
+        starts per axis at that level.
+        """
+        level = rect.x_length().bit_length() - 1
+        step, count = qdag_level_grid(level, self.max_domain)
+        grid_x, grid_y, grid_z = (
+            rect.start_x() // step, rect.start_y() // step, rect.start_z() // step
         )
-        qdag = cls._build_quad_tree_src_helper(height, root_rect, is_src)
-        qdag[QDAG_ROOT] = [root_rect]
-        return qdag
-
-    @classmethod
-    def _build_quad_tree_src_helper(
-        cls, height: int, bounding_box: Rect3D, is_src: bool
-    ) -> Dict[Rect3D, List[Rect3D]]:
-        if height <= 0:
-            result = {}
-            result[bounding_box] = []
-            return result
-
-        edge_dictionary = {}
-        side_length = 2 ** height
-
-        # If height >= 2, we need to make the in-between nodes for SRC:
-        child_rects = []
-        if height >= 2:
-            child_rects = get_all_child_nodes_in_rect3d(bounding_box)
-        else:
-            child_rects = get_child_nodes_in_rect3d(bounding_box)
-
-        if not is_src:
-            child_rects = get_child_nodes_in_rect3d(bounding_box)
-
-
-        main_dict = {}
-        main_dict[bounding_box] = child_rects
-
-        for child_rect in child_rects:
-            child_dict = cls._build_quad_tree_src_helper(height - 1, child_rect, is_src)
-            # Merge the two dicts together:
-            main_dict.update(child_dict)
-
-        return main_dict
+        return self._level_offsets[level] + (grid_x * count + grid_y) * count + grid_z
+
+    def node_rect(self, node_id: int) -> Rect3D:
+        offsets = self._level_offsets
+        level = next(k for k in range(self.height + 1) if node_id < offsets[k + 1])
+        step, count = qdag_level_grid(level, self.max_domain)
+        rest, grid_z = divmod(node_id - offsets[level], count)
+        grid_x, grid_y = divmod(rest, count)
+        side = 1 << level
+        start = Point3D(grid_x * step, grid_y * step, grid_z * step)
+        return Rect3D(start, Point3D(start.x + side, start.y + side, start.z + side))
+
+    def get_single_range_cover_ids(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Batched get_single_range_cover: takes (n, 3) arrays of query start
+        and (inclusive) end corners and returns the node_id of every cover.
+        """
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1, 3)
+        ends = np.asarray(ends, dtype=np.int64).reshape(-1, 3) + 1
+        longest_side_length = (ends - starts).max(axis=1)
+        levels = np.frexp(np.maximum(longest_side_length - 1, 0).astype(np.float64))[1]
+
+        offsets = self._level_offsets
+        ids = np.full(len(starts), -1, dtype=np.int64)
+        leaves = levels == 0
+        ids[leaves] = (
+            starts[leaves, 0] * self.max_domain + starts[leaves, 1]
+        ) * self.max_domain + starts[leaves, 2]
+
+        pending = ~leaves
+        for level in range(1, self.height + 1):
+            side, shift = 1 << level, level - 1
+            step, count = qdag_level_grid(level, self.max_domain)
+            rows = np.flatnonzero(pending & (levels <= level))
+
+            left = (starts[rows] >> shift) << shift
+            left_ok = (left + side <= self.max_domain) & (ends[rows] <= left + side)
+            right = (((ends[rows] + side // 2 - 1) >> shift) << shift) - side
+            right_ok = (right >= 0) & (right <= starts[rows])
+
+            cover = np.where(left_ok, left, right) // step
+            found = (left_ok | right_ok).all(axis=1)
+            rows, cover = rows[found], cover[found]
+            ids[rows] = offsets[level] + (cover[:, 0] * count + cover[:, 1]) * count + cover[:, 2]
+            pending[rows] = False
+
+        if pending.any():
+            raise ValueError("Query is not inside the QDAG domain")
+        return ids
 
 
 def get_all_child_nodes_in_rect3d(rect: Rect3D) -> List[Rect3D]:
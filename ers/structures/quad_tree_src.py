@@ -18,12 +18,9 @@
 from .rect import Rect
 from .point import Point
 
-from typing import Dict, List, Set
-
-import math
-
-QDAG_ROOT = "__root__"
+from typing import List, Set, Tuple
 
+import numpy as np
 
 def get_quad_divisions(rect: Rect) -> List[Rect]:
     """
@@ -107,146 +104,186 @@ def get_intermediate_divisions(rect: Rect) -> List[Rect]:
     return [north, south, west, east, center]
 
 
+def qdag_level_starts(coord: int, level: int, max_domain: int, is_src: bool) -> List[int]:
+    """
+    Returns the start coordinates (along one axis) of the level-`level` QDAG
+    nodes whose extent contains `coord`.
+    """
+    side = 1 << level
+    if level == 0 or not is_src:
+        return [(coord >> level) << level]
+
+    step = side >> 1
+    starts = []
+    for multiple in ((coord // step) - 1, coord // step):
+        start = multiple * step
+        if start >= 0 and start + side <= max_domain:
+            starts.append(start)
+    return starts
+
+
+def qdag_level_grid(level: int, max_domain: int) -> Tuple[int, int]:
+    """
+    Returns the start step and the number of starts per axis of the level-
+    `level` nodes of an SRC QDAG.
+    """
+    step = 1 if level == 0 else 1 << (level - 1)
+    return step, (max_domain - (1 << level)) // step + 1
+
+
+def qdag_level_offsets(height: int, num_axes: int) -> List[int]:
+    """
+    Returns the id of the first node of every level of an SRC QDAG over
+    [0, 2^height)^num_axes, followed by the total number of nodes.
+    """
+    max_domain = 2 ** height
+    offsets = [0]
+    for level in range(height + 1):
+        offsets.append(offsets[-1] + qdag_level_grid(level, max_domain)[1] ** num_axes)
+    return offsets
+
+
 class QuadTreeSRC:
+    """
+    A QDAG over the square domain [0, 2^height)^2, represented implicitly.
+
+    Every node is a square Rect of side 2^k (start inclusive, end exclusive).
+    The level-k nodes (k >= 1) of an SRC QDAG are exactly the squares whose
+    start coordinates are multiples of 2^(k - 1), i.e. the quad tree
+    divisions plus the intermediate nodes that straddle them; level 0 is
+    the unit cells. Without SRC only the aligned quad tree squares exist.
+    Children and containing covers are therefore computed arithmetically
+    from a node's coordinates and level instead of being stored.
+    """
+
     def __init__(self, height: int, is_src: bool):
+        self.height = height
         self.max_domain = 2 ** height
-        self.qdag_dict = QuadTreeSRC._build_quad_tree_src(height, is_src)
         self.is_src = is_src
+        self.root_rect = Rect(Point(0, 0), Point(self.max_domain, self.max_domain))
+        self._level_offsets = qdag_level_offsets(height, 2)
+
+    def get_children(self, rect: Rect) -> List[Rect]:
+        """
+        Returns the children of a QDAG node: its 4 quad tree divisions and,
+        for SRC nodes of side at least 4, the 5 intermediate nodes.
+        """
+        if rect.x_length() <= 1:
+            return []
+        children = get_quad_divisions(rect)
+        if self.is_src and rect.x_length() >= 4:
+            children += get_intermediate_divisions(rect)
+        return children
 
     def find_containing_range_covers(self, point: Point) -> Set[Rect]:
-        # Start at root:
-        root_rect_list = self.qdag_dict[
-            QDAG_ROOT
-        ]  # Everything is a list, so just grab the first elt
-        recursive_result = self._find_containing_range_covers_helper(
-            root_rect_list[0], point
-        )
-        return set(root_rect_list).union(recursive_result)
-
-    def _find_containing_range_covers_helper(
-        self, rect: Rect, point: Point
-    ) -> Set[Rect]:
         result = set()
-        children_rect = self.qdag_dict[rect]
-        for child in children_rect:
-            if child.contains_point(point):
-                # recur on containing child and add to overall result list
-                subresult = self._find_containing_range_covers_helper(child, point)
-                subresult.add(child)
-                result.update(subresult)
+        for level in range(self.height + 1):
+            side = 1 << level
+            for start_x in qdag_level_starts(point.x, level, self.max_domain, self.is_src):
+                for start_y in qdag_level_starts(point.y, level, self.max_domain, self.is_src):
+                    result.add(
+                        Rect(
+                            Point(start_x, start_y),
+                            Point(start_x + side, start_y + side),
+                        )
+                    )
         return result
 
     def get_single_range_cover(self, query: Rect) -> Rect:
-        ### print("src:", query)
-        query = Rect(query.start, Point(query.end_x() + 1, query.end_y() + 1))
-        longest_side_length = max(query.x_length(), query.y_length())
-        ### print("longest_side_length", longest_side_length)
-
-        # Find the next highest power of 2 closest to the longest side length.
-        # This is the side length of the range cover that we should pick (i.e.
-        # the smallest range that covers the entire query):
-        next_power_of_2 = 1
-        while next_power_of_2 < longest_side_length:
-            next_power_of_2 *= 2
-
-        if next_power_of_2 == 1:
-            p1 = query.start
-            p2 = Point(query.end_x(), query.end_y())
-            return Rect(p1, p2)
-
-        # Find the lower-left point of the range cover by finding the nearest
-        # multiple of (next_power_of_2 / 2):
-        offset_multiple = next_power_of_2 // 2
-        ### print("offset_multiple", offset_multiple)
-        return self._get_single_range_cover_helper(
-            query, next_power_of_2, offset_multiple
-        )
-
-    def _get_single_range_cover_helper(
-        self, query: Rect, next_power_of_2: int, offset_multiple: int
-    ) -> Rect:
-        root_rect = self.qdag_dict[QDAG_ROOT][0]
-        ### print("next_power_of_2", next_power_of_2)
-        ### print("offset_multiple", offset_multiple)
-        # This is integer division:
-        cover_start_x = (
-            math.floor(query.start_x() / float(offset_multiple)) * offset_multiple
+        """
+        Returns the smallest QDAG node covering `query`, whose end corner is
+        inclusive. For each side length 2^k, starting from the smallest one
+        that fits the query, the node aligned (to a multiple of 2^(k - 1))
+        at or before the query start is tried, then the one ending at or
+        after the query end, with both axes aligned the same way.
+        """
+        side, start_x, start_y = self._single_range_cover(
+            query.start_x(), query.start_y(), query.end_x() + 1, query.end_y() + 1
         )
-        cover_start_y = (
-            math.floor(query.start_y() / float(offset_multiple)) * offset_multiple
+        return Rect(Point(start_x, start_y), Point(start_x + side, start_y + side))
+
+    def _single_range_cover(self, start_x: int, start_y: int, end_x: int, end_y: int):
+        longest_side_length = max(end_x - start_x, end_y - start_y)
+        level = (longest_side_length - 1).bit_length()
+        if level == 0:
+            return 1, start_x, start_y
+
+        while level <= self.height:
+            side, shift = 1 << level, level - 1
+            # Cover starting at or before the query start:
+            cover_x, cover_y = (start_x >> shift) << shift, (start_y >> shift) << shift
+            if (
+                cover_x + side <= self.max_domain
+                and cover_y + side <= self.max_domain
+                and end_x <= cover_x + side
+                and end_y <= cover_y + side
+            ):
+                return side, cover_x, cover_y
+
+            # Otherwise, cover ending at or after the query end:
+            cover_x = (((end_x + side // 2 - 1) >> shift) << shift) - side
+            cover_y = (((end_y + side // 2 - 1) >> shift) << shift) - side
+            if cover_x >= 0 and cover_y >= 0 and cover_x <= start_x and cover_y <= start_y:
+                return side, cover_x, cover_y
+            level += 1
+
+        raise ValueError("Query is not inside the QDAG domain")
+
+    def node_id(self, rect: Rect) -> int:
+        """
+        Numbers the nodes of the SRC QDAG level by level: the node of side
+        2^k starting at (gx * step, gy * step) has id offset_k + gx * n_k + gy,
+        where n_k is the number of starts per axis at that level.
+        """
+        level = rect.x_length().bit_length() - 1
+        step, count = qdag_level_grid(level, self.max_domain)
+        return (
+            self._level_offsets[level]
+            + (rect.start_x() // step) * count
+            + rect.start_y() // step
         )
-        cover_start = Point(cover_start_x, cover_start_y)
-        ### print("cover_start", cover_start)
-
-        cover_end_x = cover_start_x + next_power_of_2
-        cover_end_y = cover_start_y + next_power_of_2
-        cover_end = Point(cover_end_x, cover_end_y)
-        ### print("cover_end", cover_end)
-
-        result_rect = Rect(cover_start, cover_end)
-        ### print("result_rect", result_rect)
-        ### print("root_rect", root_rect)
-        ### print("query", query)
-        if result_rect in root_rect and query in result_rect:
-            return result_rect
-
-        # Otherwise, try to shift the rectangle the other way:
-        cover_end_x = (
-            math.ceil(query.end_x() / float(offset_multiple)) * offset_multiple
-        )
-        cover_end_y = (
-            math.ceil(query.end_y() / float(offset_multiple)) * offset_multiple
-        )
-        cover_end = Point(cover_end_x, cover_end_y)
-        ### print("cover_end", cover_end)
-
-        cover_start_x = cover_end_x - next_power_of_2
-        cover_start_y = cover_end_y - next_power_of_2
-        cover_start = Point(cover_start_x, cover_start_y)
-        ### print("cover_start", cover_start)
-
-        result_rect = Rect(cover_start, cover_end)
-        if result_rect in root_rect and query in result_rect:
-            return result_rect
-        else:
-            return self._get_single_range_cover_helper(
-                query, next_power_of_2 * 2, offset_multiple * 2
-            )
-
-    @classmethod
-    def _build_quad_tree_src(cls, height: int, is_src: bool) -> Dict[Rect, List[Rect]]:
-        root_rect = Rect(Point(0, 0), Point(2 ** height, 2 ** height))
-        qdag = cls._build_quad_tree_src_helper(height, root_rect, is_src)
-        qdag[QDAG_ROOT] = [root_rect]
-        return qdag
-
-    @classmethod
-    def _build_quad_tree_src_helper(
-        cls, height: int, bounding_box: Rect, is_src: bool
-    ) -> Dict[Rect, List[Rect]]:
-        if height <= 0:
-            result = {}
-            result[bounding_box] = []
-            return result
-
-        edge_dictionary = {}
-        side_length = 2 ** height
-
-        quad_divisions = get_quad_divisions(bounding_box)
-
-        # If height >= 2, we need to make the in-between nodes for SRC:
-        intermediate_divisions = []
-        if is_src and height >= 2:
-            intermediate_divisions = get_intermediate_divisions(bounding_box)
-
-        child_rects = quad_divisions + intermediate_divisions
-
-        main_dict = {}
-        main_dict[bounding_box] = child_rects
-
-        for child_rect in child_rects:
-            child_dict = cls._build_quad_tree_src_helper(height - 1, child_rect, is_src)
-            # Merge the two dicts together:
-            main_dict.update(child_dict)
-
-        return main_dict
\ No newline at end of file
+
+    def node_rect(self, node_id: int) -> Rect:
+        offsets = self._level_offsets
+        level = next(k for k in range(self.height + 1) if node_id < offsets[k + 1])
+        step, count = qdag_level_grid(level, self.max_domain)
+        grid_x, grid_y = divmod(node_id - offsets[level], count)
+        side = 1 << level
+        start = Point(grid_x * step, grid_y * step)
+        return Rect(start, Point(start.x + side, start.y + side))
+
+    def get_single_range_cover_ids(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Batched get_single_range_cover: takes (n, 2) arrays of query start
+        and (inclusive) end corners and returns the node_id of every cover.
+        """
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.int64).reshape(-1, 2) + 1
+        longest_side_length = (ends - starts).max(axis=1)
+        levels = np.frexp(np.maximum(longest_side_length - 1, 0).astype(np.float64))[1]
+
+        offsets = self._level_offsets
+        ids = np.full(len(starts), -1, dtype=np.int64)
+        leaves = levels == 0
+        ids[leaves] = starts[leaves, 0] * self.max_domain + starts[leaves, 1]
+
+        pending = ~leaves
+        for level in range(1, self.height + 1):
+            side, shift = 1 << level, level - 1
+            step, count = qdag_level_grid(level, self.max_domain)
+            rows = np.flatnonzero(pending & (levels <= level))
+
+            left = (starts[rows] >> shift) << shift
+            left_ok = ((left + side <= self.max_domain) & (ends[rows] <= left + side)).all(axis=1)
+            right = (((ends[rows] + side // 2 - 1) >> shift) << shift) - side
+            right_ok = ((right >= 0) & (right <= starts[rows])).all(axis=1)
+
+            cover = np.where(left_ok[:, None], left, right)
+            found = left_ok | right_ok
+            rows, cover = rows[found], cover[found]
+            ids[rows] = offsets[level] + (cover[:, 0] // step) * count + cover[:, 1] // step
+            pending[rows] = False
+
+        if pending.any():
+            raise ValueError("Query is not inside the QDAG domain")
+        return ids
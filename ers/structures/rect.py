@@ -15,24 +15,30 @@
 ## limitations under the License.
 ##
 
-import functools
+import operator
 import math
 
 from .point import Point
 
 
-@functools.total_ordering
-class Rect:
-    def __init__(self, start: Point, end: Point):
+class Rect(tuple):
+    __slots__ = ()
+
+    def __new__(cls, start: Point, end: Point):
         """
         Creates a rectangle bounded by the points `start` (inclusive) and
-        `end` (exclusive).
+        `end` (exclusive). Like points, rects are immutable (start, end)
+        tuples.
         """
-        self.start = start
-        self.end = end
-
-        if (self.start.x > self.end.x) or (self.start.y > self.end.y):
+        if (start.x > end.x) or (start.y > end.y):
             raise ValueError
+        return tuple.__new__(cls, (start, end))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    start = property(operator.itemgetter(0))
+    end = property(operator.itemgetter(1))
 
     def __str__(self):
         return "Rect[" + str(self.start) + ", " + str(self.end) + "]"
@@ -40,19 +46,23 @@ class Rect:
     def __repr__(self):
         return str(self)
 
-    def __hash__(self):
-        return hash((self.start, self.end))
-
-    def __eq__(self, other):
-        if not isinstance(other, Rect):
-            return False
-        return self.start == other.start and self.end == other.end
-
     def __lt__(self, other):
         if not isinstance(other, Rect):
             return NotImplemented
         return self.start < other.start and self.end < other.end
 
+    def __le__(self, other):
+        result = self.__lt__(other)
+        return result if result is NotImplemented else result or self == other
+
+    def __gt__(self, other):
+        result = self.__le__(other)
+        return result if result is NotImplemented else not result
+
+    def __ge__(self, other):
+        result = self.__lt__(other)
+        return result if result is NotImplemented else not result
+
     def __contains__(self, other):
         if isinstance(other, Point):
             return self.contains_point(other)
@@ -17,26 +17,27 @@
 
 from .point_3d import Point3D
 
-import functools
+import operator
 import math
 
 
-@functools.total_ordering
-class Rect3D:
-    def __init__(self, start: Point3D, end: Point3D):
+class Rect3D(tuple):
+    __slots__ = ()
+
+    def __new__(cls, start: Point3D, end: Point3D):
         """
         Creates a rectangle bounded by the points `start` (inclusive) and
-        `end` (exclusive).
+        `end` (exclusive). Immutable, like Rect.
         """
-        self.start = start
-        self.end = end
-
-        if (
-            (self.start.x > self.end.x)
-            or (self.start.y > self.end.y)
-            or (self.start.z > self.end.z)
-        ):
+        if (start.x > end.x) or (start.y > end.y) or (start.z > end.z):
             raise ValueError
+        return tuple.__new__(cls, (start, end))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    start = property(operator.itemgetter(0))
+    end = property(operator.itemgetter(1))
 
     def __str__(self):
         return "Rect3D[" + str(self.start) + ", " + str(self.end) + "]"
@@ -44,19 +45,23 @@ class Rect3D:
     def __repr__(self):
         return str(self)
 
-    def __hash__(self):
-        return hash((self.start, self.end))
-
-    def __eq__(self, other):
-        if not isinstance(other, Rect3D):
-            return False
-        return self.start == other.start and self.end == other.end
-
     def __lt__(self, other):
         if not isinstance(other, Rect3D):
             return NotImplemented
         return self.start < other.start and self.end < other.end
 
+    def __le__(self, other):
+        result = self.__lt__(other)
+        return result if result is NotImplemented else result or self == other
+
+    def __gt__(self, other):
+        result = self.__le__(other)
+        return result if result is NotImplemented else not result
+
+    def __ge__(self, other):
+        result = self.__lt__(other)
+        return result if result is NotImplemented else not result
+
     def __contains__(self, other):
         if isinstance(other, Point3D):
             return self.contains_point(other)
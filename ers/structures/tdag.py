@@ -14,75 +14,111 @@
 ## See the License for the specific language governing permissions and
 ## limitations under the License.
 ##
+from typing import List, Optional, Tuple
 
-from typing import List, Tuple
-
-import functools
+import numpy as np
 
 
 class Tdag:
-    def __init__(self, left, right, mid, rng, height):
-        self.left = left
-        self.right = right
-        self.middle = mid
-        self.range = rng
+    """
+    A TDAG over the domain [0, 2^height - 1] with integer node ids.
+
+    The dyadic node covering [i * 2^l, (i + 1) * 2^l - 1] has heap id
+    h = 2^(height - l) + i (the root is 1 and the children of h are 2h and
+    2h + 1); its TDAG id is 2h. Every dyadic node of width w >= 4 also has a
+    middle node [lo + w/4, lo + 3w/4 - 1] that straddles its two children,
+    with TDAG id 2h + 1. Covers and paths are computed from the bits of the
+    endpoints, without materializing the DAG.
+    """
+
+    def __init__(self, height: int):
         self.height = height
+        self.range = (0, (1 << height) - 1)
 
+    def node_id(self, level: int, index: int, middle: bool = False) -> int:
+        return 2 * ((1 << (self.height - level)) + index) + int(middle)
 
-    def get_single_range_cover(self, query_range: Tuple[int, int]) -> Tuple[int, int]:
-        q = self.get_single_range_cover_helper(query_range)
-        return q
-
-    def get_single_range_cover_helper(self, query_range: Tuple[int, int]) -> Tuple[int, int]:
-        if self.interval_contains_interval(self.range, query_range):
-            left = None
-            right = None
-            middle = None
-            if self.middle and self.left and self.right:
-                if self.interval_contains_interval(self.middle, query_range):
-                    if (not self.interval_contains_interval(self.left.range, query_range)) and (not self.interval_contains_interval(self.right.range, query_range)):
-                        return self.middle
-            if self.left:
-                left = self.left.get_single_range_cover_helper(query_range)
-            if self.right:
-                right = self.right.get_single_range_cover_helper(query_range)
-            if left is None:
-                if right is None:
-                    return self.range
-                else:
-                    return right
-            else:
-                return left
-
-        else:
+    def node_range(self, node_id: int) -> Tuple[int, int]:
+        heap_id, middle = node_id >> 1, node_id & 1
+        level = self.height - (heap_id.bit_length() - 1)
+        lo = (heap_id - (1 << (self.height - level))) << level
+        width = 1 << level
+        if middle:
+            return (lo + width // 4, lo + 3 * width // 4 - 1)
+        return (lo, lo + width - 1)
+
+    def get_single_range_cover_id(self, query_range: Tuple[int, int]) -> Optional[int]:
+        """
+        Returns the id of the smallest node covering `query_range`: the
+        middle node of the endpoints' lowest common ancestor if it contains
+        the query, the ancestor itself otherwise.
+        """
+        start, end = min(query_range), max(query_range)
+        if not self.interval_contains_interval(self.range, (start, end)):
             return None
 
+        # The lowest common ancestor sits just above the highest bit in which
+        # the two endpoints differ:
+        level = (start ^ end).bit_length()
+        index = start >> level
+        if level >= 2:
+            quarter = 1 << (level - 2)
+            lo = index << level
+            if lo + quarter <= start and end <= lo + 3 * quarter - 1:
+                return self.node_id(level, index, middle=True)
+        return self.node_id(level, index)
 
-    @classmethod
-    def __init_tree(cls, height: int, left: int, right: int) -> "RangeTree":
-        if height < 0:
-            return None
-        else:
-            midpoint = ((right + left) // 2)
+    def get_single_range_cover(self, query_range: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        node_id = self.get_single_range_cover_id(query_range)
+        return None if node_id is None else self.node_range(node_id)
+
+    def get_single_range_covers(
+        self, starts: np.ndarray, ends: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched get_single_range_cover: returns the (lo, hi) arrays of the
+        covers of the intervals [starts[i], ends[i]]. Raises ValueError if
+        an interval is not inside the domain.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        start, end = np.minimum(starts, ends), np.maximum(starts, ends)
+        if ((start < self.range[0]) | (end > self.range[1])).any():
+            raise ValueError("Interval is not inside the TDAG domain")
 
-            mid_0 = midpoint  - ((right + left) // 4)
-            mid_1 = midpoint  + ((right + left) // 4) +1
+        # frexp gives the bit length of each (exactly representable) xor:
+        level = np.frexp((start ^ end).astype(np.float64))[1].astype(np.int64)
+        lo = (start >> level) << level
+        hi = lo + (np.int64(1) << level) - 1
+        quarter = (np.int64(1) << np.maximum(level - 2, 0))
+        middle = (level >= 2) & (lo + quarter <= start) & (end <= lo + 3 * quarter - 1)
+        return np.where(middle, lo + quarter, lo), np.where(middle, lo + 3 * quarter - 1, hi)
 
-            return cls(
-                cls.__init_tree(height - 1, left, left + int((right - left) / 2)),
-                cls.__init_tree(height - 1, left + int((right - left) / 2) + 1, right),
-                [mid_0, mid_1],
-                (left, right),
-                height,
-            )
+    def get_ancestor_ids(self, value: int) -> List[int]:
+        """
+        Returns the ids of all nodes containing `value`, from the root down
+        to its leaf, each middle node right after its dyadic parent.
+        """
+        result = []
+        for level in range(self.height, -1, -1):
+            index = value >> level
+            result.append(self.node_id(level, index))
+            if level >= 2:
+                quarter = 1 << (level - 2)
+                offset = value - (index << level)
+                if quarter <= offset < 3 * quarter:
+                    result.append(self.node_id(level, index, middle=True))
+        return result
+
+    def get_ancestor_ranges(self, value: int) -> List[Tuple[int, int]]:
+        return [self.node_range(node_id) for node_id in self.get_ancestor_ids(value)]
 
     @classmethod
-    def initialize_tree(cls, height: int) -> "RangeTree":
-        return cls.__init_tree(height, 0, pow(2, height) - 1)
+    def initialize_tree(cls, height: int) -> "Tdag":
+        return cls(height)
 
     @classmethod
     def interval_contains_interval(
         cls, main: Tuple[int, int], secondary: Tuple[int, int]
     ) -> bool:
         return (main[0] <= secondary[0]) and (main[1] >= secondary[1])
-
@@ -25,12 +25,18 @@ from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
+from typing import Iterable, List
+
 import random
 import os
 import math
 import pprint
 import functools
 
+# AES block and CBC IV sizes in bytes:
+BLOCK_LENGTH = 16
+IV_LENGTH = 16
+
 
 def check_type(arg, corr_type, param_name: str, func_name: str) -> None:
     """
@@ -204,6 +210,96 @@ def SymmetricDecrypt(key: bytes, ciphertext: bytes) -> bytes:
     return plaintext
 
 
+class HMACContext:
+    """
+    A SHA-512 HMAC keyed once and reused for many messages.
+
+    The keyed HMAC state is prepared in the constructor and copied for every
+    message, so the key schedule is not recomputed per call as in HMAC().
+    """
+
+    def __init__(self, key: bytes):
+        check_type(key, bytes, "key", "HMACContext")
+        self._hmac = hmac.HMAC(key, hashes.SHA512())
+
+    def digest(self, data: bytes) -> bytes:
+        """
+        Returns: SHA-512 HMAC of data under this context's key (bytes)
+        """
+        h = self._hmac.copy()
+        h.update(data)
+        return h.finalize()
+
+    def digest_many(self, datas: List[bytes]) -> List[bytes]:
+        """
+        Returns: the SHA-512 HMAC of each element of datas, in order
+        """
+        prepared = self._hmac
+        digests = []
+        for data in datas:
+            h = prepared.copy()
+            h.update(data)
+            digests.append(h.finalize())
+        return digests
+
+
+class SymmetricContext:
+    """
+    AES-CBC encryption and decryption under a fixed key.
+
+    Ciphertexts have the same layout as SymmetricEncrypt (PKCS7-padded
+    ciphertext followed by the 16 byte IV), so the two are interchangeable.
+    The bulk methods draw the IVs for a whole list of plaintexts with a
+    single call to SecureRandom.
+    """
+
+    def __init__(self, key: bytes):
+        check_type(key, bytes, "key", "SymmetricContext")
+        self._algorithm = algorithms.AES(key)
+
+    def encrypt(self, plaintext: bytes) -> bytes:
+        return self._encrypt_with_iv(plaintext, SecureRandom(IV_LENGTH))
+
+    def encrypt_many(self, plaintexts: List[bytes]) -> List[bytes]:
+        ivs = SecureRandom(IV_LENGTH * len(plaintexts))
+        return [
+            self._encrypt_with_iv(plaintext, ivs[i * IV_LENGTH : (i + 1) * IV_LENGTH])
+            for i, plaintext in enumerate(plaintexts)
+        ]
+
+    def decrypt(self, ciphertext: bytes) -> bytes:
+        iv = ciphertext[-IV_LENGTH:]
+        decryptor = Cipher(self._algorithm, modes.CBC(iv)).decryptor()
+        padded = decryptor.update(ciphertext[:-IV_LENGTH]) + decryptor.finalize()
+        return _pkcs7_unpad(padded)
+
+    def decrypt_many(self, ciphertexts: Iterable[bytes]) -> List[bytes]:
+        return [self.decrypt(ciphertext) for ciphertext in ciphertexts]
+
+    def _encrypt_with_iv(self, plaintext: bytes, iv: bytes) -> bytes:
+        encryptor = Cipher(self._algorithm, modes.CBC(iv)).encryptor()
+        padded = _pkcs7_pad(plaintext)
+        return encryptor.update(padded) + encryptor.finalize() + iv
+
+
+def _pkcs7_pad(data: bytes) -> bytes:
+    """
+    A helper function that PKCS7-pads data to the AES block size.
+    """
+    pad_length = BLOCK_LENGTH - (len(data) % BLOCK_LENGTH)
+    return data + bytes((pad_length,)) * pad_length
+
+
+def _pkcs7_unpad(data: bytes) -> bytes:
+    """
+    A helper function that strips PKCS7 padding, raising ValueError if the
+    padding is malformed. The padding is checked in constant time by the
+    cryptography unpadder.
+    """
+    unpadder = sym_padding.PKCS7(128).unpadder()
+    return unpadder.update(data) + unpadder.finalize()
+
+
 def SecureRandom(num_bytes: int) -> bytes:
     """
     Given a length, return that many randomly generated bytes. Can be used for an IV or symmetric key.
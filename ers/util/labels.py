@@ -0,0 +1,104 @@
+##
+## Copyright 2022 Zachary Espiritu and Evangelia Anna Markatou and
+##                Francesca Falzon and Roberto Tamassia and William Schor
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##    http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+
+from typing import Sequence, Tuple
+
+import functools
+import struct
+
+# Canonical binary encoding of the plaintext labels stored in an EMM.
+#
+# Every label is a fixed-width record:
+#
+#   kind (uint8) | number of coordinates n (uint8) | n x int32 (little-endian)
+#
+# The kind tag keeps labels of different node types apart even when they
+# have the same number of coordinates (e.g. a pair of intervals and a 2D
+# rectangle are both four integers).
+KIND_POINT = 1      # a domain point: (x, y, ...)
+KIND_INTERVALS = 2  # a product of 1D intervals: (lo_x, hi_x, lo_y, hi_y, ...)
+KIND_RECT = 3       # a rectangle/box by its corners: (start..., end...)
+
+KIND_NAMES = {
+    KIND_POINT: "Point",
+    KIND_INTERVALS: "Intervals",
+    KIND_RECT: "Rect",
+}
+
+_HEADER = struct.Struct("<BB")
+
+
+@functools.lru_cache(maxsize=None)
+def _label_struct(num_coords: int) -> struct.Struct:
+    return struct.Struct(f"<BB{num_coords}i")
+
+
+def encode_point(*coords: int) -> bytes:
+    """
+    Encodes a domain point given by its coordinates.
+    """
+    return _label_struct(len(coords)).pack(KIND_POINT, len(coords), *coords)
+
+
+def encode_intervals(*intervals: Sequence[int]) -> bytes:
+    """
+    Encodes a node given as a product of 1D intervals, e.g. a range tree
+    node ([lo_x, hi_x], [lo_y, hi_y]).
+    """
+    coords = [bound for interval in intervals for bound in interval]
+    return _label_struct(len(coords)).pack(KIND_INTERVALS, len(coords), *coords)
+
+
+def encode_rect(start: Sequence[int], end: Sequence[int]) -> bytes:
+    """
+    Encodes a rectangle (or box) given by the coordinates of its start and
+    end corners.
+    """
+    num_coords = len(start) + len(end)
+    return _label_struct(num_coords).pack(KIND_RECT, num_coords, *start, *end)
+
+
+def decode_label(label: bytes) -> Tuple[int, Tuple[int, ...]]:
+    """
+    Decodes a label produced by one of the encoders above.
+
+    Returns: a (kind, coordinates) tuple, where coordinates is the flat
+             tuple of integers that was encoded.
+    """
+    kind, num_coords = _HEADER.unpack_from(label)
+    if kind not in KIND_NAMES:
+        raise ValueError(f"Unknown label kind: {kind}")
+    values = _label_struct(num_coords).unpack(label)
+    return kind, values[2:]
+
+
+def describe_label(label: bytes) -> str:
+    """
+    A helper function that gives a human-readable representation of a label
+    for debugging.
+    """
+    kind, coords = decode_label(label)
+    if kind == KIND_POINT:
+        body = ", ".join(map(str, coords))
+    elif kind == KIND_INTERVALS:
+        body = ", ".join(
+            f"[{coords[i]}, {coords[i + 1]}]" for i in range(0, len(coords), 2)
+        )
+    else:
+        half = len(coords) // 2
+        body = f"{coords[:half]}, {coords[half:]}"
+    return f"{KIND_NAMES[kind]}({body})"